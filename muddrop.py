@@ -1,1099 +1,3614 @@
-import elementtree.ElementTree as ET
-import exceptions
-import re
-import optparse
-import sys, os
-import base64
-import time
-import md5
-from twisted.internet.protocol import Protocol, ClientCreator, ServerFactory
-from twisted.protocols.basic import LineReceiver
-from twisted.internet import reactor
-
-AC_DISCONNECTED = 0
-AC_CONNECTING = 1
-AC_CONNECTED = 2
-
-class Formatting:
-    """Various text formatting functions."""
-    def __init__(self):
-        self.strANSICodes = r"(?:\x1b\[(?:(?:\d+(?:|;))*[fHpm]|\=\d*[hl]|\d*[ABCDJKknsu])|\xff(\xfb|\xfc)\x01)"
-
-    def fnExpandRE(self, strText, reObject, dicVariables = {}):
-        """Expand text according to the regular expression result."""
-        intCounter = 1
-        strReplaced = strText
-
-        lstVariables = re.findall("@([a-z][a-z0-9\_]*)", strReplaced.lower(), re.IGNORECASE)
-        for strVariable in lstVariables:
-            try:
-                strValue = dicVariables[strVariable]
-            except KeyError:
-                strValue = ""
-            strReplaced = re.sub("(?i)@%s" % strVariable, str(strValue), strReplaced)
-
-        lstMatches = reObject.groups()
-        for intCounter in range(len(lstMatches)):
-            if lstMatches[intCounter] == None:
-                strMatch = ""
-            else:
-                strMatch = lstMatches[intCounter]
-            strReplaced = strReplaced.replace("\\g<%s>" % (intCounter + 1), strMatch)
-        for strGroup, strMatch in reObject.groupdict().items():
-            if strMatch == None:
-                strMatch = ""
-            strReplaced = strReplaced.replace("\\g<%s>" % strGroup, strMatch)
-
-        return reObject.expand(strReplaced)
-
-    def fnGetLineBeginning(self, strLine, intStart):
-        """Find the actual beginning of a match object in the line that includes
-           the ANSI codes."""
-
-        itrRe = re.finditer(self.strANSICodes, strLine)
-
-        for reMatch in itrRe:
-            tplMatch = reMatch.span()
-            if tplMatch[0] <= intStart:
-                intStart += tplMatch[1] - tplMatch[0]
-
-        return intStart
-
-    def fnTrimNewline(self, strText):
-        """Trim the final newlines from a string."""
-        if strText.endswith("\r\n") or strText.endswith("\n\r"):
-            return strText[:-2]
-        elif strText.endswith("\n"):
-            return strText[:-1]
-        else:
-            return strText
-
-    def fnStripANSI(self, strText):
-        """Strip various ANSI codes from the input."""
-        return re.sub(self.strANSICodes, "", strText)
-
-    def fnGetStyle(self, strLine, intStart):
-        """Return the ANSI codes for the matching line."""
-        # NOTE: It does not appear that the MUD sends a 0 every time it
-        # wants to reset the style. Rather, it assumes that styles are
-        # reset whenever it sends a new escape sequence (for example,
-        # \x1b[m sets the text to white on black), so we will just use
-        # the last style sent.
-        reANSI = re.compile(r"\x1b\[(?:(\d+)(?:|;))?(?:(\d+)(?:|;))?(?:(\d+)(?:|;))?(?:(\d+)(?:|;))?(?:(\d+)(?:|;))?m")
-        # Return all the styles of the line.
-        lstTempStyles = reANSI.findall(strLine[0:intStart])
-        if lstTempStyles == []:
-            return None
-
-        lstTempStyles = lstTempStyles[-1]
-        lstStyles = [int(strNumber) for strNumber in lstTempStyles if strNumber != ""]
-        # If there are no foreground/background styles, insert the
-        # "white on black" default.
-        blnForeground = False
-        blnBackground = False
-        for intStyle in lstStyles:
-            if 30 <= intStyle <= 37:
-                blnForeground = True
-            if 40 <= intStyle <= 47:
-                blnBackground = True
-        if not blnForeground:
-            lstStyles.append(37)
-        if not blnBackground:
-            lstStyles.append(40)
-        return lstStyles
-
-    def fnExpandMacros(self, strText, insMUDdrop, strIP = "?"):
-        """Expand various macros such as the time, server, etc."""
-        strText = strText.replace("%server", insMUDdrop.cnfConfiguration.strHost)
-        strText = strText.replace("%name", insMUDdrop.cnfConfiguration.strName)
-        strText = strText.replace("%rport", str(insMUDdrop.cnfConfiguration.intPort))
-        strText = strText.replace("%lport", str(insMUDdrop.cnfConfiguration.intLocalPort))
-        strText = strText.replace("%rip", strIP)
-        strText = time.strftime(strText)
-        return strText
-
-    def fnRegexpify(self, strText):
-        """Convert a standard MUSHClient trigger to a regular expression."""
-        strText = re.sub(r"([\[\]\-\=\_\+\"\'\;\:\/\?\\\.\>\,\<\!\@\#\$\%\^\&\*\(\)\|])", r"\\\1", strText)
-        return "^%s$" % strText
-
-class MUDdrop:
-    def init(self, strFilename):
-        """Initialise stuff."""
-        self.strBuffer = ""
-        self.fmFormatting = Formatting()
-        self.stConnectionState = AC_DISCONNECTED
-        # Remote user connection.
-        self.cntClientConnection = None
-        self.lstLastStyle = [37, 40]
-        # We need the init() function (instead of __init__) for the call
-        # below to work, otherwise mdBot will not exist yet and we won't
-        # be able to call it.
-        self.cnfConfiguration = Configuration(strFilename)
-        # Execute the plugins' OnPluginInstall callback.
-        self.fnHandleTimers()
-        self.cntConnection = MUDConnection(self.cnfConfiguration.strHost, self.cnfConfiguration.intPort)
-        mdBot.fnCallPluginFunction("OnPluginInstall", ())
-
-    def fnSavePlugins(self):
-        """Save all the plugins' states."""
-        for plgPlugin in self.cnfConfiguration.dicPlugins.values():
-            plgPlugin.savestate()
-
-    def fnExecCode(self, strCode, plgPlugin):
-        """Execute some code."""
-        try:
-            exec(strCode, {"world": Callbacks(plgPlugin)})
-        except:
-            self.fnException(sys.exc_type, sys.exc_value, sys.exc_traceback)
-
-    def fnCallPluginFunction(self, strFunctionCall, tplArguments):
-        """Call the specified function in all plugins."""
-        for plgPlugin in self.cnfConfiguration.dicPlugins.values():
-            plgPlugin.run(strFunctionCall, tplArguments, True)
-
-    def fnExit(self):
-        """Handle exiting."""
-        self.fnSavePlugins()
-        if mdBot.cntConnection != None:
-            mdBot.cntConnection.close()
-        reactor.stop()
-        self = None
-
-    def fnHandleTimers(self):
-        blnActiveTimers = False
-        for plgPlugin in self.cnfConfiguration.dicPlugins.values():
-            for tmrTimer in plgPlugin.lstTimers:
-                if not tmrTimer.blnEnabled:
-                    continue
-                try:
-                    if not mdBot.cntConnection and not tmrTimer.blnActiveClosed:
-                        continue
-                except:
-                    pass
-                blnActiveTimers = True
-                fltNewTime = time.time()
-                if fltNewTime > tmrTimer.fltTime + tmrTimer.intHour * 3600 + tmrTimer.intMinute * 60 + tmrTimer.intSecond:
-                    if tmrTimer.intSendTo == 0:
-                        if mdBot.cntConnection != None:
-                            self.fnSendData(tmrTimer.strSend)
-                    elif tmrTimer.intSendTo == 12:
-                        self.fnExecCode(tmrTimer.strSend, plgPlugin)
-                    if tmrTimer.blnOneShot:
-                        plgPlugin.lstTimers.remove(tmrTimer)
-                    else:
-                        tmrTimer.fltTime = fltNewTime
-                    # Check scripting.
-                    if tmrTimer.strScript != "":
-                        # We need a tuple, hence the comma
-                        plgPlugin.run(tmrTimer.strScript, (tmrTimer.strName, ))
-        if blnActiveTimers or mdBot.cntConnection:
-            reactor.callLater(1, self.fnHandleTimers)
-        else:
-            reactor.stop()
-
-    def fnMatchTriggers(self, strData):
-        lstLastStyle = self.fmFormatting.fnGetStyle(strData, len(strData))
-        if lstLastStyle != None:
-            self.lstLastStyle = lstLastStyle
-        for plgPlugin in self.cnfConfiguration.dicPlugins.values():
-            for ciTrigger in plgPlugin.lstTriggers:
-                if not ciTrigger.blnEnabled:
-                    continue
-
-                # Strip ANSI if necessary
-                if ciTrigger.blnKeepANSI:
-                    reResult = ciTrigger.reTrigger.search(strData)
-                else:
-                    reResult = ciTrigger.reTrigger.search(self.fmFormatting.fnStripANSI(strData))
-
-                if reResult != None:
-                    if not ciTrigger.blnKeepANSI:
-                        intStart = self.fmFormatting.fnGetLineBeginning(strData, reResult.start(0))
-                        lstLineStyle = self.fmFormatting.fnGetStyle(strData, intStart)
-                        if lstLineStyle == None:
-                            lstLineStyle = self.lstLastStyle
-
-                        if ciTrigger.blnMatchBold:
-                            if ciTrigger.blnBold != (1 in lstLineStyle):
-                                continue
-                        if ciTrigger.blnMatchItalic:
-                            if ciTrigger.blnItalic != (3 in lstLineStyle):
-                                continue
-                        if ciTrigger.blnMatchInverse:
-                            if ciTrigger.blnInverse != (7 in lstLineStyle):
-                                continue
-                        if ciTrigger.blnMatchBackColour:
-                            if ciTrigger.intBackColour + 32 not in lstLineStyle:
-                                continue
-                        if ciTrigger.blnMatchTextColour:
-                            if ciTrigger.intTextColour + 22 not in lstLineStyle:
-                                continue
-
-                    if self.cnfConfiguration.blnDebug:
-                        self.fnNoteData("Matched '%s' in %s, groups are %s" % (ciTrigger.strMatch, plgPlugin.strName, reResult.groups()))
-
-                    fmFormatting = Formatting()
-                    # Check "send to".
-                    if ciTrigger.intSendTo == 0:
-                        # If blnExpandVariables is True, return the variables dictionary.
-                        self.fnSendData(fmFormatting.fnExpandRE(ciTrigger.strSend, reResult, (ciTrigger.blnExpandVariables and [plgPlugin.dicVariables] or [{}])[0]))
-                    elif ciTrigger.intSendTo == 12:
-                        self.fnExecCode(fmFormatting.fnExpandRE(ciTrigger.strSend, reResult, (ciTrigger.blnExpandVariables and [plgPlugin.dicVariables] or [{}])[0]), plgPlugin)
-
-                    # Check scripting.
-                    if ciTrigger.strScript != "":
-                        plgPlugin.run(ciTrigger.strScript, (ciTrigger.strName, strData, reResult.groups()))
-                    # Check "keep evaluating".
-                    if not ciTrigger.blnKeepEvaluating:
-                        break
-
-    def fnMatchAliases(self, strData):
-        blnMatched = False
-        for plgPlugin in self.cnfConfiguration.dicPlugins.values():
-            for alsAlias in plgPlugin.lstAliases:
-                if not alsAlias.blnEnabled:
-                    continue
-
-                reResult = alsAlias.reAlias.search(strData)
-
-                if reResult != None:
-                    blnMatched = True
-                    if self.cnfConfiguration.blnDebug:
-                        self.fnNoteData("Matched '%s' in %s, groups are %s" % (alsAlias.strMatch, plgPlugin.strName, reResult.groups()))
-
-                    fmFormatting = Formatting()
-                    # Check "send to".
-                    if alsAlias.intSendTo == 0:
-                        # If blnExpandVariables is True, return the variables dictionary.
-                        strResult = fmFormatting.fnExpandRE(alsAlias.strSend, reResult, (alsAlias.blnExpandVariables and [plgPlugin.dicVariables] or [{}])[0])
-                        if alsAlias.blnEchoAlias:
-                            self.cntClientConnection.fnSend(strResult + "\n")
-                        self.fnSendData(strResult, alsAlias.blnOmitFromLog)
-                    elif alsAlias.intSendTo == 12:
-                        self.fnExecCode(fmFormatting.fnExpandRE(alsAlias.strSend, reResult, (alsAlias.blnExpandVariables and [plgPlugin.dicVariables] or [{}])[0]), plgPlugin)
-
-                    # Check scripting.
-                    if alsAlias.strScript != "":
-                        plgPlugin.run(alsAlias.strScript, (alsAlias.strName, strData, reResult.groups()))
-                    # Check "keep evaluating".
-                    if not alsAlias.blnKeepEvaluating:
-                        break
-        if not blnMatched:
-            self.fnSendData(strData)
-
-    def fnProcessData(self, strData):
-        """Process the data coming from the MUD and match triggers."""
-        self.fnLogDataIn(strData)
-        self.fnMatchTriggers(strData)
-
-    def fnSendData(self, strLine, blnOmitFromLog = False):
-        """Send data to the MUD."""
-        if strLine != "":
-            try:
-                self.cntConnection.sendLine(strLine)
-            except:
-                self.fnError("Could not write data to socket. Reason is '%s'." % sys.exc_value)
-            if not blnOmitFromLog:
-                self.fnLogDataOut(strLine)
-
-    def fnLogDataIn(self, strData):
-        """Log the incoming data."""
-        if self.cnfConfiguration.blnToScreen:
-            print self.fmFormatting.fnStripANSI(strData)
-        if self.cnfConfiguration.blnLogging:
-            if not self.cnfConfiguration.blnKeepANSI:
-                self.cnfConfiguration.flLogFile.write("%s%s%s\n" % (self.fmFormatting.fnExpandMacros(self.cnfConfiguration.strPrependOut, self), self.fmFormatting.fnStripANSI(strData), self.fmFormatting.fnExpandMacros(self.cnfConfiguration.strAppendIn, self)))
-            else:
-                self.cnfConfiguration.flLogFile.write("%s%s%s\n" % (self.fmFormatting.fnExpandMacros(self.cnfConfiguration.strPrependOut, self), strData, self.fmFormatting.fnExpandMacros(self.cnfConfiguration.strAppendIn, self)))
-
-    def fnNoteData(self, strLine, blnOmitConsole = False, blnOmitRemote = False, blnOmitLog = False, blnOmitNewline = False):
-        """Print debugging data."""
-        strData = self.fmFormatting.fnTrimNewline(strLine)
-        if self.cnfConfiguration.blnNoteToConsole and not blnOmitConsole:
-            if blnOmitNewline:
-                print strData,
-            else:
-                print strData
-        if self.cnfConfiguration.blnLogging and not blnOmitLog and self.cnfConfiguration.blnNoteToLog:
-            self.cnfConfiguration.flLogFile.write("%s%s%s%s" % (self.fmFormatting.fnExpandMacros(self.cnfConfiguration.strPrependOut, self), strData, self.fmFormatting.fnExpandMacros(self.cnfConfiguration.strAppendOut, self), (blnOmitNewline and [""] or ["\n"])[0]))
-        if self.cntClientConnection and not blnOmitRemote and self.cnfConfiguration.blnNoteToRemote:
-            self.cntClientConnection.fnSend(strData + (blnOmitNewline and [""] or ["\n"])[0])
-
-    def fnLogDataOut(self, strData):
-        """Log the outgoing data."""
-        strData = self.fmFormatting.fnTrimNewline(strData)
-        if self.cnfConfiguration.blnToScreen:
-            print strData
-        if self.cnfConfiguration.blnLogging:
-            self.cnfConfiguration.flLogFile.write("%s%s%s\n" % (self.fmFormatting.fnExpandMacros(self.cnfConfiguration.strPrependOut, self), strData, self.fmFormatting.fnExpandMacros(self.cnfConfiguration.strAppendOut, self)))
-
-    def fnGetStyle(self, strLine, intCharNumber):
-        """Retrieve the style of a character in a line."""
-        blnEscaped = False
-        strBuffer = ""
-        intCounterClear = 0
-        for strCharacter in strLine:
-            if not blnEscaped:
-                if strCharacter == "\x1b":
-                    blnEscaped = True
-                    lstStyle = []
-                else:
-                    intCounterClear +=1
-            else:
-                if strCharacter in "0123456789":
-                    strBuffer += strCharacter
-                elif strCharacter == "m":
-                    blnEscaped = False
-                    lstStyle.append(strBuffer and int(strBuffer))
-                    strBuffer = ""
-                elif strCharacter == ";":
-                    lstStyle.append(strBuffer and int(strBuffer))
-                    strBuffer = ""
-            if intCounterClear == intCharNumber:
-                return lstStyle
-
-    def OnConnect(self):
-        """Initialise various connection details."""
-        # Open the logfile if specified.
-        if self.cnfConfiguration.blnLogging:
-            self.cnfConfiguration.flLogFile = file(self.fmFormatting.fnExpandMacros(self.cnfConfiguration.strLogFile, self), "a")
-        # Print OnConnect string.
-        if self.cnfConfiguration.strOnConnect != "":
-            self.fnNoteData(self.fmFormatting.fnExpandMacros(self.cnfConfiguration.strOnConnect, self) + "\n")
-        # Perform autologon.
-        self.fnSendData(self.cnfConfiguration.strName)
-        self.cntConnection.sendLine(self.cnfConfiguration.strPassword + "\n")
-        # Send connection commands.
-        if self.cnfConfiguration.strConnectionCommands != "":
-            self.fnSendData(self.cnfConfiguration.strConnectionCommands)
-        # Execute OnPluginConnect.
-        self.fnCallPluginFunction("OnPluginConnect", ())
-
-    def OnConnectFailed(self):
-        """Do stuff when the connection has failed."""
-        # Print OnConnectFailed string.
-        if self.cnfConfiguration.strOnConnectFailed != "":
-            self.fnNoteData(self.fmFormatting.fnExpandMacros(self.cnfConfiguration.strOnConnectFailed, self) + "\n")
-        self.fnCallPluginFunction("OnPluginConnectFailed", ())
-
-    def OnDisconnect(self):
-        """Clean up after disconnection."""
-        if self.cnfConfiguration.strOnDisconnect != "":
-            self.fnNoteData(self.fmFormatting.fnExpandMacros(self.cnfConfiguration.strOnDisconnect, self) + "\n")
-        if self.cnfConfiguration.blnLogging:
-            self.cnfConfiguration.flLogFile.close()
-        self.fnSavePlugins()
-        self.fnCallPluginFunction("OnPluginDisconnect", ())
-
-    def OnRemoteConnect(self, strAddress):
-        """Remote client connection callback."""
-        if self.cnfConfiguration.strOnRemoteConnect != "":
-            self.fnNoteData(self.fmFormatting.fnExpandMacros(self.cnfConfiguration.strOnRemoteConnect, self, strAddress), blnOmitRemote = True)
-        self.fnCallPluginFunction("OnPluginClientConnect", ())
-
-    def OnRemoteDisconnect(self, strAddress):
-        """Remote client disconnection callback."""
-        if self.cnfConfiguration.strOnRemoteDisconnect != "":
-            self.fnNoteData(self.fmFormatting.fnExpandMacros(self.cnfConfiguration.strOnRemoteDisconnect, self, strAddress), blnOmitRemote = True)
-        self.fnCallPluginFunction("OnPluginClientDisconnect", ())
-
-    def fnError(self, strDescription):
-        print "ERROR: %s" % strDescription
-        self.fnExit()
-
-    def fnException(self, strType, strValue, tbTraceback):
-        if strType == exceptions.SystemExit:
-            os._exit(0)
-        print "Exception of type %s occurred in line %s, reason \"%s\"." % (strType, tbTraceback.tb_lineno, strValue)
-
-class Callbacks:
-    def __init__(self, plgNamespace):
-        # Get the plugin reference so we can manipulate it.
-        self.plgPlugin = plgNamespace
-        self.GetPluginName = plgNamespace.strName
-    def Connect(self):
-        """Connect to the server."""
-        if mdBot.cntConnection == None:
-            mdBot.cntConnection = MUDConnection(mdBot.cnfConfiguration.strHost, mdBot.cnfConfiguration.intPort)
-    def Send(self, strData):
-        """Send data to the world."""
-        mdBot.cntClientConnection.fnSend(strData)
-        mdBot.fnSendData(strData)
-    def SaveState(self):
-        """Save the plugin's state."""
-        self.plgPlugin.savestate()
-    def Exit(self):
-        """Exits the program."""
-        mdBot.fnExit()
-    def Disconnect(self):
-        """Disconnect the current connection."""
-        if mdBot.cntConnection != None:
-            mdBot.cntConnection.close()
-    def Note(self, strData):
-        """Send text to stdout."""
-        mdBot.fnNoteData(strData)
-    def SetVariable(self, strVariableName, strData):
-        """Set a variable in the plugin's variables dictionary."""
-        self.plgPlugin.dicVariables[strVariableName.lower()] = strData
-        return 0
-    def GetInfo(self, intInfoType):
-        """Get information about the current character."""
-        if intInfoType == 1:
-            return mdBot.cnfConfiguration.strHost
-        elif intInfoType == 3:
-            return mdBot.cnfConfiguration.strName
-        elif intInfoType == 11:
-            return mdBot.cnfConfiguration.strOnConnect
-        elif intInfoType == 12:
-            return mdBot.cnfConfiguration.strOnDisconnect
-        elif intInfoType == 106:
-            # Return true if not connected.
-            return (mdBot.stConnectionState == AC_DISCONNECTED) and True or False
-        elif intInfoType == 106:
-            # Return true if currently connecting.
-            return (mdBot.stConnectionState == AC_CONNECTING) and True or False
-        elif intInfoType == 3:
-            return mdBot.cnfConfiguration.strName
-        else:
-            return "NOT IMPLEMENTED"
-    def GetVariable(self, strVariableName):
-        """Get a variable from the plugin's variables dictionary."""
-        if strVariableName.lower() in self.plgPlugin.dicVariables:
-            return self.plgPlugin.dicVariables[strVariableName.lower()]
-        else:
-            return
-    def DeleteVariable(self, strVariableName):
-        """Delete a variable from the plugin's variables dictionary."""
-        if strVariableName.lower() in self.plgPlugin.dicVariables:
-            del self.plgPlugin.dicVariables[strVariableName.lower()]
-            varReturn = 0
-        else:
-            varReturn = 30019
-        return varReturn
-    def EnableTrigger(self, strTriggerName, blnEnabled):
-        """Enable or disable a trigger."""
-        for ciTrigger in self.plgPlugin.lstTriggers:
-            if ciTrigger.strName == strTriggerName:
-                # If the trigger is what the user wanted, set its status
-                ciTrigger.blnEnabled = blnEnabled
-                return 0
-        else:
-            # Trigger not found
-            return 30005
-    def EnableTriggerGroup(self, strGroupName, blnEnabled):
-        """Enable or disable a trigger group."""
-        intCounter = 0
-        for ciTrigger in self.plgPlugin.lstTriggers:
-            if ciTrigger.strGroup == strGroupName:
-                # If the trigger is in the group, set its status
-                # and increment the counter.
-                ciTrigger.blnEnabled = blnEnabled
-                intCounter += 1
-        return intCounter
-    def EnableTimer(self, strTimerName, blnEnabled):
-        """Enable or disable a timer."""
-        for ciTimer in self.plgPlugin.lstTimers:
-            if ciTimer.strName == strTimerName:
-                # If the trigger is what the user wanted, set its status
-                ciTimer.fltTime = time.time() + ciTimer.intOffsetHour * 3600 + ciTimer.intOffsetMinute * 60 + ciTimer.intOffsetSecond
-                ciTimer.blnEnabled = blnEnabled
-                return 0
-        else:
-            # Trigger not found
-            return 30017
-    def EnableTimerGroup(self, strGroupName, blnEnabled):
-        """Enable or disable a trigger group."""
-        intCounter = 0
-        for ciTimer in self.plgPlugin.lstTimers:
-            if ciTimer.strGroup == strGroupName:
-                # If the trigger is in the group, set its status
-                # and increment the counter.
-                ciTimer.fltTime = time.time() + ciTimer.intOffsetHour * 3600 + ciTimer.intOffsetMinute * 60 + ciTimer.intOffsetSecond
-                ciTimer.blnEnabled = blnEnabled
-                intCounter += 1
-        return intCounter
-    def EnableGroup(self, strGroupName, blnEnabled):
-        """Enable or disable a group."""
-        intCounter = 0
-        for ciTrigger in self.plgPlugin.lstTriggers:
-            if ciTrigger.strGroup == strGroupName:
-                # If the trigger is in the group, set its status
-                # and increment the counter.
-                ciTrigger.blnEnabled = blnEnabled
-                intCounter += 1
-        for ciTimer in self.plgPlugin.lstTimers:
-            if ciTimer.strGroup == strGroupName:
-                # If the trigger is in the group, set its status
-                # and increment the counter.
-                ciTimer.blnEnabled = blnEnabled
-                intCounter += 1
-        # TODO: Add aliases.
-        return intCounter
-    def TraceOut(self, strMessage):
-        mdBot.fnNoteData("%s notes '%s'." % (self.plgPlugin.strName, strMessage))
-    def GetPluginName(self):
-        """Return the plugin's name."""
-        return self.plgPlugin.strName
-    def ColourTell(self, strForegroundColor, strBackgroundColor, strText):
-        """Send text to the console without a newline, in color."""
-        # TODO: Make color actually work.
-        mdBot.fnNoteData(strText, blnOmitNewline = True)
-    def ColourNote(self, strForegroundColor, strBackgroundColor, strText):
-        """Send text to the console with a newline, in color."""
-        # TODO: Make color actually work.
-        mdBot.fnNoteData(strText)
-    def DoAfter(self, intSeconds, strText):
-        """Send text to the MUD after the specified amount of seconds."""
-        self.plgPlugin.createtimer(int(intSeconds), strText)
-
-class Plugin:
-    class Trigger:
-        """The trigger object class."""
-        def __repr__(self):
-            return self.strMatch
-        def __cmp__(self, other):
-            if self.intSequence < other.intSequence:
-                return -1
-            elif self.intSequence == other.intSequence:
-                return 0
-            else:
-                return 1
-    class Alias:
-        """The alias object class."""
-        def __repr__(self):
-            return self.strMatch
-        def __cmp__(self, other):
-            if self.intSequence < other.intSequence:
-                return -1
-            elif self.intSequence == other.intSequence:
-                return 0
-            else:
-                return 1
-    class Timer:
-        """The timer object class."""
-
-    def createtimer(self, intSeconds, strText):
-        """Create a timer."""
-        tmrTimer = Plugin.Timer()
-        tmrTimer.blnEnabled = True
-        tmrTimer.intHour = 0
-        tmrTimer.intMinute = 0
-        tmrTimer.intSecond = intSeconds
-        tmrTimer.blnOneShot = True
-        tmrTimer.fltTime = time.time()
-        tmrTimer.strSend = strText
-        self.lstTimers.append(tmrTimer)
-
-    def loadtimers(self, xmlTimers):
-        """Load timers from the xmlTimers node."""
-        self.lstTimers = []
-        if xmlTimers == None:
-            return
-        for xmlTimer in xmlTimers:
-            tmrTimer = Plugin.Timer()
-            tmrTimer.blnEnabled = self.getxmlattr(xmlTimer, "enabled", True)
-            tmrTimer.strName = self.getxmlattr(xmlTimer, "name")
-            for tmrOther in self.lstTimers:
-                if (tmrOther.strName.lower() == tmrOther.strName.lower()) and (tmrOther.strName != ""):
-                    mdBot.fnError("Duplicate timer name found: '%s'" % tmrOther.strName)
-            tmrTimer.strGroup = self.getxmlattr(xmlTimer, "group")
-            tmrTimer.strVariable = self.getxmlattr(xmlTimer, "variable")
-            tmrTimer.strScript = self.getxmlattr(xmlTimer, "script")
-            tmrTimer.intHour = int(self.getxmlattr(xmlTimer, "hour"))
-            tmrTimer.intMinute = int(self.getxmlattr(xmlTimer, "minute"))
-            # This is converted to an int, change if accuracy is needed.
-            tmrTimer.intSecond = int(float(self.getxmlattr(xmlTimer, "second")))
-            tmrTimer.intSendTo = int(self.getxmlattr(xmlTimer, "send_to"))
-            tmrTimer.intOffsetHour = int(self.getxmlattr(xmlTimer, "offset_hour"))
-            tmrTimer.intOffsetMinute = int(self.getxmlattr(xmlTimer, "offset_minute"))
-            tmrTimer.intOffsetSecond = int(self.getxmlattr(xmlTimer, "offset_second"))
-            tmrTimer.blnOneShot = self.getxmlattr(xmlTimer, "one_shot", True)
-            tmrTimer.blnOmitFromOutput = self.getxmlattr(xmlTimer, "omit_from_output", True)
-            tmrTimer.blnOmitFromLog = self.getxmlattr(xmlTimer, "omit_from_log", True)
-            tmrTimer.blnActiveClosed = self.getxmlattr(xmlTimer, "active_closed", True)
-            tmrTimer.blnAtTime = self.getxmlattr(xmlTimer, "at_time", True)
-            tmrTimer.strSend = xmlTimer.find("send").text
-            tmrTimer.fltTime = time.time() + tmrTimer.intOffsetHour * 3600 + tmrTimer.intOffsetMinute * 60 + tmrTimer.intOffsetSecond
-
-            if tmrTimer.intHour + tmrTimer.intMinute + tmrTimer.intSecond > 0:
-                # Append it to the timers list.
-                self.lstTimers.append(tmrTimer)
-            else:
-                mdBot.fnError("Timer has no interval set.")
-
-    def loadtriggers(self, xmlTriggers):
-        """Load triggers from the xmlTriggers node."""
-        fmFormatting = Formatting()
-
-        self.lstTriggers = []
-        if xmlTriggers == None:
-            return
-        for xmlTrigger in xmlTriggers:
-            trgTrigger = Plugin.Trigger()
-            trgTrigger.strMatch = self.getxmlattr(xmlTrigger, "match")
-            trgTrigger.blnEnabled = self.getxmlattr(xmlTrigger, "enabled", True)
-            trgTrigger.blnExpandVariables = self.getxmlattr(xmlTrigger, "expand_variables", True)
-            trgTrigger.blnKeepANSI = self.getxmlattr(xmlTrigger, "keep_ansi", True)
-            trgTrigger.blnBold = self.getxmlattr(xmlTrigger, "bold", True)
-            trgTrigger.blnInverse = self.getxmlattr(xmlTrigger, "inverse", True)
-            trgTrigger.blnItalic = self.getxmlattr(xmlTrigger, "italic", True)
-            trgTrigger.blnMatchBackColour = self.getxmlattr(xmlTrigger, "match_back_colour", True)
-            trgTrigger.blnMatchBold = self.getxmlattr(xmlTrigger, "match_bold", True)
-            trgTrigger.blnMatchInverse = self.getxmlattr(xmlTrigger, "match_inverse", True)
-            trgTrigger.blnMatchItalic = self.getxmlattr(xmlTrigger, "match_italic", True)
-            trgTrigger.blnMatchTextColour = self.getxmlattr(xmlTrigger, "match_text_colour", True)
-            trgTrigger.strName = self.getxmlattr(xmlTrigger, "name")
-            for trgOther in self.lstTriggers:
-                if (trgOther.strName.lower() == trgTrigger.strName.lower()) and (trgOther.strName != ""):
-                    mdBot.fnError("Duplicate trigger name found: '%s'" % trgOther.strName)
-            trgTrigger.strGroup = self.getxmlattr(xmlTrigger, "group")
-            trgTrigger.blnIgnoreCase = self.getxmlattr(xmlTrigger, "ignore_case", True)
-            trgTrigger.blnRegexp = self.getxmlattr(xmlTrigger, "regexp", True)
-            trgTrigger.blnKeepEvaluating = self.getxmlattr(xmlTrigger, "keep_evaluating", True)
-            trgTrigger.intSequence = int(self.getxmlattr(xmlTrigger, "sequence"))
-            trgTrigger.intBackColour = int(self.getxmlattr(xmlTrigger, "back_colour"))
-            trgTrigger.intTextColour = int(self.getxmlattr(xmlTrigger, "text_colour"))
-            trgTrigger.intSendTo = int(self.getxmlattr(xmlTrigger, "send_to"))
-            trgTrigger.strScript = self.getxmlattr(xmlTrigger, "script")
-
-            if not trgTrigger.blnRegexp:
-                trgTrigger.strMatch = fmFormatting.fnRegexpify(trgTrigger.strMatch)
-
-            if len(xmlTrigger) > 0:
-                # Substitute MUSHClient compatible %1 for pyregexp \1.
-                trgTrigger.strSend = re.sub(r"\%(?:(\d)|\<(.*?)\>)", r"\\g<\1>", xmlTrigger[0].text)
-            else:
-                trgTrigger.strSend = ""
-            intFlags = 0
-            if trgTrigger.blnIgnoreCase:
-                intFlags |= re.IGNORECASE
-            trgTrigger.reTrigger = re.compile(trgTrigger.strMatch, intFlags)
-            self.lstTriggers.append(trgTrigger)
-        self.lstTriggers.sort()
-
-    def loadaliases(self, xmlAliases):
-        """Load aliases from the xmlAliases node."""
-        fmFormatting = Formatting()
-
-        self.lstAliases = []
-        if xmlAliases == None:
-            return
-        for xmlAlias in xmlAliases:
-            alsAlias = Plugin.Alias()
-            alsAlias.strMatch = self.getxmlattr(xmlAlias, "match")
-            alsAlias.blnEnabled = self.getxmlattr(xmlAlias, "enabled", True)
-            alsAlias.blnExpandVariables = self.getxmlattr(xmlAlias, "expand_variables", True)
-            alsAlias.blnEchoAlias = self.getxmlattr(xmlAlias, "echo_alias", True)
-            alsAlias.strName = self.getxmlattr(xmlAlias, "name")
-            for alsOther in self.lstAliases:
-                if (alsOther.strName.lower() == alsAlias.strName.lower()) and (alsOther.strName != ""):
-                    mdBot.fnError("Duplicate alias name found: '%s'" % alsOther.strName)
-            alsAlias.strGroup = self.getxmlattr(xmlAlias, "group")
-            alsAlias.blnIgnoreCase = self.getxmlattr(xmlAlias, "ignore_case", True)
-            alsAlias.blnRegexp = self.getxmlattr(xmlAlias, "regexp", True)
-            alsAlias.blnKeepEvaluating = self.getxmlattr(xmlAlias, "keep_evaluating", True)
-            alsAlias.blnOmitFromCommandHistory = self.getxmlattr(xmlAlias, "omit_from_command_history", True)
-            alsAlias.blnOmitFromLog = self.getxmlattr(xmlAlias, "omit_from_log", True)
-            alsAlias.intSequence = int(self.getxmlattr(xmlAlias, "sequence"))
-            alsAlias.intSendTo = int(self.getxmlattr(xmlAlias, "send_to"))
-            alsAlias.strScript = self.getxmlattr(xmlAlias, "script")
-            alsAlias.strVariable = self.getxmlattr(xmlAlias, "variable")
-
-            if not alsAlias.blnRegexp:
-                alsAlias.strMatch = fmFormatting.fnRegexpify(alsAlias.strMatch)
-
-            if len(xmlAlias) > 0:
-                # Substitute MUSHClient compatible %1 for pyregexp \1.
-                alsAlias.strSend = re.sub(r"\%(?:(\d)|\<(.*?)\>)", r"\\g<\1>", xmlAlias[0].text)
-            else:
-                alsAlias.strSend = ""
-            intFlags = 0
-            if alsAlias.blnIgnoreCase:
-                intFlags |= re.IGNORECASE
-            alsAlias.reAlias = re.compile(alsAlias.strMatch, intFlags)
-            self.lstAliases.append(alsAlias)
-        self.lstAliases.sort()
-
-    def run(self, strFunctionName, tplArguments, blnSilent = False):
-        """Execute the function in the plugin namespace."""
-        try:
-            self.dicGlobals[strFunctionName](*tplArguments)
-        except KeyError:
-            if not blnSilent:
-                mdBot.fnException(sys.exc_type, sys.exc_value, sys.exc_traceback)
-        except:
-                mdBot.fnException(sys.exc_type, sys.exc_value, sys.exc_traceback)
-
-    def load(self, strFilename, strID):
-        """Load the plugin data, triggers, etc."""
-        try:
-            flPlugin = file(strFilename)
-        except:
-            mdBot.fnError("Plugin '%s' cannot be opened." % strFilename)
-
-        xmlTree = ET.parse(flPlugin)
-        xmlRoot = xmlTree.getroot()
-
-        # Load generic plugin configuration.
-        xmlPlugin = xmlTree.find("plugin")
-        self.strName = self.getxmlattr(xmlPlugin, "name")
-        self.strID = self.getxmlattr(xmlPlugin, "id")
-        self.blnSaveState = self.getxmlattr(xmlPlugin, "save_state", True)
-        if self.getxmlattr(xmlPlugin, "language").lower() != "python":
-            mdBot.fnError("The only plugin language supported is Python, error in '%s'." % strFilename)
-        strScript = xmlTree.find("script").text
-        # Execute the script and keep the globals
-        self.dicGlobals = {"world": Callbacks(self)}
-        try:
-            exec(strScript, self.dicGlobals)
-        except:
-            mdBot.fnException(sys.exc_type, sys.exc_value, sys.exc_traceback)
-        # Load variables from the file.
-        self.dicVariables = self.loadstate(xmlRoot)
-        # Load state variables (variables that already exist will be
-        # overwritten).
-        try:
-            flState = file("state/%s-%s-state.xml" % (strID, self.strID))
-        except:
-            pass
-        else:
-            self.dicVariables.update(self.loadstate(ET.parse(flState).getroot()))
-            flState.close()
-
-        # Load aliases, triggers and timers.
-        self.loadaliases(xmlRoot.find("aliases"))
-        self.loadtriggers(xmlRoot.find("triggers"))
-        self.loadtimers(xmlRoot.find("timers"))
-
-        flPlugin.close()
-
-        return self.strID
-
-    def loadstate(self, xmlRoot):
-        """Load the world variables from an xml node."""
-        dicVariables = {}
-        try:
-            lstVariables = xmlRoot.find("variables").getchildren()
-        except:
-            return {}
-
-        for etElement in lstVariables:
-            if etElement.text == None:
-                dicVariables[etElement.attrib["name"].lower()] = ""
-            else:
-                dicVariables[etElement.attrib["name"].lower()] = etElement.text
-
-        return dicVariables
-
-    def savestate(self):
-        """Save the plugin state."""
-        if not self.blnSaveState:
-            return
-        try:
-            flState = file("state/%s-%s-state.xml" % (mdBot.cnfConfiguration.strID, self.strID), "w")
-        except:
-            return
-
-        xmlRoot = ET.Element("muclient")
-        xmlRoot.append(ET.Element("variables"))
-        xmlVariables = xmlRoot[0]
-        xmlVariables.attrib = {"muclient_version": "3", "world_file_version": "1", "date_saved": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())}
-
-        for strKey, strValue in self.dicVariables.items():
-            etElement = ET.Element("variable")
-            etElement.attrib = {"name": strKey}
-            etElement.text = str(strValue)
-            xmlVariables.append(etElement)
-
-        ET.ElementTree(xmlRoot).write(flState)
-
-        flState.close()
-
-    def fnselyn(self, strText):
-        """Convert 'y'/'n' to True or False."""
-        if strText.lower() == "y":
-            return True
-        else:
-            return False
-
-    def getxmlattr(self, xmlNode, strAttribute, blnYN = False):
-        """Get the value of strAttribute from xmlNode, converting it to
-           binary if blnYN is True. If not found, return its default. If
-           the default does not exist, it is a mandatory attribute."""
-
-        dicAttributes = {
-            "appendin": "",                          # Text to append to incoming data.
-            "appendout": "",                         # Text to append to outgoing data.
-            "active_closed": False,                  # Is timer active when the world is closed? (NS)
-            "at_time": False,                        # At time for timer. (NS)
-            "back_colour": 0,                        # Backcolour to match on. (NS)
-            "bold": False,                           # Match if the text is bold. (NS)
-            "connectioncommands": "",                # Commands to send on connection.
-            "debug": False,                          # Print debugging data in the output.
-            "enabled": False,                        # Is the item enabled?
-            "expand_variables": False,               # Expand variables. (NS)
-            "echo_alias": False,                     # Echo the alias. (NS)
-            "group": "",                             # Item group name.
-            "hour": 0,                               # Hour interval for timers. (NS)
-            "ignore_case": False,                    # Ignore case. (NS)
-            "inverse": False,                        # Match if the text is inverse. (NS)
-            "italic": False,                         # Match if the text is italic. (NS)
-            "keep_ansi": False,                      # Keep the ANSI codes to match on.
-            "keep_evaluating": True,                 # Keep evaluating after a trigger has been matched.
-            "localport": 4000,                       # Port number to listen to.
-            "logfile": "log.txt",                    # Log filename.
-            "logging": False,                        # Is logging enabled?
-            "match_back_colour": False,              # Enable match on backcolour.
-            "match_bold": False,                     # Enable match on bold.
-            "match_inverse": False,                  # Enable match on inverse.
-            "match_italic": False,                   # Enable match on italic.
-            "match_text_colour": False,              # Enable match on forecolour.
-            "minute": 0,                             # Minute interval for timers. (NS)
-            "name": "",                              # Item name.
-            "notetoconsole": False,                  # Send notes to the console.
-            "notetolog": False,                      # Write notes to the log.
-            "notetoremote": True,                    # Send notes to the remote client.
-            "offset_hour": 0,                        # Hour offset for timers. (NS)
-            "offset_minute": 0,                      # Minute offset for timers. (NS)
-            "offset_second": 0,                      # Second offset for timers. (NS)
-            "omit_from_command_history": False,      # Omit line from logfile. (NS)
-            "omit_from_log": False,                  # Omit line from logfile. (NS)
-            "omit_from_output": False,               # Omit line from output. (NS)
-            "one_shot": False,                       # Is timer one-shot? (NS)
-            "onconnect": "",                         # Log text to append on connection.
-            "ondisconnect": "",                      # Log text to append on disconnection.
-            "onremoteconnect": "",                   # Log text to append on remote client connection.
-            "onremotedisconnect": "",                # Log text to append on remote client disconnection.
-            "port": 4000,                            # Port to connect on.
-            "prependin": "",                         # Text to prepend to incoming data.
-            "prependout": "",                        # Text to prepend to outgoing data.
-            "regexp": False,                         # Is the trigger a regular expression?
-            "repeat": False,                         # Repeat the trigger on the same line. (NS)
-            "save_state": False,                     # Save the namespace's state. (NS)
-            "script": "",                            # Call a script function when executed.
-            "second": 0,                             # Second interval for timers. (NS)
-            "send_to": 0,                            # Send to various outputs. (PS)
-            "sequence": 100,                         # Sequence of the trigger.
-            "toscreen": False,                       # Print the output to stdout.
-            "text_colour": 0,                        # Forecolour to match on. (NS)
-            "variable": "",                          # Variable to send to (NS)
-        }
-        if strAttribute in xmlNode.attrib:
-            if blnYN:
-                return self.fnselyn(xmlNode.attrib[strAttribute])
-            else:
-                return xmlNode.attrib[strAttribute]
-        else:
-            if strAttribute in dicAttributes:
-                return dicAttributes[strAttribute]
-            else:
-                mdBot.fnError("Mandatory attribute \"%s\" does not exist." % strAttribute)
-
-
-class Configuration:
-    def __init__(self, strFilename):
-        """Load the configuration from the specified file."""
-        try:
-            flFile = file(strFilename)
-        except:
-            print("Cannot open file '%s' for reading." % strFilename)
-            sys.exit()
-        xmlTree = ET.parse(flFile)
-        xmlRoot = xmlTree.getroot()
-        # Create this here so we can access the getxmlattr function.
-        self.dicPlugins = {"000000000000000000000000": Plugin()}
-        plgNamespace = self.dicPlugins["000000000000000000000000"]
-
-        # World ID.
-        self.strID = plgNamespace.getxmlattr(xmlRoot, "id")
-
-        # Connection details.
-        self.strHost = plgNamespace.getxmlattr(xmlRoot, "host")
-        self.intPort = int(plgNamespace.getxmlattr(xmlRoot, "port"))
-        self.intLocalPort = int(plgNamespace.getxmlattr(xmlRoot, "localport"))
-        self.strName = plgNamespace.getxmlattr(xmlRoot, "name")
-        self.strPassword = base64.decodestring(plgNamespace.getxmlattr(xmlRoot, "password"))
-        self.strConnectionCommands = plgNamespace.getxmlattr(xmlRoot, "connectioncommands").decode("string_escape")
-
-        # Debugging.
-        self.blnDebug = plgNamespace.getxmlattr(xmlRoot, "debug", True)
-        self.blnNoteToConsole = plgNamespace.getxmlattr(xmlRoot, "notetoconsole", True)
-        self.blnNoteToLog = plgNamespace.getxmlattr(xmlRoot, "notetolog", True)
-        self.blnNoteToRemote = plgNamespace.getxmlattr(xmlRoot, "notetoremote", True)
-
-        # Logging.
-        xmlLogging = xmlRoot.find("logging")
-        self.blnLogging = plgNamespace.getxmlattr(xmlLogging, "enabled", True)
-        self.blnToScreen = plgNamespace.getxmlattr(xmlLogging, "toscreen", True)
-        self.blnKeepANSI = plgNamespace.getxmlattr(xmlLogging, "keep_ansi", True)
-        self.strLogFile = plgNamespace.getxmlattr(xmlLogging, "logfile")
-        self.strAppendIn = plgNamespace.getxmlattr(xmlLogging, "appendin").decode("string_escape")
-        self.strAppendOut = plgNamespace.getxmlattr(xmlLogging, "appendout").decode("string_escape")
-        self.strPrependIn = plgNamespace.getxmlattr(xmlLogging, "prependin").decode("string_escape")
-        self.strPrependOut = plgNamespace.getxmlattr(xmlLogging, "prependout").decode("string_escape")
-        self.strOnConnect = plgNamespace.getxmlattr(xmlLogging, "onconnect").decode("string_escape")
-        self.strOnConnectFailed = plgNamespace.getxmlattr(xmlLogging, "onconnectfailed").decode("string_escape")
-        self.strOnDisconnect = plgNamespace.getxmlattr(xmlLogging, "ondisconnect").decode("string_escape")
-        self.strOnRemoteConnect = plgNamespace.getxmlattr(xmlLogging, "onremoteconnect").decode("string_escape")
-        self.strOnRemoteDisconnect = plgNamespace.getxmlattr(xmlLogging, "onremotedisconnect").decode("string_escape")
-
-        # Pass the standard namespace to the plugin so we can access it.
-        plgNamespace.strID = "000000000000000000000000"
-        plgNamespace.strName = "Main namespace"
-        plgNamespace.blnSaveState = True
-        strScript = xmlTree.find("script").text
-        plgNamespace.dicGlobals = {"world": Callbacks(plgNamespace)}
-        try:
-            exec(strScript, plgNamespace.dicGlobals)
-        except:
-            mdBot.fnException(sys.exc_type, sys.exc_value, sys.exc_traceback)
-
-        # Load variables from the file.
-        plgNamespace.dicVariables = plgNamespace.loadstate(xmlRoot)
-        # Load state variables (variables that already exist will be
-        # overwritten).
-        try:
-            flState = file("state/%s-%s-state.xml" % (self.strID, plgNamespace.strID))
-        except:
-            pass
-        else:
-            plgNamespace.dicVariables.update(plgNamespace.loadstate(ET.parse(flState).getroot()))
-            flState.close()
-
-        # Load triggers, timers.
-        plgNamespace.loadtriggers(xmlRoot.find("triggers"))
-        plgNamespace.loadaliases(xmlRoot.find("aliases"))
-        plgNamespace.loadtimers(xmlRoot.find("timers"))
-
-        # Load plugins.
-        if xmlRoot.find("plugins"):
-            for xmlPlugin in xmlRoot.find("plugins"):
-                plgPlugin = Plugin()
-                strID = plgPlugin.load(xmlPlugin.attrib["name"], self.strID)
-                if strID in self.dicPlugins:
-                    mdBot.fnError("Duplicate plugin '%s' found." % xmlPlugin.attrib["name"])
-                else:
-                    self.dicPlugins[strID] = plgPlugin
-        flFile.close()
-
-class MUDProtocol(LineReceiver):
-    def __init__(self):
-        self.setRawMode()
-        self.delimiter = "\n"
-        self.buffer = ""
-    def rawDataReceived(self, data):
-        if mdBot.cntClientConnection:
-            mdBot.cntClientConnection.fnSend(data)
-        self.buffer += data.replace("\r", "")
-        while True:
-            try:
-                line, self.buffer = self.buffer.split(self.delimiter, 1)
-            except ValueError:
-                break
-            else:
-                mdBot.fnProcessData(line.replace("\r", ""))
-    def connectionLost(self, reason):
-        mdBot.stConnectionState = AC_DISCONNECTED
-        mdBot.OnDisconnect()
-        mdBot.cntConnection.cleanup()
-
-class MUDConnection:
-    def __init__(self, host, port):
-        self.protocol = None
-        creator = ClientCreator(reactor, MUDProtocol)
-        deferred = creator.connectTCP(host, port)
-        deferred.addCallback(self.builtProtocol)
-        deferred.addErrback(self.connectionFailed)
-    def connectionFailed(self, reason):
-        mdBot.stConnectionState = AC_DISCONNECTED
-        mdBot.OnConnectFailed()
-        self.cleanup()
-    def builtProtocol(self, protocol):
-        self.protocol = protocol
-        mdBot.stConnectionState = AC_CONNECTED
-        mdBot.OnConnect()
-        mdBot.cntClientConnection = MUDServer()
-    def sendLine(self, line):
-        self.protocol.sendLine(line)
-    def close(self):
-        self.protocol.transport.loseConnection()
-    def cleanup(self):
-        self.protocol = None
-        mdBot.stConnectionState = AC_DISCONNECTED
-        mdBot.cntConnection = None
-        if mdBot.cntClientConnection:
-            mdBot.cntClientConnection.close()
-            mdBot.cntClientConnection = None
-
-class MUDServerProtocol(LineReceiver):
-    def lineReceived(self, line):
-        if self.intState == 0:
-            self.strAuthName = line
-            self.intState = 1
-            self.sendLine("Please enter the character password:")
-        elif self.intState == 1:
-            if self.strAuthName.lower() == mdBot.cnfConfiguration.strName.lower() and line == mdBot.cnfConfiguration.strPassword:
-                self.intState = 2
-                self.sendLine("Welcome to %s.\n" % mdBot.cnfConfiguration.strName)
-                mdBot.OnRemoteConnect(self.transport.getPeer().host)
-            else:
-                self.sendLine("Wrong name/password.\n")
-                self.transport.loseConnection()
-        elif self.intState == 2:
-            mdBot.fnMatchAliases(line)
-    def connectionLost(self, reason):
-        if self.intState == 2:
-            mdBot.OnRemoteDisconnect(self.transport.getPeer().host)
-        self.factory.connected = False
-        if mdBot.cntConnection:
-            mdBot.cntClientConnection = MUDServer()
-    def connectionMade(self):
-        self.factory.connected = True
-        self.factory.port.stopListening()
-        self.intState = 0 # Name auth
-        self.sendLine("You have connected to MUDdrop, you have 20 seconds to authenticate. Please enter\nthe character name:")
-        reactor.callLater(20, self.factory.timeout)
-
-class MUDServer(ServerFactory):
-    def __init__(self):
-        self.connected = False
-        self.client = None
-        self.port = reactor.listenTCP(mdBot.cnfConfiguration.intLocalPort, self)
-    def buildProtocol(self, addr):
-        self.client = MUDServerProtocol()
-        self.client.factory = self
-        return self.client
-    def fnSend(self, line):
-        if self.connected and self.client.intState == 2: # Authenticated.
-            self.client.transport.write(line)
-    def close(self):
-        self.port.stopListening()
-        if self.connected:
-            self.client.transport.loseConnection()
-    def timeout(self):
-        if self.client.intState != 2:
-            self.close()
-
-mdBot = MUDdrop()
-
-def fnMain():
-    global mdBot
-
-    cmdParser = optparse.OptionParser(usage = "%prog [options]")
-    cmdParser.set_defaults(character = "character.xml", password = "")
-    cmdParser.add_option("-c", "--character", dest = "character", help = "load the character configuration from FILE (default: %default)", metavar = "FILE")
-    cmdParser.add_option("-e", "--encode", dest = "password", help = "encode STRING in base64 and print it", metavar = "STRING")
-    cmdParser.add_option("-i", "--generateid", dest = "generateid", help = "generate a unique ID", action = "store_true")
-    (optOptions, lstArguments) = cmdParser.parse_args()
-    if optOptions.password:
-        print "The encoded string is \"%s\"" % base64.b64encode(optOptions.password)
-        return
-    if optOptions.generateid:
-        print "Your unique ID is:\n%s" % md5.new(str(time.time())).hexdigest()[0:24]
-        return
-    mdBot.init(optOptions.character)
-
-    reactor.run()
-
-fnMain()
+import elementtree.ElementTree as ET
+import exceptions
+import re
+import bisect
+import heapq
+import sre_parse
+import sre_constants
+import optparse
+import sys, os
+import glob
+import base64
+import time
+import zlib
+import md5
+import marshal
+import cPickle
+import signal
+import struct
+import collections
+import types
+import codecs
+import random
+from twisted.internet.protocol import Protocol, ClientCreator, ServerFactory
+from twisted.protocols.basic import LineReceiver
+from twisted.internet import reactor, defer, threads, endpoints
+from twisted.web import server, resource
+from twisted.python import threadable
+
+AC_DISCONNECTED = 0
+AC_CONNECTING = 1
+AC_CONNECTED = 2
+
+# Results of running a trigger or alias.
+TR_NOMATCH = 0
+TR_MATCHED = 1
+TR_STOP = 2
+
+# Telnet commands and options.
+IAC = "\xff"
+DONT = "\xfe"
+DO = "\xfd"
+WONT = "\xfc"
+WILL = "\xfb"
+SB = "\xfa"
+SE = "\xf0"
+TELOPT_ECHO = "\x01"
+TELOPT_COMPRESS2 = "\x56"
+
+class Formatting:
+    """Various text formatting functions."""
+    def __init__(self):
+        self.strANSICodes = r"(?:\x1b\[(?:(?:\d+(?:|;))*[fHpm]|\=\d*[hl]|\d*[ABCDJKknsu])|\xff(\xfb|\xfc)\x01)"
+        self.reANSICodes = re.compile(self.strANSICodes)
+
+    def fnConvertWildcards(self, strText):
+        """Substitute MUSHClient compatible %1 and %<name> for pyregexp \g<1>
+           and \g<name>."""
+        return re.sub(r"\%(?:(\d)|\<(.*?)\>)", lambda reMatch: "\\g<%s>" % (reMatch.group(1) or reMatch.group(2)), strText)
+
+    def fnTrimNewline(self, strText):
+        """Trim the final newlines from a string."""
+        if strText.endswith("\r\n") or strText.endswith("\n\r"):
+            return strText[:-2]
+        elif strText.endswith("\n"):
+            return strText[:-1]
+        else:
+            return strText
+
+    def fnStripANSI(self, strText):
+        """Strip various ANSI codes from the input."""
+        return self.reANSICodes.sub("", strText)
+
+    def fnExpandMacros(self, strText, insMUDdrop, strIP = "?"):
+        """Expand various macros such as the time, server, etc."""
+        return time.strftime(self.fnExpandNameMacros(strText, insMUDdrop, strIP))
+
+    def fnExpandNameMacros(self, strText, insMUDdrop, strIP = "?"):
+        """Expand the macros that do not depend on the time."""
+        strText = strText.replace("%server", insMUDdrop.cnfConfiguration.strHost)
+        strText = strText.replace("%name", insMUDdrop.cnfConfiguration.strName)
+        strText = strText.replace("%rport", str(insMUDdrop.cnfConfiguration.intPort))
+        strText = strText.replace("%lport", str(insMUDdrop.cnfConfiguration.intLocalPort))
+        strText = strText.replace("%rip", strIP)
+        return strText
+
+    def fnRegexpify(self, strText):
+        """Convert a standard MUSHClient trigger to a regular expression."""
+        strText = re.sub(r"([\[\]\-\=\_\+\"\'\;\:\/\?\\\.\>\,\<\!\@\#\$\%\^\&\*\(\)\|])", r"\\\1", strText)
+        return "^%s$" % strText
+
+    def fnRequiredLiteral(self, strPattern, intFlags = 0):
+        """Return the longest literal string that every match of the regular
+           expression has to contain, and whether it must be at the start of
+           the line. The literal is "" if none could be found."""
+        try:
+            lstParsed = sre_parse.parse(strPattern, intFlags)
+        except:
+            return "", False
+
+        def fnFlatten(lstSequence):
+            # Plain groups are a required part of the sequence, so their
+            # contents can be treated as if they were inline.
+            for strOp, objArgument in lstSequence:
+                if strOp == sre_constants.SUBPATTERN:
+                    for tplItem in fnFlatten(objArgument[-1]):
+                        yield tplItem
+                else:
+                    yield strOp, objArgument
+
+        strLongest = ""
+        blnLongestAnchored = False
+        lstRun = []
+        blnRunAnchored = False
+        # blnStart is True while nothing but a "^" has been seen.
+        blnStart = True
+        blnAnchored = False
+        for strOp, objArgument in fnFlatten(lstParsed):
+            if strOp == sre_constants.LITERAL:
+                if not lstRun:
+                    blnRunAnchored = blnStart and blnAnchored
+                # The lines are unicode, so the literal is too, even for a
+                # byte string pattern with escaped non-ASCII characters.
+                lstRun.append(unichr(objArgument))
+                continue
+            if strOp == sre_constants.AT and objArgument == sre_constants.AT_BEGINNING and blnStart and not (lstParsed.pattern.flags & re.MULTILINE):
+                blnAnchored = True
+                continue
+            if len(lstRun) > len(strLongest):
+                strLongest = "".join(lstRun)
+                blnLongestAnchored = blnRunAnchored
+            lstRun = []
+            blnStart = False
+        if len(lstRun) > len(strLongest):
+            strLongest = "".join(lstRun)
+            blnLongestAnchored = blnRunAnchored
+        return strLongest, blnLongestAnchored
+
+class SendTemplate:
+    """The send text of a trigger or alias, parsed once into literal, group
+       and variable segments so that expanding it is a single join."""
+    SEG_LITERAL = 0
+    SEG_GROUP = 1
+    SEG_VARIABLE = 2
+
+    def __init__(self, strText, rePattern, blnExpandVariables):
+        self.lstSegments = []
+        if blnExpandVariables:
+            lstChunks = re.split("(?i)@([a-z][a-z0-9\_]*)", strText)
+        else:
+            lstChunks = [strText]
+        for intChunk in range(len(lstChunks)):
+            if intChunk % 2:
+                self.lstSegments.append((SendTemplate.SEG_VARIABLE, lstChunks[intChunk].lower()))
+                continue
+            strChunk = lstChunks[intChunk]
+            # A backslash before a variable, or at the end, has nothing left
+            # to escape, so it is kept as it is.
+            blnBackslash = (len(strChunk) - len(strChunk.rstrip("\\"))) % 2 == 1
+            if blnBackslash:
+                strChunk = strChunk[:-1]
+            # This handles the group references and escapes the same way
+            # reObject.expand() does.
+            lstGroups, lstLiterals = sre_parse.parse_template(strChunk, rePattern)
+            dicGroups = dict(lstGroups)
+            for intIndex in range(len(lstLiterals)):
+                if lstLiterals[intIndex] == None:
+                    self.lstSegments.append((SendTemplate.SEG_GROUP, dicGroups[intIndex]))
+                elif lstLiterals[intIndex] != "":
+                    self.lstSegments.append((SendTemplate.SEG_LITERAL, lstLiterals[intIndex]))
+            if blnBackslash:
+                self.lstSegments.append((SendTemplate.SEG_LITERAL, "\\"))
+        # Merge adjacent literals, and precompute the text if it never
+        # changes.
+        lstMerged = []
+        for tplSegment in self.lstSegments:
+            if lstMerged and tplSegment[0] == SendTemplate.SEG_LITERAL and lstMerged[-1][0] == SendTemplate.SEG_LITERAL:
+                lstMerged[-1] = (SendTemplate.SEG_LITERAL, lstMerged[-1][1] + tplSegment[1])
+            else:
+                lstMerged.append(tplSegment)
+        self.lstSegments = lstMerged
+        self.blnStatic = True
+        for intKind, objValue in self.lstSegments:
+            if intKind != SendTemplate.SEG_LITERAL:
+                self.blnStatic = False
+        if self.blnStatic:
+            self.strStatic = "".join([objValue for intKind, objValue in self.lstSegments])
+
+    def fnExpand(self, reResult, dicVariables):
+        """Expand the template for a match."""
+        if self.blnStatic:
+            return self.strStatic
+        lstParts = []
+        for intKind, objValue in self.lstSegments:
+            if intKind == SendTemplate.SEG_LITERAL:
+                lstParts.append(objValue)
+            elif intKind == SendTemplate.SEG_GROUP:
+                lstParts.append(reResult.group(objValue) or "")
+            else:
+                # Variables hold text from the MUD as unicode, which is
+                # encoded on the way out, so only convert other values.
+                objVariable = dicVariables.get(objValue, "")
+                if not isinstance(objVariable, basestring):
+                    objVariable = str(objVariable)
+                lstParts.append(objVariable)
+        return "".join(lstParts)
+
+class StyleTracker:
+    """Follow the SGR escape sequences from the MUD across lines. A style is
+       a bitfield: the foreground colour (0-7) in the lowest four bits, the
+       background colour above it, and a bit each for bold, italic,
+       underline and inverse."""
+    FOREGROUND = 0x0F
+    BACKGROUND_SHIFT = 4
+    BACKGROUND = 0xF0
+    BOLD = 0x100
+    ITALIC = 0x200
+    UNDERLINE = 0x400
+    INVERSE = 0x800
+    # White on black.
+    DEFAULT = 7
+
+    def __init__(self):
+        self.intStyle = self.DEFAULT
+        # SGR parameters -> the codes in them, so that every distinct
+        # sequence is only split once.
+        self.dicCodes = {}
+
+    def fnApply(self, strParameters):
+        """Apply the parameters of an SGR sequence and return the new style."""
+        tplCodes = self.dicCodes.get(strParameters)
+        if tplCodes == None:
+            tplCodes = tuple([int(strCode or "0") for strCode in strParameters.split(";")])
+            self.dicCodes[strParameters] = tplCodes
+        intStyle = self.intStyle
+        intIndex = 0
+        while intIndex < len(tplCodes):
+            intCode = tplCodes[intIndex]
+            if intCode == 0:
+                intStyle = self.DEFAULT
+            elif 30 <= intCode <= 37:
+                intStyle = (intStyle & ~self.FOREGROUND) | (intCode - 30)
+            elif 40 <= intCode <= 47:
+                intStyle = (intStyle & ~self.BACKGROUND) | ((intCode - 40) << self.BACKGROUND_SHIFT)
+            elif 90 <= intCode <= 97:
+                intStyle = (intStyle & ~self.FOREGROUND) | (intCode - 90)
+            elif 100 <= intCode <= 107:
+                intStyle = (intStyle & ~self.BACKGROUND) | ((intCode - 100) << self.BACKGROUND_SHIFT)
+            elif intCode == 1:
+                intStyle |= self.BOLD
+            elif intCode == 3:
+                intStyle |= self.ITALIC
+            elif intCode == 4:
+                intStyle |= self.UNDERLINE
+            elif intCode == 7:
+                intStyle |= self.INVERSE
+            elif intCode == 22:
+                intStyle &= ~self.BOLD
+            elif intCode == 23:
+                intStyle &= ~self.ITALIC
+            elif intCode == 24:
+                intStyle &= ~self.UNDERLINE
+            elif intCode == 27:
+                intStyle &= ~self.INVERSE
+            elif intCode == 39:
+                intStyle = (intStyle & ~self.FOREGROUND) | (self.DEFAULT & self.FOREGROUND)
+            elif intCode == 49:
+                intStyle &= ~self.BACKGROUND
+            elif intCode in (38, 48):
+                # 256 colour and RGB colours have no place in the bitfield,
+                # skip their arguments.
+                if intIndex + 1 < len(tplCodes) and tplCodes[intIndex + 1] == 5:
+                    intIndex += 2
+                elif intIndex + 1 < len(tplCodes) and tplCodes[intIndex + 1] == 2:
+                    intIndex += 4
+            intIndex += 1
+        self.intStyle = intStyle
+        return intStyle
+
+    def fnCodes(self, intStyle):
+        """Return a style as a list of SGR codes, as plugins see it."""
+        lstCodes = []
+        if intStyle & self.BOLD:
+            lstCodes.append(1)
+        if intStyle & self.ITALIC:
+            lstCodes.append(3)
+        if intStyle & self.UNDERLINE:
+            lstCodes.append(4)
+        if intStyle & self.INVERSE:
+            lstCodes.append(7)
+        lstCodes.append(30 + (intStyle & self.FOREGROUND))
+        lstCodes.append(40 + ((intStyle & self.BACKGROUND) >> self.BACKGROUND_SHIFT))
+        return lstCodes
+
+class ParsedLine:
+    """A line from the MUD, parsed once so that all the triggers and plugins
+       can share its stripped text and styles. The style tracker carries the
+       style over from the previous lines and is left at the style the line
+       ends with."""
+    def __init__(self, strRaw, fmFormatting, trkStyle):
+        self.strRaw = strRaw
+        self.intStartStyle = trkStyle.intStyle
+        lstText = []
+        # Every run of visible text is stored as its offset in the stripped
+        # line and in the raw line, so any stripped offset can be mapped back
+        # to the raw one.
+        self.lstRunStarts = []
+        self.lstRawStarts = []
+        # The styles (see StyleTracker) are stored by the stripped offset
+        # they start at.
+        self.lstStyleStarts = []
+        self.lstStyles = []
+        intStripped = 0
+        intRaw = 0
+        for reMatch in fmFormatting.reANSICodes.finditer(strRaw):
+            intStart, intEnd = reMatch.span()
+            if intStart > intRaw:
+                self.lstRunStarts.append(intStripped)
+                self.lstRawStarts.append(intRaw)
+                lstText.append(strRaw[intRaw:intStart])
+                intStripped += intStart - intRaw
+            intRaw = intEnd
+            strCode = reMatch.group(0)
+            if strCode.startswith("\x1b[") and strCode.endswith("m"):
+                self.lstStyleStarts.append(intStripped)
+                self.lstStyles.append(trkStyle.fnApply(strCode[2:-1]))
+        if intRaw < len(strRaw):
+            self.lstRunStarts.append(intStripped)
+            self.lstRawStarts.append(intRaw)
+            lstText.append(strRaw[intRaw:])
+            intStripped += len(strRaw) - intRaw
+        # The end of the line maps to the end of the raw line, after any
+        # trailing escape sequences.
+        self.lstRunStarts.append(intStripped)
+        self.lstRawStarts.append(len(strRaw))
+        self.strStripped = "".join(lstText)
+        # What the triggers have done to the line for the remote clients:
+        # gagged it, replaced it, or highlighted (raw start, raw end, codes
+        # before, codes after) parts of it.
+        self.blnOmit = False
+        self.strOutput = None
+        self.lstHighlights = []
+
+    def fnRawOffset(self, intOffset):
+        """Return the offset in the raw line of a stripped offset."""
+        intRun = bisect.bisect_right(self.lstRunStarts, intOffset) - 1
+        if intRun < 0:
+            return intOffset
+        return self.lstRawStarts[intRun] + intOffset - self.lstRunStarts[intRun]
+
+    def fnHighlight(self, intStart, intEnd, strBefore, strAfter):
+        """Surround the text between two stripped offsets with codes."""
+        if intStart < intEnd:
+            self.lstHighlights.append((self.fnRawOffset(intStart), self.fnRawOffset(intEnd - 1) + 1, strBefore, strAfter))
+
+    def fnOutput(self):
+        """Return the line as the remote clients should see it, or None if it
+           is gagged."""
+        if self.blnOmit:
+            return None
+        if self.strOutput != None:
+            return self.strOutput
+        if not self.lstHighlights:
+            return self.strRaw
+        self.lstHighlights.sort()
+        lstParts = []
+        intOffset = 0
+        for intStart, intEnd, strBefore, strAfter in self.lstHighlights:
+            if intStart < intOffset:
+                # Overlaps an earlier highlight.
+                continue
+            lstParts.extend((self.strRaw[intOffset:intStart], strBefore, self.strRaw[intStart:intEnd], strAfter))
+            intOffset = intEnd
+        lstParts.append(self.strRaw[intOffset:])
+        return "".join(lstParts)
+
+    def fnStyleAt(self, intOffset):
+        """Return the style in effect at a stripped offset."""
+        intStyle = bisect.bisect_right(self.lstStyleStarts, intOffset) - 1
+        if intStyle < 0:
+            return self.intStartStyle
+        return self.lstStyles[intStyle]
+
+class TimerScheduler:
+    """Keep the enabled timers in a heap ordered by their next deadline and
+       arm a single reactor call for the earliest one."""
+    def __init__(self, fnCallback):
+        # Heap entries are [deadline, counter, plugin, timer, valid]. The
+        # counter keeps entries with equal deadlines in insertion order, and
+        # cancelled entries are marked invalid and skipped when they surface.
+        self.lstHeap = []
+        self.intCounter = 0
+        # Timers that were due while disconnected and are not active when
+        # the world is closed.
+        self.lstParked = []
+        self.dcCall = None
+        self.fnCallback = fnCallback
+
+    def fnSchedule(self, plgPlugin, tmrTimer):
+        """Schedule a timer for its next deadline, replacing any previous
+           schedule. Disabled timers are just unscheduled."""
+        self.fnUnschedule(tmrTimer)
+        if not tmrTimer.blnEnabled:
+            return
+        self.fnPush(plgPlugin, tmrTimer, tmrTimer.fltTime + tmrTimer.getinterval())
+        self.fnArm()
+
+    def fnUnschedule(self, tmrTimer):
+        """Remove a timer from the schedule."""
+        if tmrTimer.lstEntry != None:
+            tmrTimer.lstEntry[-1] = False
+            tmrTimer.lstEntry = None
+
+    def fnPush(self, plgPlugin, tmrTimer, fltDeadline):
+        self.intCounter += 1
+        tmrTimer.lstEntry = [fltDeadline, self.intCounter, plgPlugin, tmrTimer, True]
+        heapq.heappush(self.lstHeap, tmrTimer.lstEntry)
+
+    def fnPopDue(self, fltNow):
+        """Remove and return the (plugin, timer) pairs that are due."""
+        lstDue = []
+        while self.lstHeap and self.lstHeap[0][0] <= fltNow:
+            lstEntry = heapq.heappop(self.lstHeap)
+            if lstEntry[-1]:
+                lstEntry[3].lstEntry = None
+                lstDue.append((lstEntry[2], lstEntry[3]))
+        return lstDue
+
+    def fnPark(self, plgPlugin, tmrTimer):
+        """Hold a due timer until there is a connection again."""
+        self.lstParked.append((plgPlugin, tmrTimer))
+
+    def fnResume(self):
+        """Run the parked timers that are still enabled."""
+        for plgPlugin, tmrTimer in self.lstParked:
+            if tmrTimer.blnEnabled and tmrTimer.lstEntry == None:
+                self.fnPush(plgPlugin, tmrTimer, time.time())
+        self.lstParked = []
+        self.fnArm()
+
+    def fnDeadline(self, tmrTimer):
+        """Return when a timer is due, or None if it is not scheduled."""
+        if tmrTimer.lstEntry != None:
+            return tmrTimer.lstEntry[0]
+        for plgPlugin, tmrParked in self.lstParked:
+            if tmrParked is tmrTimer:
+                return time.time()
+        return None
+
+    def fnDropPlugin(self, plgPlugin):
+        """Unschedule all the timers of a plugin."""
+        for lstEntry in self.lstHeap:
+            if lstEntry[2] is plgPlugin:
+                self.fnUnschedule(lstEntry[3])
+        self.lstParked = [(plgParked, tmrTimer) for plgParked, tmrTimer in self.lstParked if plgParked is not plgPlugin]
+        self.fnArm()
+
+    def fnHasActiveClosed(self):
+        """Return True if a scheduled timer can run without a connection."""
+        for lstEntry in self.lstHeap:
+            if lstEntry[-1] and lstEntry[3].blnActiveClosed:
+                return True
+        return False
+
+    def fnArm(self):
+        """Make sure the reactor calls us at the earliest deadline."""
+        while self.lstHeap and not self.lstHeap[0][-1]:
+            heapq.heappop(self.lstHeap)
+        if not self.lstHeap:
+            if self.dcCall != None and self.dcCall.active():
+                self.dcCall.cancel()
+            self.dcCall = None
+            return
+        fltDelay = max(0, self.lstHeap[0][0] - time.time())
+        if self.dcCall != None and self.dcCall.active():
+            self.dcCall.reset(fltDelay)
+        else:
+            self.dcCall = reactor.callLater(fltDelay, self.fnFire)
+
+    def fnFire(self):
+        self.dcCall = None
+        self.fnCallback()
+
+    def fnStop(self):
+        """Unschedule everything."""
+        for lstEntry in self.lstHeap:
+            lstEntry[3].lstEntry = None
+        self.lstHeap = []
+        self.lstParked = []
+        if self.dcCall != None and self.dcCall.active():
+            self.dcCall.cancel()
+        self.dcCall = None
+
+class CommandQueue:
+    """Hold the commands for the MUD and send them no faster than the
+       configured rate, so that trigger cascades don't trip the MUD's flood
+       protection. Commands from the remote client go in a lane of their own
+       that is sent before the bot's."""
+    LANE_CLIENT = 0
+    LANE_BOT = 1
+
+    def __init__(self, mdBot, fnWrite):
+        self.mdBot = mdBot
+        self.fnWrite = fnWrite
+        # Lane entries are (command, omit from log, time queued).
+        self.lstLanes = [collections.deque(), collections.deque()]
+        # (lane, command) -> number waiting, for coalescing.
+        self.dicWaiting = {}
+        self.fltTokens = float(mdBot.cnfConfiguration.intSendBurst)
+        self.fltUpdated = time.time()
+        self.dcCall = None
+        self.intSent = 0
+        self.intCoalesced = 0
+        self.fltLatency = 0.0
+        self.fltMaxLatency = 0.0
+
+    def fnPut(self, strLine, blnOmitFromLog, intLane):
+        """Queue a command, or send it now if nothing is waiting and the
+           rate allows it."""
+        cnfConfiguration = self.mdBot.cnfConfiguration
+        if cnfConfiguration.fltSendRate <= 0 and self.fnDepth() == 0:
+            self.fnWrite(strLine, blnOmitFromLog)
+            self.intSent += 1
+            return
+        tplKey = (intLane, strLine)
+        if cnfConfiguration.blnCoalesce and tplKey in self.dicWaiting:
+            self.intCoalesced += 1
+            return
+        self.dicWaiting[tplKey] = self.dicWaiting.get(tplKey, 0) + 1
+        self.lstLanes[intLane].append((strLine, blnOmitFromLog, time.time()))
+        self.fnRun()
+
+    def fnRefill(self, fltNow):
+        cnfConfiguration = self.mdBot.cnfConfiguration
+        self.fltTokens = min(float(cnfConfiguration.intSendBurst), self.fltTokens + (fltNow - self.fltUpdated) * cnfConfiguration.fltSendRate)
+        self.fltUpdated = fltNow
+
+    def fnRun(self):
+        """Send as many commands as the rate allows and arm a reactor call
+           for the rest."""
+        if self.dcCall != None and self.dcCall.active():
+            return
+        self.dcCall = None
+        fltRate = self.mdBot.cnfConfiguration.fltSendRate
+        fltNow = time.time()
+        self.fnRefill(fltNow)
+        for intLane in (self.LANE_CLIENT, self.LANE_BOT):
+            dqLane = self.lstLanes[intLane]
+            while dqLane and (fltRate <= 0 or self.fltTokens >= 1):
+                strLine, blnOmitFromLog, fltQueued = dqLane.popleft()
+                tplKey = (intLane, strLine)
+                self.dicWaiting[tplKey] -= 1
+                if not self.dicWaiting[tplKey]:
+                    del self.dicWaiting[tplKey]
+                if fltRate > 0:
+                    self.fltTokens -= 1
+                self.fltLatency = fltNow - fltQueued
+                if self.fltLatency > self.fltMaxLatency:
+                    self.fltMaxLatency = self.fltLatency
+                self.intSent += 1
+                self.fnWrite(strLine, blnOmitFromLog)
+                if self.mdBot.blnExited:
+                    # Writing failed and the session has ended.
+                    return
+        if self.fnDepth() > 0 and fltRate > 0:
+            self.dcCall = reactor.callLater((1 - self.fltTokens) / fltRate, self.fnRun)
+
+    def fnDepth(self):
+        """Return the number of commands waiting."""
+        return len(self.lstLanes[0]) + len(self.lstLanes[1])
+
+    def fnGetCommands(self):
+        """Return the waiting commands in the order they will be sent."""
+        return [tplEntry[0] for tplEntry in self.lstLanes[0]] + [tplEntry[0] for tplEntry in self.lstLanes[1]]
+
+    def fnClear(self):
+        """Drop the waiting commands and return how many there were."""
+        intDepth = self.fnDepth()
+        self.lstLanes = [collections.deque(), collections.deque()]
+        self.dicWaiting = {}
+        if self.dcCall != None and self.dcCall.active():
+            self.dcCall.cancel()
+        self.dcCall = None
+        return intDepth
+
+    def fnReset(self):
+        """Drop the waiting commands and start again with a full burst, for
+           a new connection."""
+        self.fnClear()
+        self.fltTokens = float(self.mdBot.cnfConfiguration.intSendBurst)
+        self.fltUpdated = time.time()
+
+class CodeCache:
+    """A bounded cache of compiled code objects, keyed by their source."""
+    def __init__(self, intSize = 256):
+        self.intSize = intSize
+        # Source -> [code object, last use].
+        self.dicCode = {}
+        self.intTick = 0
+
+    def fnGet(self, strCode):
+        """Return the compiled code, compiling it if it is not cached."""
+        self.intTick += 1
+        lstEntry = self.dicCode.get(strCode)
+        if lstEntry == None:
+            if len(self.dicCode) >= self.intSize:
+                self.fnEvict()
+            lstEntry = [compile(strCode, "<send>", "exec"), 0]
+            self.dicCode[strCode] = lstEntry
+        lstEntry[1] = self.intTick
+        return lstEntry[0]
+
+    def fnEvict(self):
+        """Drop the least recently used half of the cache."""
+        lstEntries = self.dicCode.items()
+        lstEntries.sort(key = lambda tplEntry: tplEntry[1][1])
+        for strCode, lstEntry in lstEntries[:len(lstEntries) // 2 + 1]:
+            del self.dicCode[strCode]
+
+class Stats:
+    """Call counts, matches and times of triggers, aliases, timers, plugin
+       scripts and of the matching passes themselves. The time of a
+       trigger, alias or timer includes the scripts it runs."""
+    def __init__(self):
+        # id(item) -> [kind, plugin, item, calls, matches, seconds, most
+        # seconds]. The item is kept so that its id is not reused.
+        self.dicCounters = {}
+        self.fltStarted = time.time()
+
+    def fnAdd(self, strKind, plgPlugin, objItem, fltTime, blnMatched = False):
+        lstCounter = self.dicCounters.get(id(objItem))
+        if lstCounter == None:
+            lstCounter = [strKind, plgPlugin, objItem, 0, 0, 0.0, 0.0]
+            self.dicCounters[id(objItem)] = lstCounter
+        lstCounter[3] += 1
+        if blnMatched:
+            lstCounter[4] += 1
+        lstCounter[5] += fltTime
+        if fltTime > lstCounter[6]:
+            lstCounter[6] = fltTime
+
+    def fnDropPlugin(self, plgPlugin):
+        """Forget the counters of a plugin and of its items."""
+        for intID, lstCounter in self.dicCounters.items():
+            if lstCounter[1] is plgPlugin:
+                del self.dicCounters[intID]
+
+    def fnGetStats(self):
+        """Return (kind, plugin, name, calls, matches, seconds, most seconds)
+           tuples, slowest first. The plugin is "" for the matching passes."""
+        lstStats = []
+        for strKind, plgPlugin, objItem, intCalls, intMatches, fltTime, fltMax in self.dicCounters.values():
+            if strKind == "core":
+                strPlugin = ""
+                strName = objItem
+            elif strKind == "plugin":
+                strPlugin = plgPlugin.strName
+                strName = plgPlugin.strName
+            else:
+                strPlugin = plgPlugin.strName
+                if strKind == "timer":
+                    strName = objItem.strName or objItem.strSend
+                else:
+                    strName = objItem.strName or objItem.strMatch
+            lstStats.append((strKind, strPlugin, strName, intCalls, intMatches, fltTime, fltMax))
+        lstStats.sort(key = lambda tplStat: -tplStat[5])
+        return lstStats
+
+    def fnReport(self):
+        """Return the counters as lines of text, slowest first."""
+        lstLines = ["Counting for %d seconds." % (time.time() - self.fltStarted)]
+        lstLines.append("%-8s %9s %9s %11s %9s  %s" % ("Kind", "Calls", "Matches", "Time (ms)", "Max (ms)", "Name"))
+        for strKind, strPlugin, strName, intCalls, intMatches, fltTime, fltMax in self.fnGetStats():
+            if strPlugin and strKind != "plugin":
+                strName = "%s: %s" % (strPlugin, strName)
+            lstLines.append("%-8s %9d %9d %11.3f %9.3f  %s" % (strKind, intCalls, intMatches, fltTime * 1000, fltMax * 1000, strName))
+        return lstLines
+
+class SessionRecorder:
+    """Raw MUD traffic saved with timestamps, for replaying it later. Each
+       record is a direction, the time and the length of the data, followed
+       by the data."""
+    REC_IN = "<"
+    REC_OUT = ">"
+    # Lines typed by remote clients, before aliases.
+    REC_CLIENT = "|"
+    HEADER = "!cdI"
+
+    def __init__(self, strFilename, strMode = "ab"):
+        self.flFile = file(strFilename, strMode)
+
+    def fnRecord(self, strDirection, strData):
+        self.flFile.write(struct.pack(SessionRecorder.HEADER, strDirection, time.time(), len(strData)) + strData)
+
+    def fnRead(self):
+        """Return the records as (direction, time, data) tuples."""
+        strData = self.flFile.read()
+        intHeader = struct.calcsize(SessionRecorder.HEADER)
+        lstRecords = []
+        intOffset = 0
+        while intOffset + intHeader <= len(strData):
+            strDirection, fltTime, intLength = struct.unpack(SessionRecorder.HEADER, strData[intOffset:intOffset + intHeader])
+            intOffset += intHeader
+            if intOffset + intLength > len(strData):
+                # The recording was cut short.
+                break
+            lstRecords.append((strDirection, fltTime, strData[intOffset:intOffset + intLength]))
+            intOffset += intLength
+        return lstRecords
+
+    def fnClose(self):
+        self.flFile.close()
+
+class ReplayConnection:
+    """Stands in for MUDConnection when replaying, counting what would have
+       been sent."""
+    def __init__(self):
+        self.intSent = 0
+    def write(self, data):
+        pass
+    def sendLine(self, line):
+        self.intSent += 1
+    def close(self):
+        pass
+
+class LogWriter:
+    """Collect log lines in memory and write them to the log file in
+       batches, rotating it by date or size if configured."""
+    def __init__(self, insMUDdrop):
+        self.mdBot = insMUDdrop
+        self.cnfConfiguration = insMUDdrop.cnfConfiguration
+        self.fmFormatting = insMUDdrop.fmFormatting
+        # Template -> template with the name macros expanded.
+        self.dicTemplates = {}
+        # Template -> (second, fully expanded text).
+        self.dicExpanded = {}
+        self.lstBuffer = []
+        self.intBuffered = 0
+        self.dcFlush = None
+        self.strFilename = self.fnExpand(self.cnfConfiguration.strLogFile)
+        self.flFile = file(self.strFilename, "a")
+
+    def fnExpand(self, strTemplate):
+        """Expand a template, reusing the result for the rest of the second."""
+        intNow = int(time.time())
+        tplExpanded = self.dicExpanded.get(strTemplate)
+        if tplExpanded != None and tplExpanded[0] == intNow:
+            return tplExpanded[1]
+        if strTemplate not in self.dicTemplates:
+            self.dicTemplates[strTemplate] = self.fmFormatting.fnExpandNameMacros(strTemplate, self.mdBot)
+        strExpanded = time.strftime(self.dicTemplates[strTemplate], time.localtime(intNow))
+        self.dicExpanded[strTemplate] = (intNow, strExpanded)
+        return strExpanded
+
+    def fnWrite(self, strPrepend, strText, strAppend, strEnd = "\n", strDirection = None):
+        """Add a line to the log. The direction is only kept by the indexed
+           log."""
+        if self.cnfConfiguration.blnLogRotate:
+            strFilename = self.fnExpand(self.cnfConfiguration.strLogFile)
+            if strFilename != self.strFilename:
+                # The date in the filename has changed, start a new file.
+                self.fnFlush()
+                self.flFile.close()
+                self.strFilename = strFilename
+                self.flFile = file(self.strFilename, "a")
+        strLine = "%s%s%s%s" % (self.fnExpand(strPrepend), self.mdBot.fnEncode(strText), self.fnExpand(strAppend), strEnd)
+        self.lstBuffer.append(strLine)
+        self.intBuffered += len(strLine)
+        if self.intBuffered >= self.cnfConfiguration.intLogBufferSize:
+            self.fnFlush()
+        elif self.dcFlush == None:
+            self.dcFlush = reactor.callLater(self.cnfConfiguration.fltLogFlushInterval, self.fnFlush)
+
+    def fnFlush(self):
+        """Write the buffered lines to the file."""
+        if self.dcFlush != None:
+            if self.dcFlush.active():
+                self.dcFlush.cancel()
+            self.dcFlush = None
+        if not self.lstBuffer:
+            return
+        if self.cnfConfiguration.intLogMaxSize and self.flFile.tell() + self.intBuffered > self.cnfConfiguration.intLogMaxSize:
+            self.fnRotate()
+        self.flFile.write("".join(self.lstBuffer))
+        self.flFile.flush()
+        self.lstBuffer = []
+        self.intBuffered = 0
+
+    def fnRotate(self):
+        """Move the full log file out of the way and start a new one."""
+        self.flFile.close()
+        intCounter = 1
+        while os.path.exists("%s.%s" % (self.strFilename, intCounter)):
+            intCounter += 1
+        os.rename(self.strFilename, "%s.%s" % (self.strFilename, intCounter))
+        self.flFile = file(self.strFilename, "a")
+
+    def fnClose(self):
+        """Flush and close the log file."""
+        self.fnFlush()
+        self.flFile.close()
+
+class IndexedLog:
+    """Write the log as compressed segments, a new one every segment
+       interval, each line stored as its time, direction and text. A segment
+       is a series of gzip members, one per block of lines, so zcat still
+       reads it. Its .idx file has a line per block with the block's offset,
+       size, first and last time, line count and the words in it, so that
+       fnSearchLog only decompresses the blocks that can match."""
+    LOG_IN = "<"
+    LOG_OUT = ">"
+    LOG_NOTE = "#"
+    # Words shorter than this are not indexed.
+    reWords = re.compile(r"\w{3,}")
+
+    def __init__(self, insMUDdrop):
+        self.mdBot = insMUDdrop
+        self.cnfConfiguration = insMUDdrop.cnfConfiguration
+        self.strTemplate = insMUDdrop.fmFormatting.fnExpandNameMacros(self.cnfConfiguration.strLogFile, insMUDdrop)
+        self.intSegment = None
+        self.strFilename = None
+        self.lstBlock = []
+        self.intBlockBytes = 0
+        self.fltFirst = 0.0
+        self.fltLast = 0.0
+        self.dicWords = {}
+        self.dcFlush = None
+
+    def fnWrite(self, strPrepend, strText, strAppend, strEnd = "\n", strDirection = LOG_NOTE):
+        """Add a line to the log. The prepended and appended text is left
+           out, the time and direction are kept instead."""
+        fltNow = time.time()
+        intInterval = self.cnfConfiguration.intLogSegmentInterval
+        intSegment = int(fltNow) / intInterval * intInterval
+        if intSegment != self.intSegment:
+            self.fnFlush()
+            self.intSegment = intSegment
+            tplTime = time.localtime(intSegment)
+            self.strFilename = time.strftime(self.strTemplate, tplTime) + time.strftime(".%Y%m%d-%H%M%S.gz", tplTime)
+        if not self.lstBlock:
+            self.fltFirst = fltNow
+        self.fltLast = fltNow
+        for strLine in self.mdBot.fnEncode(strText).split("\n"):
+            strRecord = "%.3f\t%s\t%s\n" % (fltNow, strDirection, strLine)
+            self.lstBlock.append(strRecord)
+            self.intBlockBytes += len(strRecord)
+            for strWord in self.reWords.findall(strLine.lower()):
+                self.dicWords[strWord] = True
+        if self.intBlockBytes >= self.cnfConfiguration.intLogBufferSize:
+            self.fnFlush()
+        elif self.dcFlush == None:
+            self.dcFlush = reactor.callLater(self.cnfConfiguration.fltLogBlockInterval, self.fnFlush)
+
+    def fnFlush(self):
+        """Write the block to the segment and index it."""
+        if self.dcFlush != None:
+            if self.dcFlush.active():
+                self.dcFlush.cancel()
+            self.dcFlush = None
+        if not self.lstBlock:
+            return
+        # A gzip member of its own, so that it can be read on its own.
+        zcCompressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        strMember = zcCompressor.compress("".join(self.lstBlock)) + zcCompressor.flush()
+        lstWords = self.dicWords.keys()
+        lstWords.sort()
+        try:
+            if os.path.exists(self.strFilename):
+                intOffset = os.path.getsize(self.strFilename)
+            else:
+                intOffset = 0
+            flSegment = file(self.strFilename, "ab")
+            flSegment.write(strMember)
+            flSegment.close()
+            # The index is written after the data, so a block that is in the
+            # index is always complete.
+            flIndex = file(os.path.splitext(self.strFilename)[0] + ".idx", "a")
+            flIndex.write("%d %d %.3f %.3f %d %s\n" % (intOffset, len(strMember), self.fltFirst, self.fltLast, len(self.lstBlock), " ".join(lstWords)))
+            flIndex.close()
+        except (IOError, OSError):
+            self.mdBot.fnNoteData("Could not write to the log '%s'." % self.strFilename, blnOmitLog = True)
+        self.lstBlock = []
+        self.intBlockBytes = 0
+        self.dicWords = {}
+
+    def fnClose(self):
+        """Write what is left."""
+        self.fnFlush()
+
+def fnSearchLog(strFilename, strPattern, fltSince = None, fltUntil = None):
+    """Return the (time, direction, text) records of an indexed log segment
+       that are in the time range and whose text matches strPattern. Blocks
+       outside the time range, or without all the words of the literal text
+       the pattern requires, are not decompressed."""
+    reSearch = re.compile(strPattern)
+    strLiteral, blnAnchored = Formatting().fnRequiredLiteral(strPattern)
+    lstWords = IndexedLog.reWords.findall(strLiteral.lower())
+    lstRecords = []
+    flIndex = file(os.path.splitext(strFilename)[0] + ".idx")
+    flSegment = file(strFilename, "rb")
+    for strEntry in flIndex:
+        lstFields = strEntry.split()
+        if len(lstFields) < 5 or not strEntry.endswith("\n"):
+            # A line cut short by a crash.
+            continue
+        fltFirst = float(lstFields[2])
+        fltLast = float(lstFields[3])
+        if (fltSince != None and fltLast < fltSince) or (fltUntil != None and fltFirst > fltUntil):
+            continue
+        setWords = set(lstFields[5:])
+        blnPossible = True
+        for strWord in lstWords:
+            if strWord in setWords:
+                continue
+            # The literal may start or end in the middle of a word.
+            for strIndexed in setWords:
+                if strWord in strIndexed:
+                    break
+            else:
+                blnPossible = False
+                break
+        if not blnPossible:
+            continue
+        flSegment.seek(int(lstFields[0]))
+        strBlock = zlib.decompress(flSegment.read(int(lstFields[1])), 16 + zlib.MAX_WBITS)
+        for strRecord in strBlock.splitlines():
+            strTime, strDirection, strText = strRecord.split("\t", 2)
+            fltTime = float(strTime)
+            if (fltSince != None and fltTime < fltSince) or (fltUntil != None and fltTime > fltUntil):
+                continue
+            if reSearch.search(strText):
+                lstRecords.append((fltTime, strDirection, strText))
+    flSegment.close()
+    flIndex.close()
+    return lstRecords
+
+def fnReplaceFile(strSource, strTarget):
+    """Rename strSource over strTarget."""
+    try:
+        os.rename(strSource, strTarget)
+    except OSError:
+        # Windows will not rename over an existing file.
+        os.remove(strTarget)
+        os.rename(strSource, strTarget)
+
+class Scrollback:
+    """The most recent lines from the MUD, kept in zlib-compressed blocks.
+       Whole blocks are dropped from the front once the newer ones hold at
+       least intMaxLines lines or intMaxBytes bytes."""
+    BLOCK_LINES = 256
+    BLOCK_BYTES = 65536
+
+    def __init__(self, intMaxLines, intMaxBytes):
+        self.fnSetLimits(intMaxLines, intMaxBytes)
+        # Blocks are (compressed lines, line count, uncompressed size).
+        self.dqBlocks = collections.deque()
+        self.intLines = 0
+        self.intBytes = 0
+        # The newest lines, not yet compressed.
+        self.lstTail = []
+        self.intTailBytes = 0
+
+    def fnSetLimits(self, intMaxLines, intMaxBytes):
+        self.intMaxLines = intMaxLines
+        self.intMaxBytes = intMaxBytes
+        # Small limits get small blocks, so that they are kept to closely.
+        self.intBlockLines = max(1, min(self.BLOCK_LINES, intMaxLines / 4))
+        self.intBlockBytes = max(1, min(self.BLOCK_BYTES, intMaxBytes / 4))
+
+    def fnAdd(self, strLine):
+        """Add a line (bytes, without the newline)."""
+        if self.intMaxLines <= 0 or self.intMaxBytes <= 0:
+            return
+        self.lstTail.append(strLine)
+        self.intTailBytes += len(strLine) + 1
+        self.intLines += 1
+        self.intBytes += len(strLine) + 1
+        if len(self.lstTail) >= self.intBlockLines or self.intTailBytes >= self.intBlockBytes:
+            self.dqBlocks.append((zlib.compress("\n".join(self.lstTail)), len(self.lstTail), self.intTailBytes))
+            self.lstTail = []
+            self.intTailBytes = 0
+        while self.dqBlocks and (self.intLines - self.dqBlocks[0][1] >= self.intMaxLines or self.intBytes - self.dqBlocks[0][2] >= self.intMaxBytes):
+            strBlock, intBlockLines, intBlockBytes = self.dqBlocks.popleft()
+            self.intLines -= intBlockLines
+            self.intBytes -= intBlockBytes
+
+    def fnGetLines(self, intCount = None):
+        """Return the last intCount lines, oldest first, or all of them.
+           Only the blocks that are needed are decompressed."""
+        if intCount == None or intCount > self.intMaxLines:
+            intCount = self.intMaxLines
+        if intCount <= 0:
+            return []
+        lstLines = self.lstTail[-intCount:]
+        for strBlock, intBlockLines, intBlockBytes in reversed(self.dqBlocks):
+            if len(lstLines) >= intCount:
+                break
+            lstLines[0:0] = zlib.decompress(strBlock).split("\n")[-(intCount - len(lstLines)):]
+        return lstLines
+
+class StateStore:
+    """A plugin's saved variables. Only variables that changed since the
+       last write are considered, writes are delayed so that several saves
+       become one, and the state file is replaced atomically. With the
+       journal enabled, changes are appended to it instead and folded back
+       into the state file once it grows past intCompact entries."""
+    def __init__(self, strFilename, dicVariables, fltDelay = 5, blnJournal = False, intCompact = 1000, strCharset = "latin-1"):
+        self.strFilename = strFilename
+        self.strJournal = os.path.splitext(strFilename)[0] + ".journal"
+        # The plugin's dictionary, shared.
+        self.dicVariables = dicVariables
+        self.fltDelay = fltDelay
+        self.blnJournal = blnJournal
+        self.intCompact = intCompact
+        # Variables holding bytes from the MUD are saved as text.
+        self.strCharset = strCharset
+        # Names of the variables changed or deleted since the last write.
+        self.dicDirty = {}
+        # Every write of the state file starts a new generation; journal
+        # entries older than the state file are ignored.
+        self.intGeneration = 0
+        self.intJournalEntries = 0
+        self.dcFlush = None
+
+    def fnLoaded(self, xmlState):
+        """Note the generation of the state file that was read."""
+        try:
+            self.intGeneration = int(xmlState.find("variables").attrib.get("generation", 0))
+        except:
+            self.intGeneration = 0
+
+    def fnReplay(self):
+        """Apply the journal to the variables."""
+        try:
+            flJournal = file(self.strJournal)
+        except:
+            return
+        for strLine in flJournal:
+            if not strLine.endswith("\n"):
+                # A line cut short by a crash.
+                break
+            lstFields = strLine.split()
+            try:
+                if int(lstFields[0]) < self.intGeneration:
+                    continue
+                # The names are written as UTF-8.
+                strName = base64.b64decode(lstFields[1]).decode("utf-8")
+                if len(lstFields) == 4:
+                    # Text, rather than bytes.
+                    self.dicVariables[strName] = base64.b64decode(lstFields[2]).decode("utf-8")
+                elif len(lstFields) == 3:
+                    self.dicVariables[strName] = base64.b64decode(lstFields[2])
+                elif strName in self.dicVariables:
+                    del self.dicVariables[strName]
+            except:
+                continue
+            self.intJournalEntries += 1
+        flJournal.close()
+
+    def fnChanged(self, strName):
+        """Mark a variable as changed or deleted."""
+        self.dicDirty[strName] = True
+
+    def fnSave(self):
+        """Write the changes after a short delay."""
+        if self.dcFlush == None or not self.dcFlush.active():
+            self.dcFlush = reactor.callLater(self.fltDelay, self.fnFlush)
+
+    def fnFlush(self):
+        """Write the changes now."""
+        if self.dcFlush != None and self.dcFlush.active():
+            self.dcFlush.cancel()
+        self.dcFlush = None
+        if not self.dicDirty:
+            return
+        if self.blnJournal and self.intJournalEntries + len(self.dicDirty) <= self.intCompact:
+            blnWritten = self.fnAppendJournal()
+        else:
+            blnWritten = self.fnWriteState()
+        if blnWritten:
+            self.dicDirty = {}
+
+    def fnAppendJournal(self):
+        lstLines = []
+        for strName in self.dicDirty:
+            if isinstance(strName, unicode):
+                strEncodedName = base64.b64encode(strName.encode("utf-8"))
+            else:
+                strEncodedName = base64.b64encode(strName)
+            if strName not in self.dicVariables:
+                lstLines.append("%s %s\n" % (self.intGeneration, strEncodedName))
+            elif isinstance(self.dicVariables[strName], unicode):
+                lstLines.append("%s %s %s u\n" % (self.intGeneration, strEncodedName, base64.b64encode(self.dicVariables[strName].encode("utf-8"))))
+            else:
+                lstLines.append("%s %s %s\n" % (self.intGeneration, strEncodedName, base64.b64encode(str(self.dicVariables[strName]))))
+        try:
+            flJournal = file(self.strJournal, "a")
+            flJournal.write("".join(lstLines))
+            flJournal.close()
+        except (IOError, OSError):
+            return False
+        self.intJournalEntries += len(lstLines)
+        return True
+
+    def fnWriteState(self):
+        """Write all the variables to the state file and drop the journal."""
+        xmlRoot = ET.Element("muclient")
+        xmlRoot.append(ET.Element("variables"))
+        xmlVariables = xmlRoot[0]
+        xmlVariables.attrib = {"muclient_version": "3", "world_file_version": "1", "date_saved": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()), "generation": str(self.intGeneration + 1)}
+
+        for strKey, strValue in self.dicVariables.items():
+            etElement = ET.Element("variable")
+            etElement.attrib = {"name": strKey}
+            if not isinstance(strValue, basestring):
+                strValue = str(strValue)
+            if isinstance(strValue, str):
+                strValue = strValue.decode(self.strCharset, "replace")
+            etElement.text = strValue
+            xmlVariables.append(etElement)
+
+        # Write a temporary file and rename it over the old one, so that a
+        # crash leaves either the old state or the new one.
+        strTemporary = self.strFilename + ".tmp"
+        try:
+            flState = file(strTemporary, "w")
+            ET.ElementTree(xmlRoot).write(flState)
+            flState.flush()
+            os.fsync(flState.fileno())
+            flState.close()
+            fnReplaceFile(strTemporary, self.strFilename)
+        except (IOError, OSError):
+            return False
+        self.intGeneration += 1
+        if os.path.exists(self.strJournal):
+            try:
+                os.remove(self.strJournal)
+            except OSError:
+                pass
+        self.intJournalEntries = 0
+        return True
+
+class ConfigCache:
+    """Parsed character and plugin files, kept on disk so that files that
+       have not changed don't have to be parsed again. Entries are keyed on
+       the file's path, modification time and MD5 digest."""
+    def __init__(self, strDirectory = "cache"):
+        # None disables the cache.
+        self.strDirectory = strDirectory
+        # Entries written by another version of this file are not used.
+        try:
+            self.fltCodeTime = os.path.getmtime(__file__)
+        except OSError:
+            self.fltCodeTime = 0
+
+    def fnKey(self, strFilename):
+        """Return the key of a file, or None if it cannot be read."""
+        try:
+            flFile = file(strFilename, "rb")
+            strDigest = md5.new(flFile.read()).hexdigest()
+            flFile.close()
+            fltMTime = os.path.getmtime(strFilename)
+        except (IOError, OSError):
+            return None
+        # Code objects are only good for the Python that marshalled them.
+        return (os.path.abspath(strFilename), fltMTime, strDigest, sys.version, self.fltCodeTime)
+
+    def fnCacheFile(self, tplKey):
+        return os.path.join(self.strDirectory, md5.new(tplKey[0]).hexdigest() + ".cache")
+
+    def fnLoad(self, tplKey):
+        """Return the cached data for a key, or None."""
+        if self.strDirectory == None or tplKey == None:
+            return None
+        try:
+            flCache = file(self.fnCacheFile(tplKey), "rb")
+            tplCachedKey, dicData = cPickle.load(flCache)
+            flCache.close()
+        except:
+            return None
+        if tplCachedKey != tplKey:
+            return None
+        return dicData
+
+    def fnStore(self, tplKey, dicData):
+        """Cache the data for a key."""
+        if self.strDirectory == None or tplKey == None:
+            return
+        strCache = self.fnCacheFile(tplKey)
+        try:
+            if not os.path.isdir(self.strDirectory):
+                os.makedirs(self.strDirectory)
+            # Only the owner may read the cached files.
+            flCache = os.fdopen(os.open(strCache + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0600), "wb")
+            cPickle.dump((tplKey, dicData), flCache, cPickle.HIGHEST_PROTOCOL)
+            flCache.close()
+            fnReplaceFile(strCache + ".tmp", strCache)
+        except:
+            # The cache is only an optimisation.
+            pass
+
+class ConfigurationError(Exception):
+    """A character or plugin file could not be loaded."""
+
+class SessionManager:
+    """Run several characters in one process, each in its own MUDdrop
+       instance, on a shared reactor."""
+    def __init__(self, strCacheDirectory = "cache", strRecord = None):
+        self.lstSessions = []
+        self.ccConfig = ConfigCache(strCacheDirectory)
+        # File to record the sessions' traffic to, with macros.
+        self.strRecord = strRecord
+
+    def fnStart(self, strFilename, blnConnect = True):
+        """Load a character file and connect it. Return the new session, or
+           None if the file could not be loaded."""
+        try:
+            mdBot = MUDdrop(self, strFilename, blnConnect)
+        except ConfigurationError:
+            print "Could not load '%s', skipping it." % strFilename
+            return None
+        self.lstSessions.append(mdBot)
+        return mdBot
+
+    def fnReload(self):
+        """Reload the changed files of every session."""
+        for mdBot in self.lstSessions:
+            mdBot.fnReload()
+
+    def fnSessionEnded(self, mdBot):
+        """Forget a session that has exited, and stop when none are left."""
+        if mdBot in self.lstSessions:
+            self.lstSessions.remove(mdBot)
+        if not self.lstSessions:
+            try:
+                reactor.stop()
+            except:
+                # The reactor is already stopping or hasn't started.
+                pass
+
+class MUDdrop:
+    def __init__(self, smSessions, strFilename, blnConnect = True):
+        """Initialise stuff."""
+        self.smSessions = smSessions
+        self.blnExited = False
+        # Errors abort the load instead of exiting while this is set.
+        self.blnLoading = True
+        self.cnfConfiguration = None
+        self.strBuffer = ""
+        self.fmFormatting = Formatting()
+        self.stConnectionState = AC_DISCONNECTED
+        # Remote user connection.
+        self.cntClientConnection = None
+        # The style the MUD's output has got to.
+        self.trkStyle = StyleTracker()
+        # The line currently being processed.
+        self.plLine = None
+        self.cntConnection = None
+        self.lwLog = None
+        # Raw traffic recorder, if recording.
+        self.srRecorder = None
+        # Trigger and script counters, if profiling.
+        self.stStats = None
+        # Connection counters, and the pending reconnection, if any.
+        self.fltStarted = time.time()
+        self.fltConnected = None
+        self.intConnections = 0
+        self.intAttempts = 0
+        self.dcReconnect = None
+        # Set when a plugin disconnects on purpose.
+        self.blnStayDisconnected = False
+        # Traffic and error counters, for the metrics.
+        self.intLinesIn = 0
+        self.intLinesOut = 0
+        self.intBytesIn = 0
+        self.intBytesOut = 0
+        self.intTriggerFires = 0
+        self.intErrors = 0
+        # Commands for the MUD waiting to be sent, and the lane that
+        # fnSendData puts them in.
+        self.cqQueue = None
+        self.intSendLane = CommandQueue.LANE_BOT
+        self.tsTimers = TimerScheduler(self.fnHandleTimers)
+        self.ccCode = CodeCache()
+        self.cnfConfiguration = Configuration(self, strFilename)
+        self.blnLoading = False
+        self.cqQueue = CommandQueue(self, self.fnWriteLine)
+        # Recent output, for remote clients that attach later.
+        self.sbScrollback = Scrollback(self.cnfConfiguration.intScrollbackLines, self.cnfConfiguration.intScrollbackBytes)
+        if self.cnfConfiguration.blnProfile:
+            self.stStats = Stats()
+        self.dcStatsDump = None
+        if self.cnfConfiguration.strStatsFile != "":
+            self.dcStatsDump = reactor.callLater(self.cnfConfiguration.fltStatsInterval, self.fnDumpStats)
+        for plgPlugin in self.cnfConfiguration.dicPlugins.values():
+            plgPlugin.scheduletimers()
+        if blnConnect:
+            self.cntConnection = MUDConnection(self, self.cnfConfiguration.strHost, self.cnfConfiguration.intPort)
+        # Execute the plugins' OnPluginInstall callback.
+        self.fnCallPluginFunction("OnPluginInstall", ())
+
+    def fnSavePlugins(self):
+        """Save all the plugins' states."""
+        if self.cnfConfiguration == None:
+            return
+        for plgPlugin in self.cnfConfiguration.dicPlugins.values():
+            plgPlugin.savestate(True)
+
+    def fnExecCode(self, strCode, plgPlugin, objItem = None):
+        """Execute some code. If objItem (a trigger, alias or timer) is
+           given, the compiled code is kept on it for as long as its
+           source does not change."""
+        # Text from the MUD in the code ends up in its string literals, which
+        # are bytes in the MUD's character set, as they were before decoding.
+        strCode = self.fnEncode(strCode)
+        try:
+            # Triggers and aliases compare by sequence, hence the "is".
+            if objItem is None:
+                coCode = self.ccCode.fnGet(strCode)
+            elif objItem.strCodeSource == strCode:
+                coCode = objItem.coCode
+            else:
+                coCode = self.ccCode.fnGet(strCode)
+                objItem.strCodeSource = strCode
+                objItem.coCode = coCode
+            if self.stStats == None:
+                exec(coCode, {"world": plgPlugin.cbWorld})
+            else:
+                fltStart = time.time()
+                try:
+                    exec(coCode, {"world": plgPlugin.cbWorld})
+                finally:
+                    self.stStats.fnAdd("plugin", plgPlugin, plgPlugin, time.time() - fltStart)
+        except:
+            self.fnException(sys.exc_type, sys.exc_value, sys.exc_traceback)
+
+    def fnReplay(self, strFilename):
+        """Feed a recorded session through the triggers and aliases, with
+           nothing sent to the network. Return the number of lines and the
+           seconds it took."""
+        self.stStats = Stats()
+        # Nothing goes on the wire, so there is nothing to hold back.
+        self.cnfConfiguration.fltSendRate = 0
+        self.cntConnection = ReplayConnection()
+        self.stConnectionState = AC_CONNECTED
+        tpTelnet = TelnetParser(self, self.cntConnection.write, self.cnfConfiguration.blnMCCP)
+        lfFramer = LineFramer(self.cnfConfiguration.intMaxLineLength, self.cnfConfiguration.strCharset)
+        srRecording = SessionRecorder(strFilename, "rb")
+        lstRecords = srRecording.fnRead()
+        srRecording.fnClose()
+        intLines = 0
+        fltStart = time.time()
+        for strDirection, fltTime, strData in lstRecords:
+            if strDirection == SessionRecorder.REC_IN:
+                for strLine in lfFramer.fnFeed(tpTelnet.fnFeed(strData)):
+                    self.fnProcessData(strLine)
+                    intLines += 1
+            elif strDirection == SessionRecorder.REC_CLIENT:
+                self.fnMatchAliases(strData.decode(self.cnfConfiguration.strCharset, "replace"))
+        return intLines, time.time() - fltStart
+
+    def fnCallPluginFunction(self, strFunctionCall, tplArguments):
+        """Call the specified function in all plugins."""
+        for plgPlugin in self.cnfConfiguration.dicPlugins.values():
+            plgPlugin.run(strFunctionCall, tplArguments, True)
+
+    def fnReload(self, tplForce = ()):
+        """Reload the character and plugin files that have changed, and the
+           plugins whose IDs are in tplForce. This is done from the reactor,
+           so the triggers and aliases never change in the middle of a
+           line."""
+        reactor.callLater(0, self.fnDoReload, tplForce)
+
+    def fnDoReload(self, tplForce):
+        if self.blnExited:
+            return
+        cnfOld = self.cnfConfiguration
+        ccConfig = self.smSessions.ccConfig
+        dicOld = cnfOld.dicPlugins
+        # Plugins whose files haven't changed are kept as they are, by
+        # filename.
+        dicUnchanged = {}
+        for plgPlugin in dicOld.values():
+            if plgPlugin.strID not in tplForce and plgPlugin.tplKey != None and plgPlugin.tplKey == ccConfig.fnKey(plgPlugin.strFilename):
+                dicUnchanged[plgPlugin.strFilename] = plgPlugin
+        if len(dicUnchanged) == len(dicOld):
+            self.fnNoteData("Nothing to reload.")
+            return
+        # Save the state of the plugins that are being replaced so that
+        # they can read it back.
+        for plgPlugin in dicOld.values():
+            if plgPlugin not in dicUnchanged.values():
+                plgPlugin.savestate(True)
+
+        self.blnLoading = True
+        try:
+            try:
+                if cnfOld.strFilename in dicUnchanged:
+                    # Only plugins have changed, keep the configuration.
+                    cnfOld.dicPlugins = {"000000000000000000000000": dicOld["000000000000000000000000"]}
+                    cnfOld.loadplugins(dicUnchanged)
+                    cnfNew = cnfOld
+                else:
+                    cnfNew = Configuration(self, cnfOld.strFilename, dicUnchanged)
+            except:
+                cnfOld.dicPlugins = dicOld
+                self.fnNoteData("Reloading failed, keeping the current configuration: %s" % sys.exc_value)
+                return
+        finally:
+            self.blnLoading = False
+
+        self.cnfConfiguration = cnfNew
+        if self.cntClientConnection != None:
+            self.cntClientConnection.intMaxClients = cnfNew.intMaxClients
+            self.cntClientConnection.intClientBuffer = cnfNew.intClientBuffer
+        self.sbScrollback.fnSetLimits(cnfNew.intScrollbackLines, cnfNew.intScrollbackBytes)
+        if not cnfNew.blnProfile:
+            self.stStats = None
+        elif self.stStats == None:
+            self.stStats = Stats()
+        lstReloaded = []
+        for strID, plgOld in dicOld.items():
+            if strID not in cnfNew.dicPlugins:
+                # The plugin was removed from the character file.
+                self.tsTimers.fnDropPlugin(plgOld)
+            if self.stStats != None and plgOld not in cnfNew.dicPlugins.values():
+                self.stStats.fnDropPlugin(plgOld)
+        for strID, plgNew in cnfNew.dicPlugins.items():
+            if plgNew in dicOld.values():
+                continue
+            if strID in dicOld:
+                self.fnCarryOver(dicOld[strID], plgNew)
+            plgNew.scheduletimers()
+            plgNew.run("OnPluginInstall", (), True)
+            lstReloaded.append(plgNew.strName)
+        lstReloaded.sort()
+        self.fnNoteData("Reloaded %s." % ", ".join(lstReloaded))
+
+    def fnCarryOver(self, plgOld, plgNew):
+        """Move the variables and timer deadlines of a plugin to the plugin
+           that was loaded in its place."""
+        plgNew.dicVariables.update(plgOld.dicVariables)
+        plgNew.ssState.dicDirty.update(plgOld.ssState.dicDirty)
+        for tmrNew in plgNew.lstTimers:
+            if tmrNew.strName == "":
+                continue
+            tmrOld = plgOld.itTimers.fnGetName(tmrNew.strName)
+            if tmrOld != None:
+                fltDeadline = self.tsTimers.fnDeadline(tmrOld)
+                if fltDeadline != None:
+                    tmrNew.fltTime = fltDeadline - tmrNew.getinterval()
+        # Timers created by scripts are not in the file, move them over.
+        for tmrOld in plgOld.dicTemporaryTimers.values():
+            if self.tsTimers.fnDeadline(tmrOld) != None:
+                plgNew.dicTemporaryTimers[id(tmrOld)] = tmrOld
+                plgNew.itTimers.fnAdd(tmrOld)
+        self.tsTimers.fnDropPlugin(plgOld)
+
+    def fnDumpStats(self):
+        """Write the counters to the stats file, and do it again later."""
+        self.dcStatsDump = reactor.callLater(self.cnfConfiguration.fltStatsInterval, self.fnDumpStats)
+        if self.stStats == None:
+            return
+        strFilename = self.fmFormatting.fnExpandMacros(self.cnfConfiguration.strStatsFile, self)
+        try:
+            flStats = file(strFilename + ".tmp", "w")
+            flStats.write("\n".join(self.stStats.fnReport()) + "\n")
+            flStats.close()
+            fnReplaceFile(strFilename + ".tmp", strFilename)
+        except (IOError, OSError):
+            self.fnNoteData("Could not write the stats to '%s'." % strFilename)
+
+    def fnExit(self):
+        """Handle exiting."""
+        if self.blnExited:
+            return
+        self.blnExited = True
+        if self.dcStatsDump != None and self.dcStatsDump.active():
+            self.dcStatsDump.cancel()
+        if self.dcReconnect != None and self.dcReconnect.active():
+            self.dcReconnect.cancel()
+        if self.cqQueue != None:
+            self.cqQueue.fnClear()
+        self.fnCloseRemote()
+        self.fnSavePlugins()
+        if self.lwLog != None:
+            self.lwLog.fnFlush()
+        if self.cntConnection != None:
+            self.cntConnection.close()
+        self.tsTimers.fnStop()
+        self.smSessions.fnSessionEnded(self)
+
+    def fnHandleTimers(self):
+        """Run the timers that are due."""
+        fltNewTime = time.time()
+        for plgPlugin, tmrTimer in self.tsTimers.fnPopDue(fltNewTime):
+            if self.blnExited:
+                # A timer has made us exit, which unscheduled the rest.
+                return
+            # A connection that a timer has asked to close is as good as
+            # gone.
+            if (not self.cntConnection or self.blnStayDisconnected) and not tmrTimer.blnActiveClosed:
+                # Run it as soon as we are connected again.
+                self.tsTimers.fnPark(plgPlugin, tmrTimer)
+                continue
+            if self.stStats == None:
+                self.fnRunTimer(plgPlugin, tmrTimer, fltNewTime)
+            else:
+                fltStart = time.time()
+                self.fnRunTimer(plgPlugin, tmrTimer, fltNewTime)
+                self.stStats.fnAdd("timer", plgPlugin, tmrTimer, time.time() - fltStart, True)
+        if self.blnExited:
+            return
+        self.tsTimers.fnArm()
+        if self.stStats != None:
+            self.stStats.fnAdd("core", None, "fnHandleTimers", time.time() - fltNewTime)
+        self.fnCheckActive()
+
+    def fnRunTimer(self, plgPlugin, tmrTimer, fltNewTime):
+        """Run a timer that is due."""
+        if tmrTimer.intSendTo == 0:
+            if self.cntConnection != None:
+                self.fnSendData(tmrTimer.strSend)
+        elif tmrTimer.intSendTo == 12:
+            self.fnExecCode(tmrTimer.strSend, plgPlugin, tmrTimer)
+        if tmrTimer.blnOneShot:
+            plgPlugin.removetimer(tmrTimer)
+        elif not self.blnExited:
+            tmrTimer.fltTime = fltNewTime
+            self.tsTimers.fnSchedule(plgPlugin, tmrTimer)
+        # Check scripting.
+        if tmrTimer.strScript != "":
+            # We need a tuple, hence the comma
+            plgPlugin.run(tmrTimer.strScript, (tmrTimer.strName, ))
+
+    def fnCheckActive(self):
+        """Stop when there is no connection, no reconnection pending and no
+           timer that can run without one."""
+        if self.cntConnection or (self.dcReconnect != None and self.dcReconnect.active()) or self.tsTimers.fnHasActiveClosed():
+            return
+        self.fnExit()
+
+    def fnConnectionEnded(self):
+        """Connect again after a while if the connection has failed or
+           dropped and reconnecting is enabled, or stop if nothing else keeps
+           us running. The delay grows with every failed attempt and is
+           jittered, so that many characters don't all reconnect at once."""
+        cnfConfiguration = self.cnfConfiguration
+        if self.blnExited:
+            return
+        if not cnfConfiguration.blnReconnect or self.blnStayDisconnected:
+            self.fnCloseRemote()
+            reactor.callLater(0, self.fnCheckActive)
+            return
+        if cnfConfiguration.intReconnectAttempts and self.intAttempts >= cnfConfiguration.intReconnectAttempts:
+            self.fnNoteData("Giving up after %d attempts to reconnect." % self.intAttempts)
+            self.fnCloseRemote()
+            reactor.callLater(0, self.fnCheckActive)
+            return
+        fltDelay = min(cnfConfiguration.fltReconnectMaxDelay, cnfConfiguration.fltReconnectDelay * cnfConfiguration.fltReconnectBackoff ** self.intAttempts)
+        fltDelay *= random.uniform(1 - cnfConfiguration.fltReconnectJitter, 1 + cnfConfiguration.fltReconnectJitter)
+        self.intAttempts += 1
+        self.fnNoteData("Reconnecting in %.1f seconds." % fltDelay)
+        self.dcReconnect = reactor.callLater(fltDelay, self.fnReconnect)
+
+    def fnCloseRemote(self):
+        """Stop listening for remote clients and disconnect them. They stay
+           connected while waiting to reconnect."""
+        if self.cntClientConnection:
+            self.cntClientConnection.close()
+            self.cntClientConnection = None
+
+    def fnReconnect(self):
+        self.dcReconnect = None
+        if self.cntConnection == None and not self.blnExited:
+            self.cntConnection = MUDConnection(self, self.cnfConfiguration.strHost, self.cnfConfiguration.intPort)
+
+    def fnMatchTriggers(self, plLine):
+        fltPassStart = time.time()
+        strData = plLine.strRaw
+        strStripped = plLine.strStripped
+        for plgPlugin in self.cnfConfiguration.dicPlugins.values():
+            if plgPlugin.blnReindexTriggers:
+                plgPlugin.indextriggers()
+            lstPositions = plgPlugin.tiTriggers.fnCandidates(strData, strStripped)
+            intCandidate = 0
+            intPosition = -1
+            while True:
+                if plgPlugin.blnReindexTriggers:
+                    # A script has enabled or disabled triggers while this
+                    # line was being matched, so pick up the changes for the
+                    # triggers that come after the current one.
+                    plgPlugin.indextriggers()
+                    lstPositions = [intOther for intOther in plgPlugin.tiTriggers.fnCandidates(strData, strStripped) if intOther > intPosition]
+                    intCandidate = 0
+                if intCandidate >= len(lstPositions):
+                    break
+                intPosition = lstPositions[intCandidate]
+                intCandidate += 1
+                ciTrigger = plgPlugin.lstTriggers[intPosition]
+                if not ciTrigger.blnEnabled:
+                    continue
+                if self.stStats == None:
+                    intResult = self.fnRunTrigger(plgPlugin, ciTrigger, plLine)
+                else:
+                    fltStart = time.time()
+                    intResult = self.fnRunTrigger(plgPlugin, ciTrigger, plLine)
+                    self.stStats.fnAdd("trigger", plgPlugin, ciTrigger, time.time() - fltStart, intResult != TR_NOMATCH)
+                if intResult == TR_STOP:
+                    break
+        if self.stStats != None:
+            self.stStats.fnAdd("core", None, "fnMatchTriggers", time.time() - fltPassStart)
+
+    def fnRunTrigger(self, plgPlugin, ciTrigger, plLine):
+        """Match a trigger against a line and run it if it matches."""
+        strData = plLine.strRaw
+        # Strip ANSI if necessary
+        if ciTrigger.blnKeepANSI:
+            reResult = ciTrigger.getregexp().search(strData)
+        else:
+            reResult = ciTrigger.getregexp().search(plLine.strStripped)
+
+        if reResult == None:
+            return TR_NOMATCH
+        if not ciTrigger.blnKeepANSI:
+            intStyle = plLine.fnStyleAt(reResult.start(0))
+
+            # The colours are numbered from 8, for colour 0.
+            if ciTrigger.blnMatchBold:
+                if ciTrigger.blnBold != bool(intStyle & StyleTracker.BOLD):
+                    return TR_NOMATCH
+            if ciTrigger.blnMatchItalic:
+                if ciTrigger.blnItalic != bool(intStyle & StyleTracker.ITALIC):
+                    return TR_NOMATCH
+            if ciTrigger.blnMatchInverse:
+                if ciTrigger.blnInverse != bool(intStyle & StyleTracker.INVERSE):
+                    return TR_NOMATCH
+            if ciTrigger.blnMatchBackColour:
+                if (intStyle & StyleTracker.BACKGROUND) >> StyleTracker.BACKGROUND_SHIFT != ciTrigger.intBackColour - 8:
+                    return TR_NOMATCH
+            if ciTrigger.blnMatchTextColour:
+                if intStyle & StyleTracker.FOREGROUND != ciTrigger.intTextColour - 8:
+                    return TR_NOMATCH
+
+        self.intTriggerFires += 1
+        if self.cnfConfiguration.blnDebug:
+            self.fnNoteData("Matched '%s' in %s, groups are %s" % (ciTrigger.strMatch, plgPlugin.strName, reResult.groups()))
+
+        # Change what the remote clients see.
+        if ciTrigger.blnOmitFromOutput:
+            plLine.blnOmit = True
+        if ciTrigger.stRewrite != None:
+            plLine.strOutput = ciTrigger.stRewrite.fnExpand(reResult, plgPlugin.dicVariables)
+        if ciTrigger.strHighlight != "" and not ciTrigger.blnKeepANSI:
+            intStart, intEnd = reResult.span(0)
+            if intStart < intEnd:
+                strAfter = "\x1b[0;%sm" % ";".join([str(intCode) for intCode in self.trkStyle.fnCodes(plLine.fnStyleAt(intEnd - 1))])
+                plLine.fnHighlight(intStart, intEnd, "\x1b[%sm" % ciTrigger.strHighlight, strAfter)
+
+        # Check "send to".
+        if ciTrigger.intSendTo == 0:
+            self.fnSendData(ciTrigger.stSend.fnExpand(reResult, plgPlugin.dicVariables))
+        elif ciTrigger.intSendTo == 12:
+            self.fnExecCode(ciTrigger.stSend.fnExpand(reResult, plgPlugin.dicVariables), plgPlugin, ciTrigger)
+
+        # Check scripting.
+        if ciTrigger.strScript != "":
+            plgPlugin.run(ciTrigger.strScript, (ciTrigger.strName, strData, reResult.groups()))
+        # Check "keep evaluating".
+        if not ciTrigger.blnKeepEvaluating:
+            return TR_STOP
+        return TR_MATCHED
+
+    def fnMatchAliases(self, strData, clClient = None):
+        """Match the aliases against a line of input from clClient, the
+           remote client that sent it."""
+        fltPassStart = time.time()
+        blnMatched = False
+        # What the remote client sends, and what its aliases send, goes ahead
+        # of the commands from triggers and timers.
+        if clClient != None:
+            self.intSendLane = CommandQueue.LANE_CLIENT
+        try:
+            for plgPlugin in self.cnfConfiguration.dicPlugins.values():
+                for alsAlias in plgPlugin.lstAliases:
+                    if not alsAlias.blnEnabled:
+                        continue
+                    if self.stStats == None:
+                        intResult = self.fnRunAlias(plgPlugin, alsAlias, strData, clClient)
+                    else:
+                        fltStart = time.time()
+                        intResult = self.fnRunAlias(plgPlugin, alsAlias, strData, clClient)
+                        self.stStats.fnAdd("alias", plgPlugin, alsAlias, time.time() - fltStart, intResult != TR_NOMATCH)
+                    if intResult != TR_NOMATCH:
+                        blnMatched = True
+                    if intResult == TR_STOP:
+                        break
+            if self.stStats != None:
+                self.stStats.fnAdd("core", None, "fnMatchAliases", time.time() - fltPassStart, blnMatched)
+            if not blnMatched:
+                self.fnSendData(strData)
+        finally:
+            self.intSendLane = CommandQueue.LANE_BOT
+
+    def fnRunAlias(self, plgPlugin, alsAlias, strData, clClient):
+        """Match an alias against a line of input and run it if it
+           matches."""
+        reResult = alsAlias.getregexp().search(strData)
+
+        if reResult == None:
+            return TR_NOMATCH
+        if self.cnfConfiguration.blnDebug:
+            self.fnNoteData("Matched '%s' in %s, groups are %s" % (alsAlias.strMatch, plgPlugin.strName, reResult.groups()))
+
+        # Check "send to".
+        if alsAlias.intSendTo == 0:
+            strResult = alsAlias.stSend.fnExpand(reResult, plgPlugin.dicVariables)
+            if alsAlias.blnEchoAlias:
+                if clClient != None:
+                    clClient.fnSend(strResult + "\n")
+                elif self.cntClientConnection:
+                    self.cntClientConnection.fnSend(strResult + "\n")
+            self.fnSendData(strResult, alsAlias.blnOmitFromLog)
+        elif alsAlias.intSendTo == 12:
+            self.fnExecCode(alsAlias.stSend.fnExpand(reResult, plgPlugin.dicVariables), plgPlugin, alsAlias)
+
+        # Check scripting.
+        if alsAlias.strScript != "":
+            plgPlugin.run(alsAlias.strScript, (alsAlias.strName, strData, reResult.groups()))
+        # Check "keep evaluating".
+        if not alsAlias.blnKeepEvaluating:
+            return TR_STOP
+        return TR_MATCHED
+
+    def fnProcessData(self, strData):
+        """Process the data coming from the MUD and match triggers."""
+        # Parse the line once, the triggers, logging and plugin callbacks
+        # all share it.
+        self.intLinesIn += 1
+        self.plLine = ParsedLine(strData, self.fmFormatting, self.trkStyle)
+        self.fnLogDataIn(self.plLine)
+        self.fnMatchTriggers(self.plLine)
+        # Keep what the remote clients see.
+        if self.cnfConfiguration.blnOutputFilter:
+            strData = self.plLine.fnOutput()
+        if strData != None:
+            self.sbScrollback.fnAdd(self.fnEncode(strData))
+
+    def fnSendData(self, strLine, blnOmitFromLog = False):
+        """Send data to the MUD, through the command queue."""
+        if strLine != "":
+            self.cqQueue.fnPut(strLine, blnOmitFromLog, self.intSendLane)
+
+    def fnWriteLine(self, strLine, blnOmitFromLog = False):
+        """Write data to the MUD connection now."""
+        if self.cntConnection == None:
+            # Disconnected, possibly waiting to reconnect, which is no reason
+            # to stop.
+            self.fnNoteData("Not connected, '%s' was not sent." % strLine)
+            return
+        strLine = self.fnEncode(strLine)
+        try:
+            self.cntConnection.sendLine(strLine)
+        except:
+            self.fnError("Could not write data to socket. Reason is '%s'." % sys.exc_value)
+        if not blnOmitFromLog:
+            self.fnLogDataOut(strLine)
+
+    def fnEncode(self, strData):
+        """Return text as bytes in the character set of the MUD."""
+        if isinstance(strData, unicode):
+            return strData.encode(self.cnfConfiguration.strCharset, "replace")
+        return strData
+
+    def fnLogDataIn(self, plLine):
+        """Log the incoming data."""
+        if self.cnfConfiguration.blnToScreen:
+            print self.fnEncode(plLine.strStripped)
+        if self.lwLog != None:
+            if not self.cnfConfiguration.blnKeepANSI:
+                self.lwLog.fnWrite(self.cnfConfiguration.strPrependIn, plLine.strStripped, self.cnfConfiguration.strAppendIn, strDirection = IndexedLog.LOG_IN)
+            else:
+                self.lwLog.fnWrite(self.cnfConfiguration.strPrependIn, plLine.strRaw, self.cnfConfiguration.strAppendIn, strDirection = IndexedLog.LOG_IN)
+
+    def fnNoteData(self, strLine, blnOmitConsole = False, blnOmitRemote = False, blnOmitLog = False, blnOmitNewline = False):
+        """Print debugging data."""
+        strData = self.fmFormatting.fnTrimNewline(strLine)
+        if self.cnfConfiguration.blnNoteToConsole and not blnOmitConsole:
+            if blnOmitNewline:
+                print self.fnEncode(strData),
+            else:
+                print self.fnEncode(strData)
+        if self.lwLog != None and not blnOmitLog and self.cnfConfiguration.blnNoteToLog:
+            self.lwLog.fnWrite(self.cnfConfiguration.strPrependOut, strData, self.cnfConfiguration.strAppendOut, (blnOmitNewline and [""] or ["\n"])[0], IndexedLog.LOG_NOTE)
+        if self.cntClientConnection and not blnOmitRemote and self.cnfConfiguration.blnNoteToRemote:
+            self.cntClientConnection.fnSend(strData + (blnOmitNewline and [""] or ["\n"])[0])
+
+    def fnLogDataOut(self, strData):
+        """Log the outgoing data."""
+        strData = self.fmFormatting.fnTrimNewline(strData)
+        if self.cnfConfiguration.blnToScreen:
+            print strData
+        if self.lwLog != None:
+            self.lwLog.fnWrite(self.cnfConfiguration.strPrependOut, strData, self.cnfConfiguration.strAppendOut, strDirection = IndexedLog.LOG_OUT)
+
+    def OnConnect(self):
+        """Initialise various connection details."""
+        self.intConnections += 1
+        self.intAttempts = 0
+        self.fltConnected = time.time()
+        # Open the logfile if specified.
+        if self.cnfConfiguration.blnLogging:
+            if self.cnfConfiguration.blnLogIndexed:
+                self.lwLog = IndexedLog(self)
+            else:
+                self.lwLog = LogWriter(self)
+        # Print OnConnect string.
+        if self.cnfConfiguration.strOnConnect != "":
+            self.fnNoteData(self.fmFormatting.fnExpandMacros(self.cnfConfiguration.strOnConnect, self) + "\n")
+        # Perform autologon, ahead of anything queued.
+        self.cqQueue.fnReset()
+        self.fnWriteLine(self.cnfConfiguration.strName)
+        self.cntConnection.sendLine(self.cnfConfiguration.strPassword + "\n")
+        # Start recording after the login, to keep the password out of it.
+        if self.smSessions.strRecord != None:
+            self.srRecorder = SessionRecorder(self.fmFormatting.fnExpandMacros(self.smSessions.strRecord, self))
+        # Send connection commands.
+        if self.cnfConfiguration.strConnectionCommands != "":
+            self.fnSendData(self.cnfConfiguration.strConnectionCommands)
+        # Execute OnPluginConnect.
+        self.fnCallPluginFunction("OnPluginConnect", ())
+        # Run the timers that were waiting for the connection.
+        self.tsTimers.fnResume()
+
+    def OnConnectFailed(self):
+        """Do stuff when the connection has failed."""
+        # Print OnConnectFailed string.
+        if self.cnfConfiguration.strOnConnectFailed != "":
+            self.fnNoteData(self.fmFormatting.fnExpandMacros(self.cnfConfiguration.strOnConnectFailed, self) + "\n")
+        self.fnCallPluginFunction("OnPluginConnectFailed", ())
+
+    def OnDisconnect(self):
+        """Clean up after disconnection."""
+        self.fltConnected = None
+        if self.cnfConfiguration.strOnDisconnect != "":
+            self.fnNoteData(self.fmFormatting.fnExpandMacros(self.cnfConfiguration.strOnDisconnect, self) + "\n")
+        if self.lwLog != None:
+            self.lwLog.fnClose()
+            self.lwLog = None
+        if self.srRecorder != None:
+            self.srRecorder.fnClose()
+            self.srRecorder = None
+        self.cqQueue.fnClear()
+        self.fnSavePlugins()
+        self.fnCallPluginFunction("OnPluginDisconnect", ())
+
+    def OnRemoteConnect(self, strAddress):
+        """Remote client connection callback."""
+        if self.cnfConfiguration.strOnRemoteConnect != "":
+            self.fnNoteData(self.fmFormatting.fnExpandMacros(self.cnfConfiguration.strOnRemoteConnect, self, strAddress), blnOmitRemote = True)
+        self.fnCallPluginFunction("OnPluginClientConnect", ())
+
+    def OnRemoteDisconnect(self, strAddress):
+        """Remote client disconnection callback."""
+        if self.cnfConfiguration.strOnRemoteDisconnect != "":
+            self.fnNoteData(self.fmFormatting.fnExpandMacros(self.cnfConfiguration.strOnRemoteDisconnect, self, strAddress), blnOmitRemote = True)
+        self.fnCallPluginFunction("OnPluginClientDisconnect", ())
+
+    def fnError(self, strDescription):
+        print "ERROR: %s" % strDescription
+        if self.blnLoading:
+            # Abort loading, Configuration or fnDoReload deal with it.
+            raise ConfigurationError(strDescription)
+        self.fnExit()
+
+    def fnException(self, strType, strValue, tbTraceback):
+        if strType == exceptions.SystemExit:
+            # Only this character exits, the others keep running.
+            self.fnExit()
+            return
+        self.intErrors += 1
+        if tbTraceback == None:
+            print "Exception of type %s occurred, reason \"%s\"." % (strType, strValue)
+        else:
+            print "Exception of type %s occurred in line %s, reason \"%s\"." % (strType, tbTraceback.tb_lineno, strValue)
+
+class Callbacks:
+    def __init__(self, plgNamespace):
+        # Get the plugin reference so we can manipulate it.
+        self.plgPlugin = plgNamespace
+        self.mdBot = plgNamespace.mdBot
+        self.GetPluginName = plgNamespace.strName
+    def Connect(self):
+        """Connect to the server."""
+        self.mdBot.blnStayDisconnected = False
+        if self.mdBot.dcReconnect != None and self.mdBot.dcReconnect.active():
+            self.mdBot.dcReconnect.cancel()
+        if self.mdBot.cntConnection == None:
+            self.mdBot.cntConnection = MUDConnection(self.mdBot, self.mdBot.cnfConfiguration.strHost, self.mdBot.cnfConfiguration.intPort)
+    def Send(self, strData):
+        """Send data to the world."""
+        if self.mdBot.cntClientConnection:
+            self.mdBot.cntClientConnection.fnSend(strData)
+        self.mdBot.fnSendData(strData)
+    def SaveState(self):
+        """Save the plugin's state."""
+        self.plgPlugin.savestate()
+    def Exit(self):
+        """Exits the program."""
+        self.mdBot.fnExit()
+    def Disconnect(self):
+        """Disconnect the current connection, without reconnecting."""
+        self.mdBot.blnStayDisconnected = True
+        if self.mdBot.cntConnection != None:
+            self.mdBot.cntConnection.close()
+    def Note(self, strData):
+        """Send text to stdout."""
+        self.mdBot.fnNoteData(strData)
+    def SetVariable(self, strVariableName, strData):
+        """Set a variable in the plugin's variables dictionary."""
+        self.plgPlugin.dicVariables[strVariableName.lower()] = strData
+        self.plgPlugin.ssState.fnChanged(strVariableName.lower())
+        return 0
+    def GetInfo(self, intInfoType):
+        """Get information about the current character."""
+        if intInfoType == 1:
+            return self.mdBot.cnfConfiguration.strHost
+        elif intInfoType == 3:
+            return self.mdBot.cnfConfiguration.strName
+        elif intInfoType == 11:
+            return self.mdBot.cnfConfiguration.strOnConnect
+        elif intInfoType == 12:
+            return self.mdBot.cnfConfiguration.strOnDisconnect
+        elif intInfoType == 106:
+            # Return true if not connected.
+            return (self.mdBot.stConnectionState == AC_DISCONNECTED) and True or False
+        elif intInfoType == 107:
+            # Return true if currently connecting.
+            return (self.mdBot.stConnectionState == AC_CONNECTING) and True or False
+        elif intInfoType == 3:
+            return self.mdBot.cnfConfiguration.strName
+        elif intInfoType == 301:
+            # When the current connection was made, or None.
+            return self.mdBot.fltConnected
+        elif intInfoType == 1001:
+            # Number of reconnections.
+            return max(0, self.mdBot.intConnections - 1)
+        elif intInfoType == 1002:
+            # Attempts to reconnect since the last connection.
+            return self.mdBot.intAttempts
+        elif intInfoType == 1003:
+            # Seconds the current connection has been up.
+            if self.mdBot.fltConnected == None:
+                return 0
+            return time.time() - self.mdBot.fltConnected
+        elif intInfoType == 1004:
+            # Seconds since the character was started.
+            return time.time() - self.mdBot.fltStarted
+        else:
+            return "NOT IMPLEMENTED"
+    def GetVariable(self, strVariableName):
+        """Get a variable from the plugin's variables dictionary."""
+        if strVariableName.lower() in self.plgPlugin.dicVariables:
+            return self.plgPlugin.dicVariables[strVariableName.lower()]
+        else:
+            return
+    def DeleteVariable(self, strVariableName):
+        """Delete a variable from the plugin's variables dictionary."""
+        if strVariableName.lower() in self.plgPlugin.dicVariables:
+            del self.plgPlugin.dicVariables[strVariableName.lower()]
+            self.plgPlugin.ssState.fnChanged(strVariableName.lower())
+            varReturn = 0
+        else:
+            varReturn = 30019
+        return varReturn
+    def EnableTrigger(self, strTriggerName, blnEnabled):
+        """Enable or disable a trigger."""
+        ciTrigger = self.plgPlugin.itTriggers.fnGetName(strTriggerName)
+        if ciTrigger is None:
+            # Trigger not found
+            return 30005
+        self.plgPlugin.enabletrigger(ciTrigger, blnEnabled)
+        return 0
+    def EnableTriggerGroup(self, strGroupName, blnEnabled):
+        """Enable or disable a trigger group."""
+        lstTriggers = self.plgPlugin.itTriggers.fnGetGroup(strGroupName)
+        for ciTrigger in lstTriggers:
+            self.plgPlugin.enabletrigger(ciTrigger, blnEnabled)
+        return len(lstTriggers)
+    def EnableTimer(self, strTimerName, blnEnabled):
+        """Enable or disable a timer."""
+        ciTimer = self.plgPlugin.itTimers.fnGetName(strTimerName)
+        if ciTimer == None:
+            # Timer not found
+            return 30017
+        ciTimer.fltTime = time.time() + ciTimer.intOffsetHour * 3600 + ciTimer.intOffsetMinute * 60 + ciTimer.intOffsetSecond
+        ciTimer.blnEnabled = blnEnabled
+        self.mdBot.tsTimers.fnSchedule(self.plgPlugin, ciTimer)
+        return 0
+    def EnableTimerGroup(self, strGroupName, blnEnabled):
+        """Enable or disable a timer group."""
+        lstTimers = self.plgPlugin.itTimers.fnGetGroup(strGroupName)
+        for ciTimer in lstTimers:
+            ciTimer.fltTime = time.time() + ciTimer.intOffsetHour * 3600 + ciTimer.intOffsetMinute * 60 + ciTimer.intOffsetSecond
+            ciTimer.blnEnabled = blnEnabled
+            self.mdBot.tsTimers.fnSchedule(self.plgPlugin, ciTimer)
+        return len(lstTimers)
+    def EnableAlias(self, strAliasName, blnEnabled):
+        """Enable or disable an alias."""
+        ciAlias = self.plgPlugin.itAliases.fnGetName(strAliasName)
+        if ciAlias is None:
+            # Alias not found
+            return 30010
+        ciAlias.blnEnabled = blnEnabled
+        return 0
+    def EnableAliasGroup(self, strGroupName, blnEnabled):
+        """Enable or disable an alias group."""
+        lstAliases = self.plgPlugin.itAliases.fnGetGroup(strGroupName)
+        for ciAlias in lstAliases:
+            ciAlias.blnEnabled = blnEnabled
+        return len(lstAliases)
+    def EnableGroup(self, strGroupName, blnEnabled):
+        """Enable or disable a group."""
+        intCounter = 0
+        for ciTrigger in self.plgPlugin.itTriggers.fnGetGroup(strGroupName):
+            self.plgPlugin.enabletrigger(ciTrigger, blnEnabled)
+            intCounter += 1
+        for ciAlias in self.plgPlugin.itAliases.fnGetGroup(strGroupName):
+            ciAlias.blnEnabled = blnEnabled
+            intCounter += 1
+        for ciTimer in self.plgPlugin.itTimers.fnGetGroup(strGroupName):
+            ciTimer.blnEnabled = blnEnabled
+            self.mdBot.tsTimers.fnSchedule(self.plgPlugin, ciTimer)
+            intCounter += 1
+        return intCounter
+    def TraceOut(self, strMessage):
+        self.mdBot.fnNoteData("%s notes '%s'." % (self.plgPlugin.strName, strMessage))
+    def GetPluginName(self):
+        """Return the plugin's name."""
+        return self.plgPlugin.strName
+    def ColourTell(self, strForegroundColor, strBackgroundColor, strText):
+        """Send text to the console without a newline, in color."""
+        # TODO: Make color actually work.
+        self.mdBot.fnNoteData(strText, blnOmitNewline = True)
+    def ColourNote(self, strForegroundColor, strBackgroundColor, strText):
+        """Send text to the console with a newline, in color."""
+        # TODO: Make color actually work.
+        self.mdBot.fnNoteData(strText)
+    def GetLineText(self, blnKeepANSI = False):
+        """Return the line that is currently being processed."""
+        if self.mdBot.plLine == None:
+            return ""
+        if blnKeepANSI:
+            return self.mdBot.plLine.strRaw
+        return self.mdBot.plLine.strStripped
+    def GetLineStyle(self, intColumn):
+        """Return the ANSI style at a column of the current (stripped) line."""
+        if self.mdBot.plLine == None:
+            return self.mdBot.trkStyle.fnCodes(self.mdBot.trkStyle.intStyle)
+        return self.mdBot.trkStyle.fnCodes(self.mdBot.plLine.fnStyleAt(intColumn))
+    def GetLines(self, intCount, blnKeepANSI = False):
+        """Return up to intCount of the most recent lines from the MUD,
+           oldest first."""
+        lstLines = []
+        for strLine in self.mdBot.sbScrollback.fnGetLines(int(intCount)):
+            strLine = strLine.decode(self.mdBot.cnfConfiguration.strCharset, "replace")
+            if not blnKeepANSI:
+                strLine = self.mdBot.fmFormatting.fnStripANSI(strLine)
+            lstLines.append(strLine)
+        return lstLines
+    def ReloadPlugin(self, strPluginID):
+        """Reload a plugin from its file, keeping its variables and timers."""
+        if strPluginID not in self.mdBot.cnfConfiguration.dicPlugins:
+            # No such plugin
+            return 30041
+        self.mdBot.fnReload((strPluginID, ))
+        return 0
+    def GetQueue(self):
+        """Return the commands waiting to be sent to the MUD."""
+        return self.mdBot.cqQueue.fnGetCommands()
+    def DiscardQueue(self):
+        """Drop the commands waiting to be sent to the MUD."""
+        return self.mdBot.cqQueue.fnClear()
+    def GetQueueInfo(self):
+        """Return the number of commands waiting, the number sent, the number
+           coalesced, and the seconds the last and the slowest command
+           waited."""
+        cqQueue = self.mdBot.cqQueue
+        return (cqQueue.fnDepth(), cqQueue.intSent, cqQueue.intCoalesced, cqQueue.fltLatency, cqQueue.fltMaxLatency)
+    def GetStats(self):
+        """Return the profiling counters as (kind, plugin, name, calls,
+           matches, seconds, most seconds) tuples, slowest first."""
+        if self.mdBot.stStats == None:
+            return []
+        return self.mdBot.stStats.fnGetStats()
+    def DoAfter(self, intSeconds, strText):
+        """Send text to the MUD after the specified amount of seconds."""
+        self.plgPlugin.createtimer(int(intSeconds), strText)
+
+class ThreadCallbacks:
+    """The world of a plugin that runs functions in worker threads. Calls
+       made from a worker thread are run on the reactor thread and waited
+       for, the others are made directly."""
+    def __init__(self, cbWorld):
+        self.cbWorld = cbWorld
+    def __getattr__(self, strName):
+        objAttribute = getattr(self.cbWorld, strName)
+        if not callable(objAttribute):
+            return objAttribute
+        def fnCall(*tplArguments):
+            if threadable.isInIOThread():
+                return objAttribute(*tplArguments)
+            return threads.blockingCallFromThread(reactor, objAttribute, *tplArguments)
+        return fnCall
+
+def inthread(fnFunction):
+    """Mark a plugin function to be run in a worker thread, so that it does
+       not hold up the reactor. Available to plugin scripts."""
+    fnFunction.blnInThread = True
+    return fnFunction
+
+class TriggerIndex:
+    """An index over a plugin's enabled triggers that finds the ones that can
+       possibly match a line without running every regular expression."""
+    def __init__(self, lstTriggers):
+        self.lstTriggers = lstTriggers
+        # Triggers without a usable literal have to be tried on every line.
+        self.lstAlways = []
+        # The literals are kept apart by (keep_ansi, ignore_case), as those
+        # decide which version of the line has to be searched. Anchored
+        # literals are bucketed by their first character so that only the
+        # ones that can be at the start of the line are compared.
+        self.dicLiterals = {}
+        self.dicAnchored = {}
+        for intPosition in range(len(lstTriggers)):
+            ciTrigger = lstTriggers[intPosition]
+            if not ciTrigger.blnEnabled:
+                continue
+            if ciTrigger.strLiteral == "":
+                self.lstAlways.append(intPosition)
+                continue
+            tplKey = (ciTrigger.blnKeepANSI, ciTrigger.blnLiteralIgnoreCase)
+            if ciTrigger.blnLiteralAnchored:
+                dicBuckets = self.dicAnchored.setdefault(tplKey, {})
+                dicLiterals = dicBuckets.setdefault(ciTrigger.strLiteral[0], {})
+            else:
+                dicLiterals = self.dicLiterals.setdefault(tplKey, {})
+            dicLiterals.setdefault(ciTrigger.strLiteral, []).append(intPosition)
+        self.lstKeys = self.dicLiterals.keys()
+        for tplKey in self.dicAnchored.keys():
+            if tplKey not in self.dicLiterals:
+                self.lstKeys.append(tplKey)
+
+    def fnCandidates(self, strLine, strStripped):
+        """Return the positions of the triggers that may match the line,
+           in sequence order."""
+        lstPositions = self.lstAlways[:]
+        for tplKey in self.lstKeys:
+            blnKeepANSI, blnIgnoreCase = tplKey
+            if blnKeepANSI:
+                strText = strLine
+            else:
+                strText = strStripped
+            if blnIgnoreCase:
+                strText = strText.lower()
+            for strLiteral, lstLiteralPositions in self.dicLiterals.get(tplKey, {}).iteritems():
+                if strLiteral in strText:
+                    lstPositions.extend(lstLiteralPositions)
+            if strText != "" and tplKey in self.dicAnchored:
+                for strLiteral, lstLiteralPositions in self.dicAnchored[tplKey].get(strText[0], {}).iteritems():
+                    if strText.startswith(strLiteral):
+                        lstPositions.extend(lstLiteralPositions)
+        lstPositions.sort()
+        return lstPositions
+
+class ItemIndex:
+    """Name and group lookups over a plugin's triggers, aliases or timers."""
+    def __init__(self):
+        # Name -> item, group -> {id(item): item}. Triggers and aliases
+        # compare by sequence, so the groups are keyed by the object itself,
+        # which also makes removing the many unnamed one-shot timers cheap.
+        self.dicNames = {}
+        self.dicGroups = {}
+
+    def fnAdd(self, objItem):
+        if objItem.strName != "":
+            self.dicNames[objItem.strName] = objItem
+        self.dicGroups.setdefault(objItem.strGroup, {})[id(objItem)] = objItem
+
+    def fnRemove(self, objItem):
+        if self.dicNames.get(objItem.strName) is objItem:
+            del self.dicNames[objItem.strName]
+        dicGroup = self.dicGroups.get(objItem.strGroup)
+        if dicGroup != None and id(objItem) in dicGroup:
+            del dicGroup[id(objItem)]
+            if not dicGroup:
+                del self.dicGroups[objItem.strGroup]
+
+    def fnGetName(self, strName):
+        """Return the item with that name, or None."""
+        return self.dicNames.get(strName)
+
+    def fnGetGroup(self, strGroup):
+        """Return a list of the items in that group."""
+        return self.dicGroups.get(strGroup, {}).values()
+
+class Plugin:
+    def __init__(self, mdBot):
+        # The MUDdrop instance the plugin belongs to.
+        self.mdBot = mdBot
+
+    class Trigger:
+        """The trigger object class."""
+        # The last code run for the trigger and its compiled form.
+        strCodeSource = None
+        coCode = None
+        # What the trigger does to the line the remote clients see.
+        blnOmitFromOutput = False
+        stRewrite = None
+        strHighlight = ""
+        # Not kept in the configuration cache, see getregexp().
+        reTrigger = None
+        def getregexp(self):
+            """Return the compiled match, compiling it if needed."""
+            if self.reTrigger is None:
+                self.reTrigger = re.compile(self.strMatch, self.intFlags)
+            return self.reTrigger
+        def __repr__(self):
+            return self.strMatch
+        def __cmp__(self, other):
+            if self.intSequence < other.intSequence:
+                return -1
+            elif self.intSequence == other.intSequence:
+                return 0
+            else:
+                return 1
+    class Alias:
+        """The alias object class."""
+        # The last code run for the alias and its compiled form.
+        strCodeSource = None
+        coCode = None
+        # Not kept in the configuration cache, see getregexp().
+        reAlias = None
+        def getregexp(self):
+            """Return the compiled match, compiling it if needed."""
+            if self.reAlias is None:
+                self.reAlias = re.compile(self.strMatch, self.intFlags)
+            return self.reAlias
+        def __repr__(self):
+            return self.strMatch
+        def __cmp__(self, other):
+            if self.intSequence < other.intSequence:
+                return -1
+            elif self.intSequence == other.intSequence:
+                return 0
+            else:
+                return 1
+    class Timer:
+        """The timer object class."""
+        # The timer's entry in the scheduler's heap, if it is scheduled.
+        lstEntry = None
+        # Timers created by scripts rather than loaded from a file.
+        blnTemporary = False
+        # The last code run for the timer and its compiled form.
+        strCodeSource = None
+        coCode = None
+        def getinterval(self):
+            """Return the timer's interval in seconds."""
+            return self.intHour * 3600 + self.intMinute * 60 + self.intSecond
+
+    def createtimer(self, intSeconds, strText):
+        """Create a timer."""
+        tmrTimer = Plugin.Timer()
+        tmrTimer.blnEnabled = True
+        tmrTimer.strName = ""
+        tmrTimer.strGroup = ""
+        tmrTimer.strScript = ""
+        tmrTimer.intSendTo = 0
+        tmrTimer.intHour = 0
+        tmrTimer.intMinute = 0
+        tmrTimer.intSecond = intSeconds
+        tmrTimer.blnOneShot = True
+        tmrTimer.blnActiveClosed = False
+        tmrTimer.fltTime = time.time()
+        tmrTimer.strSend = strText
+        tmrTimer.blnTemporary = True
+        self.dicTemporaryTimers[id(tmrTimer)] = tmrTimer
+        self.itTimers.fnAdd(tmrTimer)
+        self.mdBot.tsTimers.fnSchedule(self, tmrTimer)
+
+    def removetimer(self, tmrTimer):
+        """Remove a timer."""
+        if tmrTimer.blnTemporary:
+            del self.dicTemporaryTimers[id(tmrTimer)]
+        else:
+            self.lstTimers.remove(tmrTimer)
+        self.itTimers.fnRemove(tmrTimer)
+
+    def gettimers(self):
+        """Return the timers from the file and those created by scripts."""
+        return self.lstTimers + self.dicTemporaryTimers.values()
+
+    def enabletrigger(self, trgTrigger, blnEnabled):
+        """Enable or disable a trigger."""
+        if trgTrigger.blnEnabled != blnEnabled:
+            trgTrigger.blnEnabled = blnEnabled
+            self.blnReindexTriggers = True
+
+    def scheduletimers(self):
+        """Schedule all the plugin's enabled timers."""
+        for tmrTimer in self.gettimers():
+            self.mdBot.tsTimers.fnSchedule(self, tmrTimer)
+
+    def loadtimers(self, xmlTimers):
+        """Load timers from the xmlTimers node."""
+        self.lstTimers = []
+        # Timers created by scripts, by id, so that the one-shots among
+        # them are removed cheaply when they have run.
+        self.dicTemporaryTimers = {}
+        self.itTimers = ItemIndex()
+        if xmlTimers == None:
+            return
+        setNames = set()
+        for xmlTimer in xmlTimers:
+            tmrTimer = Plugin.Timer()
+            tmrTimer.blnEnabled = self.getxmlattr(xmlTimer, "enabled", True)
+            tmrTimer.strName = self.getxmlattr(xmlTimer, "name")
+            if tmrTimer.strName.lower() in setNames:
+                self.mdBot.fnError("Duplicate timer name found: '%s'" % tmrTimer.strName)
+            elif tmrTimer.strName != "":
+                setNames.add(tmrTimer.strName.lower())
+            tmrTimer.strGroup = self.getxmlattr(xmlTimer, "group")
+            tmrTimer.strVariable = self.getxmlattr(xmlTimer, "variable")
+            tmrTimer.strScript = self.getxmlattr(xmlTimer, "script")
+            tmrTimer.intHour = int(self.getxmlattr(xmlTimer, "hour"))
+            tmrTimer.intMinute = int(self.getxmlattr(xmlTimer, "minute"))
+            # This is converted to an int, change if accuracy is needed.
+            tmrTimer.intSecond = int(float(self.getxmlattr(xmlTimer, "second")))
+            tmrTimer.intSendTo = int(self.getxmlattr(xmlTimer, "send_to"))
+            tmrTimer.intOffsetHour = int(self.getxmlattr(xmlTimer, "offset_hour"))
+            tmrTimer.intOffsetMinute = int(self.getxmlattr(xmlTimer, "offset_minute"))
+            tmrTimer.intOffsetSecond = int(self.getxmlattr(xmlTimer, "offset_second"))
+            tmrTimer.blnOneShot = self.getxmlattr(xmlTimer, "one_shot", True)
+            tmrTimer.blnOmitFromOutput = self.getxmlattr(xmlTimer, "omit_from_output", True)
+            tmrTimer.blnOmitFromLog = self.getxmlattr(xmlTimer, "omit_from_log", True)
+            tmrTimer.blnActiveClosed = self.getxmlattr(xmlTimer, "active_closed", True)
+            tmrTimer.blnAtTime = self.getxmlattr(xmlTimer, "at_time", True)
+            tmrTimer.strSend = xmlTimer.find("send").text
+            tmrTimer.fltTime = time.time() + tmrTimer.intOffsetHour * 3600 + tmrTimer.intOffsetMinute * 60 + tmrTimer.intOffsetSecond
+
+            if tmrTimer.intHour + tmrTimer.intMinute + tmrTimer.intSecond > 0:
+                # Append it to the timers list.
+                self.lstTimers.append(tmrTimer)
+                self.itTimers.fnAdd(tmrTimer)
+            else:
+                self.mdBot.fnError("Timer has no interval set.")
+
+    def loadtriggers(self, xmlTriggers):
+        """Load triggers from the xmlTriggers node."""
+        fmFormatting = Formatting()
+
+        self.lstTriggers = []
+        self.itTriggers = ItemIndex()
+        if xmlTriggers == None:
+            self.indextriggers()
+            return
+        setNames = set()
+        for xmlTrigger in xmlTriggers:
+            trgTrigger = Plugin.Trigger()
+            trgTrigger.strMatch = self.getxmlattr(xmlTrigger, "match")
+            trgTrigger.blnEnabled = self.getxmlattr(xmlTrigger, "enabled", True)
+            trgTrigger.blnExpandVariables = self.getxmlattr(xmlTrigger, "expand_variables", True)
+            trgTrigger.blnKeepANSI = self.getxmlattr(xmlTrigger, "keep_ansi", True)
+            trgTrigger.blnBold = self.getxmlattr(xmlTrigger, "bold", True)
+            trgTrigger.blnInverse = self.getxmlattr(xmlTrigger, "inverse", True)
+            trgTrigger.blnItalic = self.getxmlattr(xmlTrigger, "italic", True)
+            trgTrigger.blnMatchBackColour = self.getxmlattr(xmlTrigger, "match_back_colour", True)
+            trgTrigger.blnMatchBold = self.getxmlattr(xmlTrigger, "match_bold", True)
+            trgTrigger.blnMatchInverse = self.getxmlattr(xmlTrigger, "match_inverse", True)
+            trgTrigger.blnMatchItalic = self.getxmlattr(xmlTrigger, "match_italic", True)
+            trgTrigger.blnMatchTextColour = self.getxmlattr(xmlTrigger, "match_text_colour", True)
+            trgTrigger.strName = self.getxmlattr(xmlTrigger, "name")
+            if trgTrigger.strName.lower() in setNames:
+                self.mdBot.fnError("Duplicate trigger name found: '%s'" % trgTrigger.strName)
+            elif trgTrigger.strName != "":
+                setNames.add(trgTrigger.strName.lower())
+            trgTrigger.strGroup = self.getxmlattr(xmlTrigger, "group")
+            trgTrigger.blnIgnoreCase = self.getxmlattr(xmlTrigger, "ignore_case", True)
+            trgTrigger.blnRegexp = self.getxmlattr(xmlTrigger, "regexp", True)
+            trgTrigger.blnKeepEvaluating = self.getxmlattr(xmlTrigger, "keep_evaluating", True)
+            trgTrigger.intSequence = int(self.getxmlattr(xmlTrigger, "sequence"))
+            trgTrigger.intBackColour = int(self.getxmlattr(xmlTrigger, "back_colour"))
+            trgTrigger.intTextColour = int(self.getxmlattr(xmlTrigger, "text_colour"))
+            trgTrigger.intSendTo = int(self.getxmlattr(xmlTrigger, "send_to"))
+            trgTrigger.strScript = self.getxmlattr(xmlTrigger, "script")
+            trgTrigger.blnOmitFromOutput = self.getxmlattr(xmlTrigger, "omit_from_output", True)
+            strRewrite = self.getxmlattr(xmlTrigger, "rewrite")
+            trgTrigger.strHighlight = self.getxmlattr(xmlTrigger, "highlight")
+
+            if not trgTrigger.blnRegexp:
+                trgTrigger.strMatch = fmFormatting.fnRegexpify(trgTrigger.strMatch)
+
+            if len(xmlTrigger) > 0:
+                # Substitute MUSHClient compatible %1 for pyregexp \1.
+                trgTrigger.strSend = fmFormatting.fnConvertWildcards(xmlTrigger[0].text or "")
+            else:
+                trgTrigger.strSend = ""
+            intFlags = 0
+            if trgTrigger.blnIgnoreCase:
+                intFlags |= re.IGNORECASE
+            trgTrigger.intFlags = intFlags
+            trgTrigger.reTrigger = re.compile(trgTrigger.strMatch, intFlags)
+            trgTrigger.stSend = self.compilesend(trgTrigger.strSend, trgTrigger.reTrigger, trgTrigger.blnExpandVariables, "trigger", trgTrigger.strMatch)
+            if strRewrite != "":
+                trgTrigger.stRewrite = self.compilesend(fmFormatting.fnConvertWildcards(strRewrite), trgTrigger.reTrigger, trgTrigger.blnExpandVariables, "trigger", trgTrigger.strMatch)
+            trgTrigger.strLiteral, trgTrigger.blnLiteralAnchored = fmFormatting.fnRequiredLiteral(trgTrigger.strMatch, intFlags)
+            trgTrigger.blnLiteralIgnoreCase = bool(trgTrigger.reTrigger.flags & re.IGNORECASE)
+            if trgTrigger.blnLiteralIgnoreCase:
+                trgTrigger.strLiteral = trgTrigger.strLiteral.lower()
+            self.lstTriggers.append(trgTrigger)
+            self.itTriggers.fnAdd(trgTrigger)
+        self.lstTriggers.sort()
+        self.indextriggers()
+
+    def indextriggers(self):
+        """Rebuild the index of enabled triggers."""
+        self.tiTriggers = TriggerIndex(self.lstTriggers)
+        self.blnReindexTriggers = False
+
+    def loadaliases(self, xmlAliases):
+        """Load aliases from the xmlAliases node."""
+        fmFormatting = Formatting()
+
+        self.lstAliases = []
+        self.itAliases = ItemIndex()
+        if xmlAliases == None:
+            return
+        setNames = set()
+        for xmlAlias in xmlAliases:
+            alsAlias = Plugin.Alias()
+            alsAlias.strMatch = self.getxmlattr(xmlAlias, "match")
+            alsAlias.blnEnabled = self.getxmlattr(xmlAlias, "enabled", True)
+            alsAlias.blnExpandVariables = self.getxmlattr(xmlAlias, "expand_variables", True)
+            alsAlias.blnEchoAlias = self.getxmlattr(xmlAlias, "echo_alias", True)
+            alsAlias.strName = self.getxmlattr(xmlAlias, "name")
+            if alsAlias.strName.lower() in setNames:
+                self.mdBot.fnError("Duplicate alias name found: '%s'" % alsAlias.strName)
+            elif alsAlias.strName != "":
+                setNames.add(alsAlias.strName.lower())
+            alsAlias.strGroup = self.getxmlattr(xmlAlias, "group")
+            alsAlias.blnIgnoreCase = self.getxmlattr(xmlAlias, "ignore_case", True)
+            alsAlias.blnRegexp = self.getxmlattr(xmlAlias, "regexp", True)
+            alsAlias.blnKeepEvaluating = self.getxmlattr(xmlAlias, "keep_evaluating", True)
+            alsAlias.blnOmitFromCommandHistory = self.getxmlattr(xmlAlias, "omit_from_command_history", True)
+            alsAlias.blnOmitFromLog = self.getxmlattr(xmlAlias, "omit_from_log", True)
+            alsAlias.intSequence = int(self.getxmlattr(xmlAlias, "sequence"))
+            alsAlias.intSendTo = int(self.getxmlattr(xmlAlias, "send_to"))
+            alsAlias.strScript = self.getxmlattr(xmlAlias, "script")
+            alsAlias.strVariable = self.getxmlattr(xmlAlias, "variable")
+
+            if not alsAlias.blnRegexp:
+                alsAlias.strMatch = fmFormatting.fnRegexpify(alsAlias.strMatch)
+
+            if len(xmlAlias) > 0:
+                # Substitute MUSHClient compatible %1 for pyregexp \1.
+                alsAlias.strSend = fmFormatting.fnConvertWildcards(xmlAlias[0].text or "")
+            else:
+                alsAlias.strSend = ""
+            intFlags = 0
+            if alsAlias.blnIgnoreCase:
+                intFlags |= re.IGNORECASE
+            alsAlias.intFlags = intFlags
+            alsAlias.reAlias = re.compile(alsAlias.strMatch, intFlags)
+            alsAlias.stSend = self.compilesend(alsAlias.strSend, alsAlias.reAlias, alsAlias.blnExpandVariables, "alias", alsAlias.strMatch)
+            self.lstAliases.append(alsAlias)
+            self.itAliases.fnAdd(alsAlias)
+        self.lstAliases.sort()
+
+    def compilesend(self, strSend, rePattern, blnExpandVariables, strKind, strMatch):
+        """Parse the send text of a trigger or alias."""
+        try:
+            return SendTemplate(strSend, rePattern, blnExpandVariables)
+        except (sre_constants.error, IndexError):
+            self.mdBot.fnError("Invalid send text in %s '%s': %s" % (strKind, strMatch, sys.exc_value))
+
+    def run(self, strFunctionName, tplArguments, blnSilent = False):
+        """Execute the function in the plugin namespace. A function marked
+           with inthread is run in a worker thread, and a function that
+           returns a Deferred or a generator (run as with inlineCallbacks)
+           carries on without holding up the reactor."""
+        try:
+            fnFunction = self.dicGlobals[strFunctionName]
+        except KeyError:
+            if not blnSilent:
+                self.mdBot.fnException(sys.exc_type, sys.exc_value, sys.exc_traceback)
+            return
+        stStats = self.mdBot.stStats
+        if stStats != None:
+            fltStart = time.time()
+        try:
+            if getattr(fnFunction, "blnInThread", False):
+                objResult = threads.deferToThread(fnFunction, *tplArguments)
+            else:
+                objResult = fnFunction(*tplArguments)
+            if isinstance(objResult, types.GeneratorType):
+                objResult = defer.inlineCallbacks(lambda: objResult)()
+            if isinstance(objResult, defer.Deferred):
+                objResult.addErrback(self.reportfailure)
+        except:
+            self.mdBot.fnException(sys.exc_type, sys.exc_value, sys.exc_traceback)
+        if stStats != None:
+            stStats.fnAdd("plugin", self, self, time.time() - fltStart)
+
+    def reportfailure(self, flFailure):
+        """Report an error from a function that ran asynchronously."""
+        self.mdBot.fnException(flFailure.type, flFailure.value, flFailure.getTracebackObject())
+
+    def load(self, strFilename, cnfConfiguration):
+        """Load the plugin data, triggers, etc."""
+        ccConfig = self.mdBot.smSessions.ccConfig
+        tplKey = ccConfig.fnKey(strFilename)
+        dicCompiled = ccConfig.fnLoad(tplKey)
+        if dicCompiled == None:
+            dicCompiled = self.compile(strFilename)
+            ccConfig.fnStore(tplKey, dicCompiled)
+        else:
+            self.restoreitems(dicCompiled)
+        # Used to tell whether the file has changed when reloading.
+        self.strFilename = strFilename
+        self.tplKey = tplKey
+        self.strName = dicCompiled["name"]
+        self.strID = dicCompiled["id"]
+        self.blnSaveState = dicCompiled["save_state"]
+        self.runscript(dicCompiled)
+        self.openstate(dicCompiled["variables"], cnfConfiguration)
+
+        return self.strID
+
+    def compile(self, strFilename):
+        """Parse a plugin file and load its triggers, aliases and timers.
+           Return what is needed to load it again without parsing it."""
+        try:
+            flPlugin = file(strFilename)
+        except:
+            self.mdBot.fnError("Plugin '%s' cannot be opened." % strFilename)
+
+        xmlTree = ET.parse(flPlugin)
+        xmlRoot = xmlTree.getroot()
+
+        # Load generic plugin configuration.
+        dicCompiled = {}
+        xmlPlugin = xmlTree.find("plugin")
+        dicCompiled["name"] = self.getxmlattr(xmlPlugin, "name")
+        dicCompiled["id"] = self.getxmlattr(xmlPlugin, "id")
+        dicCompiled["save_state"] = self.getxmlattr(xmlPlugin, "save_state", True)
+        if self.getxmlattr(xmlPlugin, "language").lower() != "python":
+            self.mdBot.fnError("The only plugin language supported is Python, error in '%s'." % strFilename)
+        self.compilescript(dicCompiled, xmlTree.find("script").text, strFilename)
+        dicCompiled["variables"] = self.loadstate(xmlRoot)
+
+        # Load aliases, triggers and timers.
+        self.loadaliases(xmlRoot.find("aliases"))
+        self.loadtriggers(xmlRoot.find("triggers"))
+        self.loadtimers(xmlRoot.find("timers"))
+        dicCompiled.update(self.dumpitems())
+
+        flPlugin.close()
+
+        return dicCompiled
+
+    def compilescript(self, dicCompiled, strScript, strFilename):
+        """Compile the plugin's script into dicCompiled. If it does not
+           compile, the error is reported when it is run."""
+        dicCompiled["script"] = strScript
+        try:
+            dicCompiled["code"] = marshal.dumps(compile(strScript, strFilename, "exec"))
+        except:
+            dicCompiled["code"] = None
+
+    def runscript(self, dicCompiled):
+        """Execute the script and keep the globals."""
+        self.cbWorld = Callbacks(self)
+        self.dicGlobals = {"world": self.cbWorld, "inthread": inthread}
+        try:
+            if dicCompiled["code"] == None:
+                exec(dicCompiled["script"], self.dicGlobals)
+            else:
+                exec(marshal.loads(dicCompiled["code"]), self.dicGlobals)
+        except:
+            self.mdBot.fnException(sys.exc_type, sys.exc_value, sys.exc_traceback)
+        # Functions in worker threads reach the world through the reactor.
+        for objGlobal in self.dicGlobals.values():
+            if getattr(objGlobal, "blnInThread", False):
+                self.dicGlobals["world"] = ThreadCallbacks(self.cbWorld)
+                break
+
+    def dumpitems(self):
+        """Return the triggers, aliases and timers in a form that can be
+           pickled. Regular expressions are left out; unpickling would
+           compile them all again, so they are compiled when first used."""
+        dicItems = {"triggers": [], "aliases": [], "timers": []}
+        for trgTrigger in self.lstTriggers:
+            dicTrigger = trgTrigger.__dict__.copy()
+            del dicTrigger["reTrigger"]
+            dicItems["triggers"].append(dicTrigger)
+        for alsAlias in self.lstAliases:
+            dicAlias = alsAlias.__dict__.copy()
+            del dicAlias["reAlias"]
+            dicItems["aliases"].append(dicAlias)
+        for tmrTimer in self.lstTimers:
+            dicItems["timers"].append(tmrTimer.__dict__.copy())
+        return dicItems
+
+    def restoreitems(self, dicItems):
+        """Recreate the triggers, aliases and timers from dumpitems()."""
+        self.lstTriggers = []
+        self.itTriggers = ItemIndex()
+        for dicTrigger in dicItems["triggers"]:
+            trgTrigger = Plugin.Trigger()
+            trgTrigger.__dict__.update(dicTrigger)
+            self.lstTriggers.append(trgTrigger)
+            self.itTriggers.fnAdd(trgTrigger)
+        self.indextriggers()
+        self.lstAliases = []
+        self.itAliases = ItemIndex()
+        for dicAlias in dicItems["aliases"]:
+            alsAlias = Plugin.Alias()
+            alsAlias.__dict__.update(dicAlias)
+            self.lstAliases.append(alsAlias)
+            self.itAliases.fnAdd(alsAlias)
+        self.lstTimers = []
+        self.dicTemporaryTimers = {}
+        self.itTimers = ItemIndex()
+        for dicTimer in dicItems["timers"]:
+            tmrTimer = Plugin.Timer()
+            tmrTimer.__dict__.update(dicTimer)
+            tmrTimer.fltTime = time.time() + tmrTimer.intOffsetHour * 3600 + tmrTimer.intOffsetMinute * 60 + tmrTimer.intOffsetSecond
+            self.lstTimers.append(tmrTimer)
+            self.itTimers.fnAdd(tmrTimer)
+
+    def loadstate(self, xmlRoot):
+        """Load the world variables from an xml node."""
+        dicVariables = {}
+        try:
+            lstVariables = xmlRoot.find("variables").getchildren()
+        except:
+            return {}
+
+        for etElement in lstVariables:
+            if etElement.text == None:
+                dicVariables[etElement.attrib["name"].lower()] = ""
+            else:
+                dicVariables[etElement.attrib["name"].lower()] = etElement.text
+
+        return dicVariables
+
+    def openstate(self, dicVariables, cnfConfiguration):
+        """Set the plugin's variables from the ones in its file and its
+           saved state."""
+        self.dicVariables = dicVariables
+        self.ssState = StateStore("state/%s-%s-state.xml" % (cnfConfiguration.strID, self.strID), self.dicVariables, cnfConfiguration.fltStateDelay, cnfConfiguration.blnStateJournal, cnfConfiguration.intStateCompact, cnfConfiguration.strCharset)
+        # Load state variables (variables that already exist will be
+        # overwritten).
+        try:
+            flState = file(self.ssState.strFilename)
+        except:
+            pass
+        else:
+            xmlState = ET.parse(flState).getroot()
+            flState.close()
+            self.dicVariables.update(self.loadstate(xmlState))
+            self.ssState.fnLoaded(xmlState)
+        self.ssState.fnReplay()
+
+    def savestate(self, blnNow = False):
+        """Save the plugin state, after a short delay unless blnNow is
+           True."""
+        if not self.blnSaveState:
+            return
+        if blnNow:
+            self.ssState.fnFlush()
+        else:
+            self.ssState.fnSave()
+
+    def fnselyn(self, strText):
+        """Convert 'y'/'n' to True or False."""
+        if strText.lower() == "y":
+            return True
+        else:
+            return False
+
+    # Attribute defaults for getxmlattr(). Attributes without a default are
+    # mandatory.
+    dicAttributes = {
+        "appendin": "",                              # Text to append to incoming data.
+        "appendout": "",                             # Text to append to outgoing data.
+        "active_closed": False,                      # Is timer active when the world is closed? (NS)
+        "at_time": False,                            # At time for timer. (NS)
+        "back_colour": 0,                            # Backcolour to match on. (NS)
+        "bold": False,                               # Match if the text is bold. (NS)
+        "blockinterval": 60,                         # Seconds to wait before writing a block of the indexed log.
+        "buffersize": 65536,                         # Bytes of log data to buffer before writing.
+        "charset": "latin-1",                        # Character set of the MUD, e.g. utf-8 or cp437.
+        "clientbuffer": 1048576,                     # Bytes to hold back for a slow remote client.
+        "coalesce": False,                           # Drop a command if the same one is already waiting.
+        "connectioncommands": "",                    # Commands to send on connection.
+        "debug": False,                              # Print debugging data in the output.
+        "enabled": False,                            # Is the item enabled?
+        "expand_variables": False,                   # Expand variables. (NS)
+        "echo_alias": False,                         # Echo the alias. (NS)
+        "flushinterval": 1,                          # Seconds to wait before writing buffered log data.
+        "group": "",                                 # Item group name.
+        "highlight": "",                             # SGR codes to show the matched text in, e.g. "1;33".
+        "hour": 0,                                   # Hour interval for timers. (NS)
+        "ignore_case": False,                        # Ignore case. (NS)
+        "indexed": False,                            # Write the log as compressed, indexed segments.
+        "inverse": False,                            # Match if the text is inverse. (NS)
+        "italic": False,                             # Match if the text is italic. (NS)
+        "keep_ansi": False,                          # Keep the ANSI codes to match on.
+        "keep_evaluating": True,                     # Keep evaluating after a trigger has been matched.
+        "localport": 4000,                           # Port number to listen to.
+        "logfile": "log.txt",                        # Log filename.
+        "logging": False,                            # Is logging enabled?
+        "match_back_colour": False,                  # Enable match on backcolour.
+        "match_bold": False,                         # Enable match on bold.
+        "match_inverse": False,                      # Enable match on inverse.
+        "match_italic": False,                       # Enable match on italic.
+        "match_text_colour": False,                  # Enable match on forecolour.
+        "maxclients": 4,                             # Remote clients that can be connected at once.
+        "maxlinelength": 65536,                      # Longest line to buffer from the MUD.
+        "maxsize": 0,                                # Rotate the log when it grows past this many bytes.
+        "mccp": True,                                # Accept MCCP2 compression from the MUD.
+        "minute": 0,                                 # Minute interval for timers. (NS)
+        "name": "",                                  # Item name.
+        "notetoconsole": False,                      # Send notes to the console.
+        "notetolog": False,                          # Write notes to the log.
+        "notetoremote": True,                        # Send notes to the remote client.
+        "offset_hour": 0,                            # Hour offset for timers. (NS)
+        "offset_minute": 0,                          # Minute offset for timers. (NS)
+        "offset_second": 0,                          # Second offset for timers. (NS)
+        "omit_from_command_history": False,          # Omit line from logfile. (NS)
+        "omit_from_log": False,                      # Omit line from logfile. (NS)
+        "omit_from_output": False,                   # Omit the line from the remote clients' output.
+        "one_shot": False,                           # Is timer one-shot? (NS)
+        "outputfilter": False,                       # Let triggers gag, rewrite and highlight what remote clients see.
+        "onconnect": "",                             # Log text to append on connection.
+        "ondisconnect": "",                          # Log text to append on disconnection.
+        "onremoteconnect": "",                       # Log text to append on remote client connection.
+        "onremotedisconnect": "",                    # Log text to append on remote client disconnection.
+        "port": 4000,                                # Port to connect on.
+        "prependin": "",                             # Text to prepend to incoming data.
+        "prependout": "",                            # Text to prepend to outgoing data.
+        "prompttimeout": 0.2,                        # Seconds to wait before sending an unfinished line to remote clients.
+        "profile": True,                             # Count the calls and time of triggers, aliases, timers and scripts.
+        "reconnect": False,                          # Reconnect when the connection fails or drops.
+        "reconnectattempts": 0,                      # Attempts to reconnect before giving up, 0 for no limit.
+        "reconnectbackoff": 2,                       # Factor the delay grows by with every failed attempt.
+        "reconnectdelay": 5,                         # Seconds to wait before the first attempt.
+        "reconnectjitter": 0.25,                     # Fraction by which the delay is randomly varied.
+        "reconnectmaxdelay": 300,                    # Longest delay between attempts.
+        "regexp": False,                             # Is the trigger a regular expression?
+        "repeat": False,                             # Repeat the trigger on the same line. (NS)
+        "rewrite": "",                               # Text to show remote clients instead of the matched line.
+        "rotate": False,                             # Start a new log when the expanded logfile name changes.
+        "save_state": False,                         # Save the namespace's state. (NS)
+        "script": "",                                # Call a script function when executed.
+        "scrollback": 1000,                          # Lines of MUD output to keep for remote clients, 0 to keep none.
+        "scrollbackbytes": 1048576,                  # Bytes of MUD output to keep for remote clients.
+        "second": 0,                                 # Second interval for timers. (NS)
+        "segmentinterval": 3600,                     # Seconds covered by each segment of the indexed log.
+        "send_to": 0,                                # Send to various outputs. (PS)
+        "sendburst": 10,                             # Commands that can be sent at once before the rate applies.
+        "sendrate": 0,                               # Commands per second to send to the MUD, 0 for no limit.
+        "sequence": 100,                             # Sequence of the trigger.
+        "statecompact": 1000,                        # Journal entries to keep before rewriting the state file.
+        "statedelay": 5,                             # Seconds to wait before writing saved state.
+        "statejournal": False,                       # Append state changes to a journal.
+        "statsfile": "",                             # File to write the profiling counters to.
+        "statsinterval": 300,                        # Seconds between writes of the stats file.
+        "toscreen": False,                           # Print the output to stdout.
+        "text_colour": 0,                            # Forecolour to match on. (NS)
+        "variable": "",                              # Variable to send to (NS)
+    }
+
+    def getxmlattr(self, xmlNode, strAttribute, blnYN = False):
+        """Get the value of strAttribute from xmlNode, converting it to
+           binary if blnYN is True. If not found, return its default. If
+           the default does not exist, it is a mandatory attribute."""
+        if strAttribute in xmlNode.attrib:
+            if blnYN:
+                return self.fnselyn(xmlNode.attrib[strAttribute])
+            else:
+                return xmlNode.attrib[strAttribute]
+        else:
+            if strAttribute in self.dicAttributes:
+                return self.dicAttributes[strAttribute]
+            else:
+                self.mdBot.fnError("Mandatory attribute \"%s\" does not exist." % strAttribute)
+
+
+class Configuration:
+    def __init__(self, mdBot, strFilename, dicReuse = {}):
+        """Load the configuration from the specified file. Plugins in
+           dicReuse (filename -> plugin) are used instead of loading their
+           files again."""
+        self.mdBot = mdBot
+        # Create this here so we can access the getxmlattr function.
+        self.dicPlugins = {"000000000000000000000000": Plugin(mdBot)}
+        plgNamespace = self.dicPlugins["000000000000000000000000"]
+        ccConfig = self.mdBot.smSessions.ccConfig
+        tplKey = ccConfig.fnKey(strFilename)
+        dicCompiled = ccConfig.fnLoad(tplKey)
+        if dicCompiled == None:
+            dicCompiled = self.compile(strFilename, plgNamespace)
+            ccConfig.fnStore(tplKey, dicCompiled)
+        else:
+            self.__dict__.update(dicCompiled["configuration"])
+            self.strPassword = self.readpassword(strFilename, plgNamespace)
+            plgNamespace.restoreitems(dicCompiled)
+
+        # Pass the standard namespace to the plugin so we can access it.
+        plgNamespace.strID = "000000000000000000000000"
+        plgNamespace.strName = "Main namespace"
+        plgNamespace.blnSaveState = True
+        plgNamespace.strFilename = strFilename
+        plgNamespace.tplKey = tplKey
+        plgNamespace.runscript(dicCompiled)
+        plgNamespace.openstate(dicCompiled["variables"], self)
+
+        self.strFilename = strFilename
+        self.lstPluginFiles = dicCompiled["plugins"]
+        self.loadplugins(dicReuse)
+
+    def loadplugins(self, dicReuse):
+        """Load the plugins, reusing the ones in dicReuse."""
+        for strPlugin in self.lstPluginFiles:
+            if strPlugin in dicReuse:
+                plgPlugin = dicReuse[strPlugin]
+                strID = plgPlugin.strID
+            else:
+                plgPlugin = Plugin(self.mdBot)
+                strID = plgPlugin.load(strPlugin, self)
+            if strID in self.dicPlugins:
+                self.mdBot.fnError("Duplicate plugin '%s' found." % strPlugin)
+            else:
+                self.dicPlugins[strID] = plgPlugin
+
+    def readpassword(self, strFilename, plgNamespace):
+        """Return the password from the configuration file, parsing only
+           the root element."""
+        try:
+            for strEvent, xmlRoot in ET.iterparse(strFilename, ("start",)):
+                break
+        except:
+            self.mdBot.fnError("Cannot parse file '%s'." % strFilename)
+        return base64.decodestring(plgNamespace.getxmlattr(xmlRoot, "password"))
+
+    def compile(self, strFilename, plgNamespace):
+        """Parse the configuration file and load the main namespace's
+           triggers, aliases and timers. Return what is needed to load it
+           again without parsing it."""
+        try:
+            flFile = file(strFilename)
+        except:
+            self.mdBot.fnError("Cannot open file '%s' for reading." % strFilename)
+        try:
+            xmlTree = ET.parse(flFile)
+        except:
+            self.mdBot.fnError("Cannot parse file '%s'." % strFilename)
+        xmlRoot = xmlTree.getroot()
+
+        # World ID.
+        self.strID = plgNamespace.getxmlattr(xmlRoot, "id")
+
+        # Connection details.
+        self.strHost = plgNamespace.getxmlattr(xmlRoot, "host")
+        self.intPort = int(plgNamespace.getxmlattr(xmlRoot, "port"))
+        self.intLocalPort = int(plgNamespace.getxmlattr(xmlRoot, "localport"))
+        self.intMaxLineLength = int(plgNamespace.getxmlattr(xmlRoot, "maxlinelength"))
+        self.blnOutputFilter = plgNamespace.getxmlattr(xmlRoot, "outputfilter", True)
+        self.fltPromptTimeout = float(plgNamespace.getxmlattr(xmlRoot, "prompttimeout"))
+        self.strCharset = plgNamespace.getxmlattr(xmlRoot, "charset")
+        try:
+            codecs.lookup(self.strCharset)
+        except LookupError:
+            self.mdBot.fnError("Unknown character set '%s'." % self.strCharset)
+        self.blnMCCP = plgNamespace.getxmlattr(xmlRoot, "mccp", True)
+        self.intMaxClients = int(plgNamespace.getxmlattr(xmlRoot, "maxclients"))
+        self.intClientBuffer = int(plgNamespace.getxmlattr(xmlRoot, "clientbuffer"))
+        self.intScrollbackLines = int(plgNamespace.getxmlattr(xmlRoot, "scrollback"))
+        self.intScrollbackBytes = int(plgNamespace.getxmlattr(xmlRoot, "scrollbackbytes"))
+        self.strName = plgNamespace.getxmlattr(xmlRoot, "name")
+        self.strPassword = base64.decodestring(plgNamespace.getxmlattr(xmlRoot, "password"))
+        self.strConnectionCommands = plgNamespace.getxmlattr(xmlRoot, "connectioncommands").decode("string_escape")
+
+        # Reconnecting.
+        self.blnReconnect = plgNamespace.getxmlattr(xmlRoot, "reconnect", True)
+        self.intReconnectAttempts = int(plgNamespace.getxmlattr(xmlRoot, "reconnectattempts"))
+        self.fltReconnectBackoff = float(plgNamespace.getxmlattr(xmlRoot, "reconnectbackoff"))
+        self.fltReconnectDelay = float(plgNamespace.getxmlattr(xmlRoot, "reconnectdelay"))
+        self.fltReconnectJitter = min(1.0, float(plgNamespace.getxmlattr(xmlRoot, "reconnectjitter")))
+        self.fltReconnectMaxDelay = float(plgNamespace.getxmlattr(xmlRoot, "reconnectmaxdelay"))
+
+        # Command queue.
+        self.fltSendRate = float(plgNamespace.getxmlattr(xmlRoot, "sendrate"))
+        self.intSendBurst = max(1, int(plgNamespace.getxmlattr(xmlRoot, "sendburst")))
+        self.blnCoalesce = plgNamespace.getxmlattr(xmlRoot, "coalesce", True)
+
+        # Plugin state.
+        self.fltStateDelay = float(plgNamespace.getxmlattr(xmlRoot, "statedelay"))
+        self.blnStateJournal = plgNamespace.getxmlattr(xmlRoot, "statejournal", True)
+        self.intStateCompact = int(plgNamespace.getxmlattr(xmlRoot, "statecompact"))
+
+        # Debugging.
+        self.blnDebug = plgNamespace.getxmlattr(xmlRoot, "debug", True)
+        self.blnNoteToConsole = plgNamespace.getxmlattr(xmlRoot, "notetoconsole", True)
+        self.blnNoteToLog = plgNamespace.getxmlattr(xmlRoot, "notetolog", True)
+        self.blnNoteToRemote = plgNamespace.getxmlattr(xmlRoot, "notetoremote", True)
+
+        # Profiling.
+        self.blnProfile = plgNamespace.getxmlattr(xmlRoot, "profile", True)
+        self.strStatsFile = plgNamespace.getxmlattr(xmlRoot, "statsfile")
+        self.fltStatsInterval = float(plgNamespace.getxmlattr(xmlRoot, "statsinterval"))
+
+        # Logging.
+        xmlLogging = xmlRoot.find("logging")
+        self.blnLogging = plgNamespace.getxmlattr(xmlLogging, "enabled", True)
+        self.blnToScreen = plgNamespace.getxmlattr(xmlLogging, "toscreen", True)
+        self.blnKeepANSI = plgNamespace.getxmlattr(xmlLogging, "keep_ansi", True)
+        self.strLogFile = plgNamespace.getxmlattr(xmlLogging, "logfile")
+        self.intLogBufferSize = int(plgNamespace.getxmlattr(xmlLogging, "buffersize"))
+        self.fltLogFlushInterval = float(plgNamespace.getxmlattr(xmlLogging, "flushinterval"))
+        self.blnLogRotate = plgNamespace.getxmlattr(xmlLogging, "rotate", True)
+        self.intLogMaxSize = int(plgNamespace.getxmlattr(xmlLogging, "maxsize"))
+        self.blnLogIndexed = plgNamespace.getxmlattr(xmlLogging, "indexed", True)
+        self.intLogSegmentInterval = max(1, int(plgNamespace.getxmlattr(xmlLogging, "segmentinterval")))
+        self.fltLogBlockInterval = float(plgNamespace.getxmlattr(xmlLogging, "blockinterval"))
+        self.strAppendIn = plgNamespace.getxmlattr(xmlLogging, "appendin").decode("string_escape")
+        self.strAppendOut = plgNamespace.getxmlattr(xmlLogging, "appendout").decode("string_escape")
+        self.strPrependIn = plgNamespace.getxmlattr(xmlLogging, "prependin").decode("string_escape")
+        self.strPrependOut = plgNamespace.getxmlattr(xmlLogging, "prependout").decode("string_escape")
+        self.strOnConnect = plgNamespace.getxmlattr(xmlLogging, "onconnect").decode("string_escape")
+        self.strOnConnectFailed = plgNamespace.getxmlattr(xmlLogging, "onconnectfailed").decode("string_escape")
+        self.strOnDisconnect = plgNamespace.getxmlattr(xmlLogging, "ondisconnect").decode("string_escape")
+        self.strOnRemoteConnect = plgNamespace.getxmlattr(xmlLogging, "onremoteconnect").decode("string_escape")
+        self.strOnRemoteDisconnect = plgNamespace.getxmlattr(xmlLogging, "onremotedisconnect").decode("string_escape")
+
+        dicCompiled = {"configuration": self.__dict__.copy()}
+        del dicCompiled["configuration"]["mdBot"]
+        del dicCompiled["configuration"]["dicPlugins"]
+        # The password is read from the file every time instead of cached.
+        del dicCompiled["configuration"]["strPassword"]
+        plgNamespace.compilescript(dicCompiled, xmlTree.find("script").text, strFilename)
+        dicCompiled["variables"] = plgNamespace.loadstate(xmlRoot)
+
+        # Load triggers, timers.
+        plgNamespace.loadtriggers(xmlRoot.find("triggers"))
+        plgNamespace.loadaliases(xmlRoot.find("aliases"))
+        plgNamespace.loadtimers(xmlRoot.find("timers"))
+        dicCompiled.update(plgNamespace.dumpitems())
+
+        dicCompiled["plugins"] = []
+        if xmlRoot.find("plugins"):
+            for xmlPlugin in xmlRoot.find("plugins"):
+                dicCompiled["plugins"].append(xmlPlugin.attrib["name"])
+        flFile.close()
+
+        return dicCompiled
+
+class LineFramer:
+    """Decode a stream and split it into lines. Only the unfinished line is
+       kept between chunks, and its pieces are joined once, when the newline
+       arrives. The decoder keeps a character that is split across chunks
+       until the rest of it arrives."""
+    def __init__(self, intMaxLength = 0, strCharset = None):
+        self.lstPartial = []
+        self.intPartial = 0
+        self.intMaxLength = intMaxLength
+        if strCharset:
+            self.idDecoder = codecs.getincrementaldecoder(strCharset)("replace")
+        else:
+            self.idDecoder = None
+
+    def fnFeed(self, strData):
+        """Return the lines completed by the data."""
+        if self.idDecoder != None:
+            strData = self.idDecoder.decode(strData)
+        strData = strData.replace("\r", "")
+        lstLines = []
+        intStart = 0
+        intEnd = strData.find("\n")
+        while intEnd != -1:
+            if self.lstPartial:
+                self.lstPartial.append(strData[intStart:intEnd])
+                lstLines.append("".join(self.lstPartial))
+                self.lstPartial = []
+                self.intPartial = 0
+            else:
+                lstLines.append(strData[intStart:intEnd])
+            intStart = intEnd + 1
+            intEnd = strData.find("\n", intStart)
+        if intStart < len(strData):
+            if intStart == 0:
+                self.lstPartial.append(strData)
+            else:
+                self.lstPartial.append(strData[intStart:])
+            self.intPartial += len(strData) - intStart
+            if self.intMaxLength and self.intPartial > self.intMaxLength:
+                # Don't buffer a runaway line forever, cut it into pieces
+                # of the maximum length and keep the remainder.
+                strPartial = "".join(self.lstPartial)
+                intOffset = 0
+                while len(strPartial) - intOffset > self.intMaxLength:
+                    lstLines.append(strPartial[intOffset:intOffset + self.intMaxLength])
+                    intOffset += self.intMaxLength
+                self.lstPartial = [strPartial[intOffset:]]
+                self.intPartial = len(strPartial) - intOffset
+        return lstLines
+
+    def fnPartial(self):
+        """Return the unfinished line."""
+        return "".join(self.lstPartial)
+
+class OutputFilter:
+    """Send the MUD's output to the remote clients a line at a time, after
+       the triggers have had the chance to gag, rewrite or highlight it. An
+       unfinished line, such as a prompt, is sent once no more of it has
+       arrived for a short while."""
+    def __init__(self, mdBot, lfFramer):
+        self.mdBot = mdBot
+        self.lfFramer = lfFramer
+        # How much of the unfinished line the clients have been sent.
+        self.intPromptSent = 0
+        self.dcPrompt = None
+
+    def fnFeed(self, strData):
+        """Process the lines completed by the data and send the result to
+           the clients in one write. What the triggers send to the clients,
+           such as notes, follows the line that caused it."""
+        lstOutput = []
+        for strLine in self.lfFramer.fnFeed(strData):
+            srvClients = self.mdBot.cntClientConnection
+            if srvClients:
+                srvClients.lstHeld = []
+            try:
+                self.mdBot.fnProcessData(strLine)
+            finally:
+                if srvClients:
+                    lstHeld = srvClients.lstHeld
+                    srvClients.lstHeld = None
+            strOutput = self.mdBot.plLine.fnOutput()
+            if self.intPromptSent:
+                # The start of the line has already been sent as a prompt,
+                # send the rest unless the triggers have changed the start.
+                # If they have, or have gagged the line, end the prompt's
+                # line first, as the rest would have.
+                if strOutput != None and strOutput.startswith(strLine[:self.intPromptSent]):
+                    strOutput = strOutput[self.intPromptSent:]
+                else:
+                    lstOutput.append("\r\n")
+                self.intPromptSent = 0
+            if strOutput != None:
+                lstOutput.append(strOutput)
+                lstOutput.append("\r\n")
+            if srvClients:
+                lstOutput.extend(lstHeld)
+        if lstOutput and self.mdBot.cntClientConnection:
+            # Notes may be bytes, which only join the lines once encoded.
+            self.mdBot.cntClientConnection.fnSend("".join([self.mdBot.fnEncode(strPart) for strPart in lstOutput]))
+        if self.lfFramer.intPartial > self.intPromptSent:
+            if self.dcPrompt != None and self.dcPrompt.active():
+                self.dcPrompt.reset(self.mdBot.cnfConfiguration.fltPromptTimeout)
+            else:
+                self.dcPrompt = reactor.callLater(self.mdBot.cnfConfiguration.fltPromptTimeout, self.fnFlushPrompt)
+        else:
+            self.fnStop()
+
+    def fnFlushPrompt(self):
+        """Send what has arrived of the unfinished line."""
+        self.dcPrompt = None
+        strPartial = self.lfFramer.fnPartial()
+        if self.mdBot.cntClientConnection:
+            self.mdBot.cntClientConnection.fnSend(strPartial[self.intPromptSent:])
+        self.intPromptSent = len(strPartial)
+
+    def fnStop(self):
+        if self.dcPrompt != None and self.dcPrompt.active():
+            self.dcPrompt.cancel()
+        self.dcPrompt = None
+
+class TelnetParser:
+    """Remove the telnet commands from the MUD's stream, answer option
+       negotiation and decompress MCCP2 (zlib) compressed data."""
+    TS_DATA = 0
+    TS_IAC = 1
+    TS_OPTION = 2
+    TS_SB = 3
+    TS_SB_IAC = 4
+
+    def __init__(self, mdBot, fnWrite, blnMCCP = True):
+        self.mdBot = mdBot
+        # fnWrite sends raw data back to the MUD.
+        self.fnWrite = fnWrite
+        self.blnMCCP = blnMCCP
+        self.intState = TelnetParser.TS_DATA
+        self.strCommand = ""
+        self.lstSubnegotiation = []
+        # Option -> whether it is enabled, on the MUD's side and on ours.
+        # An option that is in here but False has been refused or turned
+        # off, so a repeated request for it is not answered again.
+        self.dicRemoteOptions = {}
+        self.dicLocalOptions = {}
+        self.zlDecompressor = None
+
+    def fnFeed(self, strData):
+        """Return the data with the telnet commands removed."""
+        lstOutput = []
+        while strData:
+            if self.zlDecompressor != None:
+                try:
+                    strPlain = self.zlDecompressor.decompress(strData)
+                except zlib.error:
+                    self.mdBot.fnNoteData("MCCP decompression failed, the rest of the stream is lost.")
+                    self.zlDecompressor = None
+                    break
+                strData = self.zlDecompressor.unused_data
+                if strData:
+                    # The compressed stream has ended, the rest is plain.
+                    self.zlDecompressor = None
+                self.fnParse(strPlain, lstOutput)
+            else:
+                intConsumed = self.fnParse(strData, lstOutput)
+                strData = strData[intConsumed:]
+        return "".join(lstOutput)
+
+    def fnParse(self, strData, lstOutput):
+        """Parse plain telnet data, appending the text to lstOutput. Return
+           how much was consumed, which is less than all of it if
+           compression starts part of the way through."""
+        intIndex = 0
+        intLength = len(strData)
+        while intIndex < intLength:
+            if self.intState == TelnetParser.TS_DATA:
+                intNext = strData.find(IAC, intIndex)
+                if intNext == -1:
+                    lstOutput.append(strData[intIndex:])
+                    return intLength
+                lstOutput.append(strData[intIndex:intNext])
+                intIndex = intNext + 1
+                self.intState = TelnetParser.TS_IAC
+                continue
+            strChar = strData[intIndex]
+            intIndex += 1
+            if self.intState == TelnetParser.TS_IAC:
+                if strChar == IAC:
+                    # An escaped 255 byte.
+                    lstOutput.append(IAC)
+                    self.intState = TelnetParser.TS_DATA
+                elif strChar in (WILL, WONT, DO, DONT):
+                    self.strCommand = strChar
+                    self.intState = TelnetParser.TS_OPTION
+                elif strChar == SB:
+                    self.lstSubnegotiation = []
+                    self.intState = TelnetParser.TS_SB
+                else:
+                    # GA, NOP and the like carry nothing for us.
+                    self.intState = TelnetParser.TS_DATA
+            elif self.intState == TelnetParser.TS_OPTION:
+                self.fnNegotiate(self.strCommand, strChar)
+                self.intState = TelnetParser.TS_DATA
+            elif self.intState == TelnetParser.TS_SB:
+                if strChar == IAC:
+                    self.intState = TelnetParser.TS_SB_IAC
+                else:
+                    self.lstSubnegotiation.append(strChar)
+            elif self.intState == TelnetParser.TS_SB_IAC:
+                if strChar == SE:
+                    self.intState = TelnetParser.TS_DATA
+                    if "".join(self.lstSubnegotiation) == TELOPT_COMPRESS2 and self.dicRemoteOptions.get(TELOPT_COMPRESS2):
+                        # Everything after this is compressed.
+                        self.zlDecompressor = zlib.decompressobj()
+                        return intIndex
+                elif strChar == IAC:
+                    self.lstSubnegotiation.append(IAC)
+                    self.intState = TelnetParser.TS_SB
+                else:
+                    self.intState = TelnetParser.TS_SB
+        return intLength
+
+    def fnNegotiate(self, strCommand, strOption):
+        """Answer an option negotiation request. As in RFC 1143, there is
+           only an answer when the state of the option changes, so that a
+           MUD repeating itself cannot start a negotiation loop."""
+        if strCommand == WILL:
+            if strOption == TELOPT_ECHO or (strOption == TELOPT_COMPRESS2 and self.blnMCCP):
+                if not self.dicRemoteOptions.get(strOption):
+                    self.dicRemoteOptions[strOption] = True
+                    self.fnWrite(IAC + DO + strOption)
+            elif strOption not in self.dicRemoteOptions:
+                self.dicRemoteOptions[strOption] = False
+                self.fnWrite(IAC + DONT + strOption)
+        elif strCommand == WONT:
+            if self.dicRemoteOptions.get(strOption):
+                self.dicRemoteOptions[strOption] = False
+                self.fnWrite(IAC + DONT + strOption)
+        elif strCommand == DO:
+            # We don't support any options on our side.
+            if strOption not in self.dicLocalOptions:
+                self.dicLocalOptions[strOption] = False
+                self.fnWrite(IAC + WONT + strOption)
+
+class MUDProtocol(LineReceiver):
+    def __init__(self, mdBot):
+        self.mdBot = mdBot
+        self.setRawMode()
+        self.delimiter = "\n"
+        self.tpTelnet = TelnetParser(self.mdBot, self.fnWriteRaw, self.mdBot.cnfConfiguration.blnMCCP)
+        self.lfFramer = LineFramer(self.mdBot.cnfConfiguration.intMaxLineLength, self.mdBot.cnfConfiguration.strCharset)
+        self.ofFilter = OutputFilter(self.mdBot, self.lfFramer)
+    def fnWriteRaw(self, data):
+        if self.mdBot.srRecorder != None:
+            self.mdBot.srRecorder.fnRecord(SessionRecorder.REC_OUT, data)
+        self.mdBot.intBytesOut += len(data)
+        self.transport.write(data)
+    def rawDataReceived(self, data):
+        self.mdBot.intBytesIn += len(data)
+        if self.mdBot.srRecorder != None:
+            self.mdBot.srRecorder.fnRecord(SessionRecorder.REC_IN, data)
+        data = self.tpTelnet.fnFeed(data)
+        if not data:
+            return
+        if self.mdBot.cnfConfiguration.blnOutputFilter:
+            self.ofFilter.fnFeed(data)
+            return
+        if self.mdBot.cntClientConnection:
+            self.mdBot.cntClientConnection.fnSend(data)
+        for line in self.lfFramer.fnFeed(data):
+            self.mdBot.fnProcessData(line)
+    def connectionLost(self, reason):
+        self.ofFilter.fnStop()
+        self.mdBot.stConnectionState = AC_DISCONNECTED
+        self.mdBot.OnDisconnect()
+        self.mdBot.cntConnection.cleanup()
+
+class MUDConnection:
+    def __init__(self, mdBot, host, port):
+        self.mdBot = mdBot
+        self.protocol = None
+        self.mdBot.stConnectionState = AC_CONNECTING
+        creator = ClientCreator(reactor, MUDProtocol, mdBot)
+        deferred = creator.connectTCP(host, port)
+        deferred.addCallback(self.builtProtocol)
+        deferred.addErrback(self.connectionFailed)
+    def connectionFailed(self, reason):
+        self.mdBot.stConnectionState = AC_DISCONNECTED
+        self.mdBot.OnConnectFailed()
+        self.cleanup()
+    def builtProtocol(self, protocol):
+        self.protocol = protocol
+        self.mdBot.stConnectionState = AC_CONNECTED
+        self.mdBot.OnConnect()
+        # The remote clients may still be there from before a reconnection.
+        if self.mdBot.cntClientConnection == None:
+            self.mdBot.cntClientConnection = MUDServer(self.mdBot)
+    def sendLine(self, line):
+        # Escape any 255 bytes so they aren't taken for telnet commands.
+        line = line.replace(IAC, IAC + IAC)
+        if self.mdBot.srRecorder != None:
+            self.mdBot.srRecorder.fnRecord(SessionRecorder.REC_OUT, line + self.protocol.delimiter)
+        self.mdBot.intLinesOut += 1
+        self.mdBot.intBytesOut += len(line) + len(self.protocol.delimiter)
+        self.protocol.sendLine(line)
+    def close(self):
+        self.protocol.transport.loseConnection()
+    def cleanup(self):
+        self.protocol = None
+        self.mdBot.stConnectionState = AC_DISCONNECTED
+        self.mdBot.cntConnection = None
+        # Reconnect, or give the plugins' timers a chance to keep us running.
+        self.mdBot.fnConnectionEnded()
+
+class MUDServerProtocol(LineReceiver):
+    def lineReceived(self, line):
+        if self.intState == 0:
+            self.strAuthName = line
+            self.intState = 1
+            self.sendLine("Please enter the character password:")
+        elif self.intState == 1:
+            if self.strAuthName.lower() == self.factory.mdBot.cnfConfiguration.strName.lower() and line == self.factory.mdBot.cnfConfiguration.strPassword:
+                self.intState = 2
+                if self.dcTimeout.active():
+                    self.dcTimeout.cancel()
+                self.sendLine("Welcome to %s.\n" % self.factory.mdBot.cnfConfiguration.strName)
+                # Catch up on what arrived before the client attached.
+                lstLines = self.factory.mdBot.sbScrollback.fnGetLines()
+                if lstLines:
+                    self.fnSend("\n".join(lstLines) + "\n")
+                self.factory.mdBot.OnRemoteConnect(self.transport.getPeer().host)
+            else:
+                self.sendLine("Wrong name/password.\n")
+                self.transport.loseConnection()
+        elif self.intState == 2:
+            if line.strip().lower() == "#reload":
+                self.factory.mdBot.fnReload()
+            elif line.strip().lower() == "#stats":
+                if self.factory.mdBot.stStats == None:
+                    self.sendLine("Profiling is off.")
+                else:
+                    self.sendLine("\n".join(self.factory.mdBot.stStats.fnReport()))
+            else:
+                if self.factory.mdBot.srRecorder != None:
+                    self.factory.mdBot.srRecorder.fnRecord(SessionRecorder.REC_CLIENT, line)
+                self.factory.mdBot.fnMatchAliases(line.decode(self.factory.mdBot.cnfConfiguration.strCharset, "replace"), self)
+    def connectionLost(self, reason):
+        if self.dcTimeout.active():
+            self.dcTimeout.cancel()
+        if self in self.factory.lstClients:
+            self.factory.lstClients.remove(self)
+        if self.intState == 2:
+            self.factory.mdBot.OnRemoteDisconnect(self.transport.getPeer().host)
+    def connectionMade(self):
+        self.intState = 0 # Name auth
+        # Output that is waiting for a slow client to catch up.
+        self.lstPending = []
+        self.intPending = 0
+        self.blnPaused = False
+        self.dcTimeout = reactor.callLater(20, self.fnTimeout)
+        if len(self.factory.lstClients) >= self.factory.intMaxClients:
+            self.sendLine("Too many clients are connected to MUDdrop.")
+            self.transport.loseConnection()
+            return
+        self.factory.lstClients.append(self)
+        # The transport tells us when its buffer is full, so we can hold
+        # the output back instead of piling it up there.
+        self.transport.registerProducer(self, True)
+        self.sendLine("You have connected to MUDdrop, you have 20 seconds to authenticate. Please enter\nthe character name:")
+    def fnSend(self, data):
+        """Write data to the client, holding it back while the client is
+           not reading."""
+        data = self.factory.mdBot.fnEncode(data)
+        if not self.blnPaused:
+            self.transport.write(data)
+            return
+        self.lstPending.append(data)
+        self.intPending += len(data)
+        if self.intPending > self.factory.intClientBuffer:
+            # The client has fallen too far behind, drop it rather than
+            # let its backlog grow without bound.
+            self.lstPending = []
+            self.intPending = 0
+            self.factory.mdBot.fnNoteData("Remote client %s is not reading its output, disconnecting it." % self.transport.getPeer().host, blnOmitRemote = True)
+            if hasattr(self.transport, "abortConnection"):
+                self.transport.abortConnection()
+            else:
+                self.transport.loseConnection()
+    def pauseProducing(self):
+        self.blnPaused = True
+    def resumeProducing(self):
+        self.blnPaused = False
+        if self.lstPending:
+            data = "".join(self.lstPending)
+            self.lstPending = []
+            self.intPending = 0
+            self.transport.write(data)
+    def stopProducing(self):
+        self.lstPending = []
+        self.intPending = 0
+    def fnTimeout(self):
+        if self.intState != 2:
+            self.transport.loseConnection()
+
+class MUDServer(ServerFactory):
+    def __init__(self, mdBot):
+        self.mdBot = mdBot
+        self.lstClients = []
+        self.intMaxClients = self.mdBot.cnfConfiguration.intMaxClients
+        self.intClientBuffer = self.mdBot.cnfConfiguration.intClientBuffer
+        # What is sent while the output filter holds it, to go after the
+        # line that caused it.
+        self.lstHeld = None
+        self.port = reactor.listenTCP(self.mdBot.cnfConfiguration.intLocalPort, self)
+    def buildProtocol(self, addr):
+        clClient = MUDServerProtocol()
+        clClient.factory = self
+        return clClient
+    def fnSend(self, line):
+        if self.lstHeld != None:
+            self.lstHeld.append(line)
+            return
+        for clClient in self.lstClients:
+            if clClient.intState == 2: # Authenticated.
+                clClient.fnSend(line)
+    def close(self):
+        self.port.stopListening()
+        for clClient in self.lstClients[:]:
+            clClient.transport.loseConnection()
+
+class MetricsPage(resource.Resource):
+    isLeaf = True
+    def __init__(self, mtMetrics):
+        resource.Resource.__init__(self)
+        self.mtMetrics = mtMetrics
+    def render_GET(self, request):
+        request.setHeader("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        return self.mtMetrics.fnRender()
+
+class Metrics:
+    """The counters of every session, and how late the reactor runs its
+       calls, in Prometheus' text format. They are served over HTTP on any
+       endpoint Twisted understands, such as "tcp:9100:interface=127.0.0.1"
+       or "unix:/var/run/muddrop.sock"."""
+    # Seconds between measurements of the reactor's lag.
+    LAG_INTERVAL = 1.0
+    # Name, type and help of the metrics of each session, which are labelled
+    # with the character's name.
+    SESSION_METRICS = (
+        ("muddrop_lines_received_total", "counter", "Lines received from the MUD."),
+        ("muddrop_lines_sent_total", "counter", "Lines sent to the MUD."),
+        ("muddrop_bytes_received_total", "counter", "Bytes received from the MUD, before decompression."),
+        ("muddrop_bytes_sent_total", "counter", "Bytes sent to the MUD."),
+        ("muddrop_trigger_fires_total", "counter", "Triggers that matched a line."),
+        ("muddrop_script_errors_total", "counter", "Exceptions raised by scripts and plugins."),
+        ("muddrop_commands_coalesced_total", "counter", "Commands dropped because the same command was already queued."),
+        ("muddrop_queue_depth", "gauge", "Commands waiting in the command queue."),
+        ("muddrop_queue_latency_seconds", "gauge", "How long the last command sent had waited in the queue."),
+        ("muddrop_connection_state", "gauge", "1 for the state the connection to the MUD is in."),
+        ("muddrop_connections_total", "counter", "Connections made to the MUD."),
+        ("muddrop_reconnect_attempts", "gauge", "Attempts to reconnect since the last connection."),
+        ("muddrop_connected_seconds", "gauge", "Seconds the current connection has been up."),
+        ("muddrop_remote_clients", "gauge", "Remote clients logged in."),
+    )
+
+    def __init__(self, smSessions, strEndpoint):
+        self.smSessions = smSessions
+        self.fltStarted = time.time()
+        self.fltLag = 0.0
+        self.fltMaxLag = 0.0
+        self.fltExpected = None
+        self.dcLag = None
+        self.fnMeasureLag()
+        epEndpoint = endpoints.serverFromString(reactor, strEndpoint)
+        deferred = epEndpoint.listen(server.Site(MetricsPage(self)))
+        deferred.addErrback(self.fnListenFailed, strEndpoint)
+
+    def fnListenFailed(self, flFailure, strEndpoint):
+        print "Could not serve the metrics on '%s': %s" % (strEndpoint, flFailure.getErrorMessage())
+
+    def fnMeasureLag(self):
+        """See how much later than asked for this call runs, and ask again."""
+        fltNow = time.time()
+        if self.fltExpected != None:
+            self.fltLag = max(0.0, fltNow - self.fltExpected)
+            if self.fltLag > self.fltMaxLag:
+                self.fltMaxLag = self.fltLag
+        self.fltExpected = fltNow + self.LAG_INTERVAL
+        self.dcLag = reactor.callLater(self.LAG_INTERVAL, self.fnMeasureLag)
+
+    def fnSessionSamples(self, mdBot):
+        """Return the name of each of SESSION_METRICS mapped to a list of
+           (extra labels, value) samples for a session."""
+        cqQueue = mdBot.cqQueue
+        intClients = 0
+        if mdBot.cntClientConnection:
+            for clClient in mdBot.cntClientConnection.lstClients:
+                if clClient.intState == 2: # Authenticated.
+                    intClients += 1
+        fltConnected = 0.0
+        if mdBot.fltConnected != None:
+            fltConnected = time.time() - mdBot.fltConnected
+        lstStates = []
+        for strState, intState in (("disconnected", AC_DISCONNECTED), ("connecting", AC_CONNECTING), ("connected", AC_CONNECTED)):
+            lstStates.append(('state="%s"' % strState, int(mdBot.stConnectionState == intState)))
+        return {
+            "muddrop_lines_received_total": [("", mdBot.intLinesIn)],
+            "muddrop_lines_sent_total": [("", mdBot.intLinesOut)],
+            "muddrop_bytes_received_total": [("", mdBot.intBytesIn)],
+            "muddrop_bytes_sent_total": [("", mdBot.intBytesOut)],
+            "muddrop_trigger_fires_total": [("", mdBot.intTriggerFires)],
+            "muddrop_script_errors_total": [("", mdBot.intErrors)],
+            "muddrop_commands_coalesced_total": [("", cqQueue.intCoalesced)],
+            "muddrop_queue_depth": [('lane="client"', len(cqQueue.lstLanes[CommandQueue.LANE_CLIENT])), ('lane="bot"', len(cqQueue.lstLanes[CommandQueue.LANE_BOT]))],
+            "muddrop_queue_latency_seconds": [("", cqQueue.fltLatency)],
+            "muddrop_connection_state": lstStates,
+            "muddrop_connections_total": [("", mdBot.intConnections)],
+            "muddrop_reconnect_attempts": [("", mdBot.intAttempts)],
+            "muddrop_connected_seconds": [("", fltConnected)],
+            "muddrop_remote_clients": [("", intClients)],
+        }
+
+    def fnEscape(self, strValue):
+        """Escape a label value."""
+        if isinstance(strValue, unicode):
+            strValue = strValue.encode("utf-8")
+        return strValue.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+    def fnFormat(self, objValue):
+        if isinstance(objValue, float):
+            return repr(objValue)
+        return str(objValue)
+
+    def fnRender(self):
+        """Return the metrics as text."""
+        lstLines = []
+        for strName, strType, strHelp, objValue in (
+                ("muddrop_start_time_seconds", "gauge", "When the process started, in seconds since the epoch.", self.fltStarted),
+                ("muddrop_sessions", "gauge", "Characters running.", len(self.smSessions.lstSessions)),
+                ("muddrop_reactor_lag_seconds", "gauge", "How late the reactor ran the last lag measurement.", self.fltLag),
+                ("muddrop_reactor_lag_max_seconds", "gauge", "The most the reactor has been late.", self.fltMaxLag)):
+            lstLines.append("# HELP %s %s" % (strName, strHelp))
+            lstLines.append("# TYPE %s %s" % (strName, strType))
+            lstLines.append("%s %s" % (strName, self.fnFormat(objValue)))
+        lstSessions = []
+        for mdBot in self.smSessions.lstSessions:
+            if mdBot.cqQueue != None:
+                lstSessions.append(('character="%s"' % self.fnEscape(mdBot.cnfConfiguration.strName), self.fnSessionSamples(mdBot)))
+        for strName, strType, strHelp in self.SESSION_METRICS:
+            lstLines.append("# HELP %s %s" % (strName, strHelp))
+            lstLines.append("# TYPE %s %s" % (strName, strType))
+            for strCharacter, dicSamples in lstSessions:
+                for strLabels, objValue in dicSamples[strName]:
+                    if strLabels:
+                        strLabels = strCharacter + "," + strLabels
+                    else:
+                        strLabels = strCharacter
+                    lstLines.append("%s{%s} %s" % (strName, strLabels, self.fnFormat(objValue)))
+        return "\n".join(lstLines) + "\n"
+
+def fnMain():
+    cmdParser = optparse.OptionParser(usage = "%prog [options] [SEGMENT...]")
+    cmdParser.set_defaults(password = "", cache = "cache")
+    cmdParser.add_option("-c", "--character", dest = "character", action = "append", help = "load the character configuration from FILE, or every .xml file in a directory (can be given more than once, default: character.xml)", metavar = "FILE")
+    cmdParser.add_option("--cache", dest = "cache", help = "keep parsed character and plugin files in DIRECTORY (default: %default)", metavar = "DIRECTORY")
+    cmdParser.add_option("--no-cache", dest = "cache", help = "don't cache parsed character and plugin files", action = "store_const", const = None)
+    cmdParser.add_option("--record", dest = "record", help = "record the raw traffic to FILE, which can contain the same macros as the log file", metavar = "FILE")
+    cmdParser.add_option("--replay", dest = "replay", help = "feed the traffic recorded in FILE through the character's triggers and aliases without connecting, and report how long they took", metavar = "FILE")
+    cmdParser.add_option("--search", dest = "search", help = "print the lines matching REGEX in the indexed log segments given as arguments", metavar = "REGEX")
+    cmdParser.add_option("--since", dest = "since", help = "only search lines from TIME on (YYYY-MM-DD [HH:MM[:SS]])", metavar = "TIME")
+    cmdParser.add_option("--until", dest = "until", help = "only search lines up to TIME (YYYY-MM-DD [HH:MM[:SS]])", metavar = "TIME")
+    cmdParser.add_option("--metrics", dest = "metrics", help = "serve the counters of every character in Prometheus' format on ENDPOINT, such as tcp:9100:interface=127.0.0.1 or unix:/var/run/muddrop.sock", metavar = "ENDPOINT")
+    cmdParser.add_option("-e", "--encode", dest = "password", help = "encode STRING in base64 and print it", metavar = "STRING")
+    cmdParser.add_option("-i", "--generateid", dest = "generateid", help = "generate a unique ID", action = "store_true")
+    (optOptions, lstArguments) = cmdParser.parse_args()
+    if optOptions.password:
+        print "The encoded string is \"%s\"" % base64.b64encode(optOptions.password)
+        return
+    if optOptions.generateid:
+        print "Your unique ID is:\n%s" % md5.new(str(time.time())).hexdigest()[0:24]
+        return
+    if optOptions.search != None:
+        lstRange = []
+        for strTime in (optOptions.since, optOptions.until):
+            fltTime = None
+            if strTime != None:
+                for strFormat in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+                    try:
+                        fltTime = time.mktime(time.strptime(strTime, strFormat))
+                        break
+                    except ValueError:
+                        pass
+                else:
+                    cmdParser.error("cannot understand the time '%s'" % strTime)
+            lstRange.append(fltTime)
+        try:
+            re.compile(optOptions.search)
+        except re.error:
+            cmdParser.error("cannot compile the regular expression '%s'" % optOptions.search)
+        lstSegments = []
+        for strArgument in lstArguments:
+            lstSegments.extend(glob.glob(strArgument))
+        lstSegments.sort()
+        for strSegment in lstSegments:
+            try:
+                lstRecords = fnSearchLog(strSegment, optOptions.search, lstRange[0], lstRange[1])
+            except (IOError, OSError, zlib.error):
+                print "Cannot search '%s': %s" % (strSegment, sys.exc_value)
+                continue
+            for fltTime, strDirection, strText in lstRecords:
+                print "%s %s %s" % (time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(fltTime)), strDirection, strText)
+        return
+    lstFilenames = []
+    for strPath in optOptions.character or ["character.xml"]:
+        if os.path.isdir(strPath):
+            lstDirectory = glob.glob(os.path.join(strPath, "*.xml"))
+            lstDirectory.sort()
+            lstFilenames.extend(lstDirectory)
+        else:
+            lstFilenames.append(strPath)
+    smSessions = SessionManager(optOptions.cache, optOptions.record)
+    if optOptions.replay:
+        for strFilename in lstFilenames:
+            mdBot = smSessions.fnStart(strFilename, False)
+            if mdBot == None:
+                continue
+            intLines, fltTime = mdBot.fnReplay(optOptions.replay)
+            print "%s: replayed %d lines in %.3f seconds (%d lines/sec), %d lines sent." % (strFilename, intLines, fltTime, intLines / max(fltTime, 0.000001), mdBot.cntConnection.intSent)
+            for strLine in mdBot.stStats.fnReport():
+                print strLine
+        return
+    if optOptions.metrics != None:
+        try:
+            Metrics(smSessions, optOptions.metrics)
+        except ValueError:
+            cmdParser.error("cannot understand the endpoint '%s'" % optOptions.metrics)
+    for strFilename in lstFilenames:
+        smSessions.fnStart(strFilename)
+    if not smSessions.lstSessions:
+        return
+    if hasattr(signal, "SIGHUP"):
+        # Reload the changed files on SIGHUP.
+        signal.signal(signal.SIGHUP, lambda intSignal, frFrame: reactor.callFromThread(smSessions.fnReload))
+
+    reactor.run()
+
+if __name__ == "__main__":
+    fnMain()
@@ -0,0 +1,1115 @@
+"""Behaviour tests for muddrop.py. Run them with "python -m unittest
+test_muddrop" from this directory."""
+import os
+import re
+import sys
+import time
+import random
+import zlib
+import shutil
+import tempfile
+import unittest
+import StringIO
+from xml.sax.saxutils import quoteattr
+
+from twisted.internet import defer, task
+from twisted.python import failure
+from twisted.test import proto_helpers
+
+import muddrop
+
+CHARACTER = """<mudbot host="localhost" port="4000" localport="0" id="f49a19004624f79e0c9cfd17" name="Sample" password="c2FtcGxl" notetoconsole="n" %s>
+<logging enabled="n" toscreen="n" logfile="log" onconnect="" onconnectfailed="" ondisconnect="" onremoteconnect="" onremotedisconnect=""/>
+<triggers>%s</triggers>
+<aliases></aliases>
+<timers>%s</timers>
+<plugins>%s</plugins>
+<script><![CDATA[%s]]></script>
+</mudbot>"""
+
+PLUGIN = """<muclient>
+<plugin name="%s" id="%s" language="Python" save_state="n"/>
+<triggers>%s</triggers>
+<aliases></aliases>
+<timers></timers>
+<script><![CDATA[pass]]></script>
+</muclient>"""
+
+class BotTestCase(unittest.TestCase):
+    """Run each test in a directory of its own, with a bot that is not
+       connected and whose sends are collected in lstSent."""
+    def setUp(self):
+        self.strCwd = os.getcwd()
+        self.strDirectory = tempfile.mkdtemp()
+        os.chdir(self.strDirectory)
+        self.lstBots = []
+
+    def tearDown(self):
+        for mdBot in self.lstBots:
+            mdBot.fnExit()
+        os.chdir(self.strCwd)
+        shutil.rmtree(self.strDirectory)
+
+    def fnWriteCharacter(self, strTriggers = "", strScript = "pass", strAttributes = "", strTimers = "", strPlugins = ""):
+        flCharacter = file("character.xml", "w")
+        flCharacter.write((CHARACTER % (strAttributes, strTriggers, strTimers, strPlugins, strScript)).encode("utf-8"))
+        flCharacter.close()
+
+    def fnMakeBot(self, strTriggers = "", strScript = "pass", strAttributes = "", strTimers = "", strPlugins = ""):
+        self.fnWriteCharacter(strTriggers, strScript, strAttributes, strTimers, strPlugins)
+        mdBot = muddrop.MUDdrop(muddrop.SessionManager(None), "character.xml", False)
+        self.lstBots.append(mdBot)
+        mdBot.lstSent = []
+        mdBot.fnSendData = lambda strLine, blnOmitFromLog = False: mdBot.lstSent.append(strLine)
+        return mdBot
+
+    def fnPlugin(self, mdBot):
+        return mdBot.cnfConfiguration.dicPlugins.values()[0]
+
+    def fnAddClients(self, mdBot, intClients):
+        """Log remote clients on string transports in to the bot, and return
+           their protocols."""
+        if mdBot.cntClientConnection == None:
+            mdBot.cntClientConnection = muddrop.MUDServer(mdBot)
+        lstClients = []
+        for intClient in range(intClients):
+            clClient = mdBot.cntClientConnection.buildProtocol(None)
+            clClient.makeConnection(proto_helpers.StringTransport())
+            clClient.dataReceived("%s\r\n%s\r\n" % (mdBot.cnfConfiguration.strName, mdBot.cnfConfiguration.strPassword))
+            clClient.transport.clear()
+            lstClients.append(clClient)
+        return lstClients
+
+def fnTrigger(strMatch, strSend = "", **dicAttributes):
+    """Return the XML of a trigger."""
+    dicAttributes.setdefault("enabled", "y")
+    dicAttributes.setdefault("regexp", "y")
+    dicAttributes.setdefault("keep_evaluating", "y")
+    strAttributes = " ".join(["%s=%s" % (strName, quoteattr(strValue)) for strName, strValue in dicAttributes.items()])
+    if strSend == "":
+        return "<trigger match=%s %s/>" % (quoteattr(strMatch), strAttributes)
+    return "<trigger match=%s %s><send>%s</send></trigger>" % (quoteattr(strMatch), strAttributes, strSend)
+
+def fnTimer(strSend, **dicAttributes):
+    """Return the XML of a timer."""
+    dicAttributes.setdefault("enabled", "y")
+    dicAttributes.setdefault("second", "1")
+    strAttributes = " ".join(["%s=%s" % (strName, quoteattr(strValue)) for strName, strValue in dicAttributes.items()])
+    return "<timer %s><send>%s</send></timer>" % (strAttributes, strSend)
+
+class TriggerIndexTest(BotTestCase):
+    PATTERNS = [
+        ("^You have (\\d+) gold", {}),
+        ("gold pieces\\.$", {}),
+        ("^(foo)?bar", {}),
+        ("foo|bar", {}),
+        ("(?:abc)+def", {}),
+        ("x*abc", {}),
+        ("ab?c", {}),
+        ("(?=tell)\\w+ tells you", {}),
+        ("(?!no)o tells", {}),
+        ("(\\w+) (says|tells) you", {}),
+        ("\\bhits\\b", {}),
+        ("(?m)^prompt>", {}),
+        ("\\Astart", {}),
+        ("HP: \\d+", {"ignore_case": "y"}),
+        ("(?i)mana", {}),
+        ("\\x1b\\[1;31mred", {"keep_ansi": "y"}),
+        ("red text", {"keep_ansi": "y"}),
+        ("You have * gold pieces.", {"regexp": "n"}),
+        ("*", {"regexp": "n"}),
+        (u"caf\xe9", {}),
+        ("[abc]def", {}),
+        ("a{2}bc", {}),
+        ("(a)\\1bc", {}),
+        ("", {}),
+    ]
+    LINES = [
+        "You have 1234 gold pieces.",
+        "you have 12 gold pieces.",
+        "foobar",
+        "bar",
+        "xbar",
+        "abcabcdef",
+        "ac abc",
+        "Bob tells you hello",
+        "Bob says you hello",
+        "no tells",
+        "it hits you",
+        "prompt> look",
+        "start here",
+        "hp: 100",
+        "HP: 20/30",
+        "MANA low",
+        "\x1b[1;31mred text\x1b[0m",
+        "\x1b[1mred\x1b[0m text",
+        u"caf\xe9 au lait",
+        "adef bdef",
+        "aabc",
+        "",
+    ]
+
+    def testNoMatchingTriggerIsSkipped(self):
+        strTriggers = "".join([fnTrigger(strMatch, **dicAttributes) for strMatch, dicAttributes in self.PATTERNS])
+        mdBot = self.fnMakeBot(strTriggers)
+        plgPlugin = self.fnPlugin(mdBot)
+        fmFormatting = muddrop.Formatting()
+        for strLine in self.LINES:
+            strStripped = fmFormatting.fnStripANSI(strLine)
+            lstCandidates = plgPlugin.tiTriggers.fnCandidates(strLine, strStripped)
+            for intPosition in range(len(plgPlugin.lstTriggers)):
+                ciTrigger = plgPlugin.lstTriggers[intPosition]
+                if ciTrigger.blnKeepANSI:
+                    strText = strLine
+                else:
+                    strText = strStripped
+                if ciTrigger.getregexp().search(strText):
+                    self.assertTrue(intPosition in lstCandidates, "%r is skipped for %r" % (ciTrigger.strMatch, strLine))
+
+    def testRandomLiterals(self):
+        rndRandom = random.Random(1)
+        lstPatterns = []
+        for intPattern in range(200):
+            strLiteral = "".join([rndRandom.choice("abcAB ") for intChar in range(rndRandom.randint(1, 4))])
+            strPattern = rndRandom.choice(["%s", "^%s", "%s$", "(%s)+x", "x?%s", "(?i)%s", "%s|zz"]) % re.escape(strLiteral)
+            lstPatterns.append(strPattern)
+        mdBot = self.fnMakeBot("".join([fnTrigger(strPattern) for strPattern in lstPatterns]))
+        plgPlugin = self.fnPlugin(mdBot)
+        for intLine in range(300):
+            strLine = "".join([rndRandom.choice("abcABxz ") for intChar in range(rndRandom.randint(0, 10))])
+            lstCandidates = plgPlugin.tiTriggers.fnCandidates(strLine, strLine)
+            for intPosition in range(len(plgPlugin.lstTriggers)):
+                if plgPlugin.lstTriggers[intPosition].getregexp().search(strLine):
+                    self.assertTrue(intPosition in lstCandidates, "%r is skipped for %r" % (plgPlugin.lstTriggers[intPosition].strMatch, strLine))
+
+    def testNonASCII(self):
+        # Escaped in byte string patterns, and as they are in unicode ones.
+        lstPatterns = ["caf\\xe9", "^\\xe9t\\xe9", "(?i)^\\xe9T\\xe9", u"na\xefve"]
+        mdBot = self.fnMakeBot("".join([fnTrigger(lstPatterns[intIndex], "send %d" % intIndex, sequence = str(intIndex + 1)) for intIndex in range(len(lstPatterns))]))
+        for strLine in (u"un caf\xe9", u"\xe9t\xe9 chaud", u"na\xefve", "plain"):
+            mdBot.fnProcessData(strLine)
+        self.assertEqual(mdBot.lstSent, ["send 0", "send 1", "send 2", "send 3"])
+
+    def testDisabledTriggersAreLeftOut(self):
+        mdBot = self.fnMakeBot(fnTrigger("gold", "take gold", enabled = "n") + fnTrigger("gold", "count gold"))
+        mdBot.fnProcessData("a gold coin")
+        self.assertEqual(mdBot.lstSent, ["count gold"])
+
+    def testTriggerEnabledOnTheSameLine(self):
+        strTriggers = fnTrigger("coin", "world.EnableTrigger('later', True)", send_to = "12", sequence = "1") + fnTrigger("coin", "take coin", name = "later", enabled = "n", sequence = "2")
+        mdBot = self.fnMakeBot(strTriggers)
+        mdBot.fnProcessData("a coin")
+        self.assertEqual(mdBot.lstSent, ["take coin"])
+
+class TimerSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.tsTimers = muddrop.TimerScheduler(lambda: None)
+
+    def tearDown(self):
+        self.tsTimers.fnStop()
+
+    def fnTimer(self, intSeconds, fltTime = 0.0):
+        tmrTimer = muddrop.Plugin.Timer()
+        tmrTimer.blnEnabled = True
+        tmrTimer.intHour = 0
+        tmrTimer.intMinute = 0
+        tmrTimer.intSecond = intSeconds
+        tmrTimer.fltTime = fltTime
+        return tmrTimer
+
+    def testDueInDeadlineOrder(self):
+        lstTimers = [self.fnTimer(intSeconds) for intSeconds in (3, 1, 2, 1)]
+        for tmrTimer in lstTimers:
+            self.tsTimers.fnSchedule(None, tmrTimer)
+        self.assertEqual(self.tsTimers.fnPopDue(0.5), [])
+        lstDue = [tmrTimer for plgPlugin, tmrTimer in self.tsTimers.fnPopDue(2)]
+        # Equal deadlines keep the order they were scheduled in.
+        self.assertEqual([tmrTimer is lstTimers[intIndex] for tmrTimer, intIndex in zip(lstDue, (1, 3, 2))], [True] * 3)
+        self.assertEqual(len(lstDue), 3)
+        self.assertEqual(self.tsTimers.fnDeadline(lstTimers[0]), 3)
+        self.assertEqual(self.tsTimers.fnDeadline(lstTimers[1]), None)
+
+    def testRescheduleAndDisable(self):
+        tmrMoved = self.fnTimer(1)
+        tmrDisabled = self.fnTimer(1)
+        self.tsTimers.fnSchedule(None, tmrMoved)
+        self.tsTimers.fnSchedule(None, tmrDisabled)
+        tmrMoved.fltTime = 10
+        self.tsTimers.fnSchedule(None, tmrMoved)
+        tmrDisabled.blnEnabled = False
+        self.tsTimers.fnSchedule(None, tmrDisabled)
+        self.assertEqual(self.tsTimers.fnPopDue(5), [])
+        self.assertEqual(self.tsTimers.fnPopDue(11), [(None, tmrMoved)])
+
+    def testParkAndResume(self):
+        tmrTimer = self.fnTimer(1)
+        tmrDisabled = self.fnTimer(1)
+        self.tsTimers.fnPark(None, tmrTimer)
+        self.tsTimers.fnPark(None, tmrDisabled)
+        tmrDisabled.blnEnabled = False
+        self.assertTrue(self.tsTimers.fnDeadline(tmrTimer) != None)
+        self.tsTimers.fnResume()
+        self.assertEqual(self.tsTimers.fnPopDue(time.time() + 1), [(None, tmrTimer)])
+
+class DoAfterTest(BotTestCase):
+    def testManyOneShots(self):
+        mdBot = self.fnMakeBot()
+        mdBot.cntConnection = True
+        plgPlugin = self.fnPlugin(mdBot)
+        lstSeconds = range(1, 2001)
+        random.Random(1).shuffle(lstSeconds)
+        for intSeconds in lstSeconds:
+            plgPlugin.cbWorld.DoAfter(intSeconds, "say %d" % intSeconds)
+        fnTime = time.time
+        fltBase = fnTime()
+        lstNow = [fltBase]
+        muddrop.time.time = lambda: lstNow[0]
+        try:
+            fltStart = fnTime()
+            for intSecond in range(1, 2001):
+                lstNow[0] = fltBase + intSecond + 0.5
+                mdBot.fnHandleTimers()
+            fltTaken = fnTime() - fltStart
+        finally:
+            muddrop.time.time = fnTime
+        mdBot.cntConnection = None
+        self.assertEqual(mdBot.lstSent, ["say %d" % intSecond for intSecond in range(1, 2001)])
+        self.assertEqual(plgPlugin.dicTemporaryTimers, {})
+        self.assertEqual(plgPlugin.itTimers.fnGetGroup(""), [])
+        self.assertTrue(fltTaken < 5, "firing took %.1f seconds" % fltTaken)
+
+class TimerShutdownTest(BotTestCase):
+    def fnRunTimers(self, strFirst):
+        """Run two timers that are due at once, the first of which sends
+           strFirst to the script engine."""
+        mdBot = self.fnMakeBot(strTimers = fnTimer(strFirst, name = "first", send_to = "12") + fnTimer("say second", name = "second"))
+        mdBot.cntConnection = muddrop.ReplayConnection()
+        fnTime = time.time
+        fltNow = fnTime() + 2
+        muddrop.time.time = lambda: fltNow
+        try:
+            mdBot.fnHandleTimers()
+        finally:
+            muddrop.time.time = fnTime
+        return mdBot
+
+    def testExit(self):
+        mdBot = self.fnRunTimers("world.Exit()")
+        self.assertTrue(mdBot.blnExited)
+        self.assertEqual(mdBot.lstSent, [])
+        self.assertEqual(mdBot.tsTimers.lstHeap, [])
+        self.assertEqual(mdBot.tsTimers.dcCall, None)
+
+    def testDisconnect(self):
+        mdBot = self.fnRunTimers("world.Disconnect()")
+        self.assertFalse(mdBot.blnExited)
+        self.assertEqual(mdBot.lstSent, [])
+        # The second timer waits for the next connection.
+        tmrSecond = self.fnPlugin(mdBot).itTimers.fnGetName("second")
+        self.assertEqual(mdBot.tsTimers.lstParked, [(self.fnPlugin(mdBot), tmrSecond)])
+
+class LineFramerTest(unittest.TestCase):
+    def testSplitCharacter(self):
+        lfFramer = muddrop.LineFramer(0, "utf-8")
+        self.assertEqual(lfFramer.fnFeed("caf\xc3"), [])
+        self.assertEqual(lfFramer.fnPartial(), u"caf")
+        self.assertEqual(lfFramer.fnFeed("\xa9\r\nna\xc3\xaf"), [u"caf\xe9"])
+        self.assertEqual(lfFramer.fnFeed("ve\r\n\xff\r\n"), [u"na\xefve", u"\ufffd"])
+
+    def testLineEnds(self):
+        lfFramer = muddrop.LineFramer()
+        self.assertEqual(lfFramer.fnFeed("a\r\nb\nc\r"), ["a", "b"])
+        self.assertEqual(lfFramer.fnFeed("\nd\n\n"), ["c", "d", ""])
+        self.assertEqual(lfFramer.fnFeed("x\ry"), [])
+        self.assertEqual(lfFramer.intPartial, 2)
+        self.assertEqual(lfFramer.fnFeed("z\n"), ["xyz"])
+        self.assertEqual(lfFramer.intPartial, 0)
+
+    def testMaxLength(self):
+        lfFramer = muddrop.LineFramer(5)
+        self.assertEqual(lfFramer.fnFeed("abc"), [])
+        # An unfinished line is cut into pieces of the maximum length.
+        self.assertEqual(lfFramer.fnFeed("defghijkl"), ["abcde", "fghij"])
+        self.assertEqual(lfFramer.fnPartial(), "kl")
+        self.assertEqual(lfFramer.fnFeed("m\n0123456789\n"), ["klm", "0123456789"])
+        self.assertEqual(lfFramer.fnPartial(), "")
+
+class TelnetParserTest(unittest.TestCase):
+    def setUp(self):
+        self.lstWritten = []
+        self.lstNotes = []
+        # Only fnNoteData is used on the bot.
+        self.mdBot = self
+        self.tpTelnet = muddrop.TelnetParser(self, self.lstWritten.append)
+
+    def fnNoteData(self, strNote):
+        self.lstNotes.append(strNote)
+
+    def testCommandsAreRemoved(self):
+        strData = "a" + muddrop.IAC + muddrop.IAC + "b" + muddrop.IAC + "\xf9c" + muddrop.IAC + muddrop.SB + "\x18\x00x" + muddrop.IAC + muddrop.IAC + muddrop.IAC + muddrop.SE + "d"
+        self.assertEqual(self.tpTelnet.fnFeed(strData), "a\xffbcd")
+        # The same, a byte at a time.
+        self.assertEqual("".join([self.tpTelnet.fnFeed(strChar) for strChar in strData]), "a\xffbcd")
+
+    def testNegotiation(self):
+        strUnknown = "\x18"
+        lstExchanges = [
+            (muddrop.WILL, muddrop.TELOPT_ECHO, [muddrop.IAC + muddrop.DO + muddrop.TELOPT_ECHO]),
+            (muddrop.WILL, muddrop.TELOPT_ECHO, []),
+            (muddrop.WILL, strUnknown, [muddrop.IAC + muddrop.DONT + strUnknown]),
+            (muddrop.WILL, strUnknown, []),
+            (muddrop.WONT, strUnknown, []),
+            (muddrop.DO, strUnknown, [muddrop.IAC + muddrop.WONT + strUnknown]),
+            (muddrop.DO, strUnknown, []),
+            (muddrop.DONT, strUnknown, []),
+            (muddrop.WONT, muddrop.TELOPT_ECHO, [muddrop.IAC + muddrop.DONT + muddrop.TELOPT_ECHO]),
+            (muddrop.WONT, muddrop.TELOPT_ECHO, []),
+            (muddrop.WILL, muddrop.TELOPT_ECHO, [muddrop.IAC + muddrop.DO + muddrop.TELOPT_ECHO]),
+        ]
+        for strCommand, strOption, lstReply in lstExchanges:
+            del self.lstWritten[:]
+            self.assertEqual(self.tpTelnet.fnFeed(muddrop.IAC + strCommand + strOption), "")
+            self.assertEqual(self.lstWritten, lstReply, repr(strCommand + strOption))
+
+    def testMCCPDisabled(self):
+        tpTelnet = muddrop.TelnetParser(self, self.lstWritten.append, False)
+        tpTelnet.fnFeed(muddrop.IAC + muddrop.WILL + muddrop.TELOPT_COMPRESS2)
+        self.assertEqual(self.lstWritten, [muddrop.IAC + muddrop.DONT + muddrop.TELOPT_COMPRESS2])
+
+    def fnCompressed(self):
+        zlCompressor = zlib.compressobj()
+        strCompressed = zlCompressor.compress("hello\r\n" + muddrop.IAC + muddrop.IAC + "world\r\n") + zlCompressor.flush()
+        return "before\r\n" + muddrop.IAC + muddrop.WILL + muddrop.TELOPT_COMPRESS2 + muddrop.IAC + muddrop.SB + muddrop.TELOPT_COMPRESS2 + muddrop.IAC + muddrop.SE + strCompressed + "after\r\n"
+
+    def testMCCP(self):
+        self.assertEqual(self.tpTelnet.fnFeed(self.fnCompressed()), "before\r\nhello\r\n\xffworld\r\nafter\r\n")
+        self.assertEqual(self.lstWritten, [muddrop.IAC + muddrop.DO + muddrop.TELOPT_COMPRESS2])
+
+    def testMCCPByteByByte(self):
+        strData = self.fnCompressed()
+        self.assertEqual("".join([self.tpTelnet.fnFeed(strChar) for strChar in strData]), "before\r\nhello\r\n\xffworld\r\nafter\r\n")
+        self.assertEqual(self.lstNotes, [])
+
+    def testMCCPCorrupt(self):
+        strData = muddrop.IAC + muddrop.WILL + muddrop.TELOPT_COMPRESS2 + muddrop.IAC + muddrop.SB + muddrop.TELOPT_COMPRESS2 + muddrop.IAC + muddrop.SE
+        self.assertEqual(self.tpTelnet.fnFeed(strData + "not zlib"), "")
+        self.assertEqual(len(self.lstNotes), 1)
+
+class SendTemplateTest(unittest.TestCase):
+    def fnExpand(self, strPattern, strTemplate, strLine, dicVariables = {}, blnExpandVariables = True):
+        rePattern = re.compile(strPattern)
+        stTemplate = muddrop.SendTemplate(strTemplate, rePattern, blnExpandVariables)
+        return stTemplate.fnExpand(rePattern.search(strLine), dicVariables)
+
+    def testGroupsLikeExpand(self):
+        fmFormatting = muddrop.Formatting()
+        strPattern = "^(?P<who>\\w+) gives you (\\d+) (gold|silver)?"
+        strLine = "Bob gives you 12 gold"
+        reResult = re.search(strPattern, strLine)
+        for strTemplate in ["%1", "%2 %3", "get %2 %<who>", "say \\\\ %1\\n", "%0", "no groups"]:
+            strConverted = fmFormatting.fnConvertWildcards(strTemplate)
+            self.assertEqual(self.fnExpand(strPattern, strConverted, strLine), reResult.expand(strConverted))
+
+    def testUnmatchedGroupIsEmpty(self):
+        self.assertEqual(self.fnExpand("(a)?(b)", "[\\1\\2]", "b"), "[b]")
+
+    def testVariables(self):
+        dicVariables = {"target": u"Jos\xe9", "count": 5}
+        self.assertEqual(self.fnExpand("kill", "kill @target", "kill", dicVariables), u"kill Jos\xe9")
+        self.assertEqual(self.fnExpand("x", "@count coins", "x", dicVariables), "5 coins")
+        self.assertEqual(self.fnExpand("x", "[@missing]", "x", dicVariables), "[]")
+        self.assertEqual(self.fnExpand("x", "@target", "x", dicVariables, False), "@target")
+
+    def testTrailingBackslash(self):
+        dicVariables = {"target": "Bob"}
+        self.assertEqual(self.fnExpand("x", "say \\@target", "x", dicVariables), "say \\Bob")
+        self.assertEqual(self.fnExpand("x", "say \\\\@target", "x", dicVariables), "say \\Bob")
+        self.assertEqual(self.fnExpand("x", "say \\\\\\@target", "x", dicVariables), "say \\\\Bob")
+        self.assertEqual(self.fnExpand("(x)", "\\1\\", "x"), "x\\")
+
+    def testStatic(self):
+        stTemplate = muddrop.SendTemplate("north\\nsouth", re.compile("x"), True)
+        self.assertTrue(stTemplate.blnStatic)
+        self.assertEqual(stTemplate.fnExpand(None, {}), "north\nsouth")
+
+class RemoteClientTest(BotTestCase):
+    def setUp(self):
+        BotTestCase.setUp(self)
+        self.mdBot = self.fnMakeBot()
+        self.clFast, self.clSlow = self.fnAddClients(self.mdBot, 2)
+        self.msServer = self.mdBot.cntClientConnection
+
+    def testFanOut(self):
+        # A client that has not logged in gets nothing.
+        clAnonymous = self.msServer.buildProtocol(None)
+        clAnonymous.makeConnection(proto_helpers.StringTransport())
+        clAnonymous.transport.clear()
+        self.msServer.fnSend("You see a coin.\n")
+        self.assertEqual(self.clFast.transport.value(), "You see a coin.\n")
+        self.assertEqual(self.clSlow.transport.value(), "You see a coin.\n")
+        self.assertEqual(clAnonymous.transport.value(), "")
+
+    def testSlowClient(self):
+        self.clSlow.pauseProducing()
+        self.msServer.fnSend("one\n")
+        self.msServer.fnSend("two\n")
+        # The paused client's output is held back without holding up the
+        # other one.
+        self.assertEqual(self.clFast.transport.value(), "one\ntwo\n")
+        self.assertEqual(self.clSlow.transport.value(), "")
+        self.assertEqual(self.clSlow.lstPending, ["one\n", "two\n"])
+        self.clSlow.resumeProducing()
+        self.assertEqual(self.clSlow.transport.value(), "one\ntwo\n")
+        self.assertEqual(self.clSlow.lstPending, [])
+
+    def testBufferOverflow(self):
+        self.msServer.intClientBuffer = 10
+        self.clSlow.pauseProducing()
+        self.msServer.fnSend("0123456789\n")
+        # The client that fell too far behind is dropped, with its backlog.
+        self.assertTrue(self.clSlow.transport.disconnecting)
+        self.assertEqual(self.clSlow.lstPending, [])
+        self.assertEqual(self.clSlow.intPending, 0)
+        self.assertFalse(self.clFast.transport.disconnecting)
+        self.assertEqual(self.clFast.transport.value(), "0123456789\n")
+
+class UnicodeVariableTest(BotTestCase):
+    def testGroupStoredAndExpanded(self):
+        strTriggers = fnTrigger("^(\\S+) arrives", script = "OnArrive") + fnTrigger("^hit", "kill @target", expand_variables = "y")
+        mdBot = self.fnMakeBot(strTriggers, "def OnArrive(name, line, groups):\n    world.SetVariable('target', groups[0])\n")
+        mdBot.fnProcessData(u"Jos\xe9 arrives")
+        mdBot.fnProcessData(u"hit")
+        self.assertEqual(mdBot.lstSent[-1], u"kill Jos\xe9")
+        self.assertEqual(mdBot.fnEncode(mdBot.lstSent[-1]), "kill Jos\xe9")
+
+class ItemIndexTest(BotTestCase):
+    def testEnableGroup(self):
+        strTriggers = fnTrigger("coin", "take coin", name = "take", group = "loot", sequence = "1") + fnTrigger("coin", "count coin", group = "loot", sequence = "2") + fnTrigger("coin", "look", sequence = "3")
+        mdBot = self.fnMakeBot(strTriggers)
+        cbWorld = self.fnPlugin(mdBot).cbWorld
+        cbWorld.EnableGroup("loot", False)
+        mdBot.fnProcessData("a coin")
+        cbWorld.EnableTrigger("take", True)
+        mdBot.fnProcessData("a coin")
+        self.assertEqual(mdBot.lstSent, ["look", "take coin", "look"])
+
+    def testRemoveEqualItems(self):
+        itIndex = muddrop.ItemIndex()
+        lstTriggers = []
+        for strName in ("first", "second"):
+            ciTrigger = muddrop.Plugin.Trigger()
+            ciTrigger.strName = strName
+            ciTrigger.strGroup = "loot"
+            # The two compare as equal.
+            ciTrigger.intSequence = 100
+            itIndex.fnAdd(ciTrigger)
+            lstTriggers.append(ciTrigger)
+        itIndex.fnRemove(lstTriggers[1])
+        self.assertTrue(itIndex.fnGetName("second") is None)
+        self.assertTrue(itIndex.fnGetName("first") is lstTriggers[0])
+        lstGroup = list(itIndex.fnGetGroup("loot"))
+        self.assertEqual(len(lstGroup), 1)
+        self.assertTrue(lstGroup[0] is lstTriggers[0])
+        itIndex.fnRemove(lstTriggers[0])
+        self.assertEqual(len(itIndex.fnGetGroup("loot")), 0)
+
+class StateStoreTest(BotTestCase):
+    def fnLoad(self, intCompact = 1000):
+        dicVariables = {}
+        ssState = muddrop.StateStore("state.xml", dicVariables, blnJournal = True, intCompact = intCompact)
+        if os.path.exists("state.xml"):
+            xmlState = muddrop.ET.parse("state.xml").getroot()
+            for xmlVariable in xmlState.find("variables"):
+                dicVariables[xmlVariable.attrib["name"]] = xmlVariable.text or ""
+            ssState.fnLoaded(xmlState)
+        ssState.fnReplay()
+        return dicVariables, ssState
+
+    def fnSet(self, ssState, strName, objValue = None):
+        if objValue == None:
+            del ssState.dicVariables[strName]
+        else:
+            ssState.dicVariables[strName] = objValue
+        ssState.fnChanged(strName)
+
+    def testJournalReplay(self):
+        dicVariables, ssState = self.fnLoad()
+        self.fnSet(ssState, "gold", "12")
+        self.fnSet(ssState, "target", u"Jos\xe9")
+        self.fnSet(ssState, "gone", "x")
+        ssState.fnFlush()
+        self.fnSet(ssState, "gone")
+        ssState.fnFlush()
+        self.assertFalse(os.path.exists("state.xml"))
+        self.assertEqual(self.fnLoad()[0], {"gold": "12", "target": u"Jos\xe9"})
+
+    def testNonASCIIName(self):
+        dicVariables, ssState = self.fnLoad()
+        self.fnSet(ssState, u"caf\xe9", "1")
+        self.fnSet(ssState, "gold", "12")
+        ssState.fnFlush()
+        dicVariables, ssState = self.fnLoad()
+        self.assertEqual(dicVariables, {u"caf\xe9": "1", "gold": "12"})
+        self.fnSet(ssState, u"caf\xe9")
+        ssState.fnFlush()
+        dicVariables, ssState = self.fnLoad(intCompact = 1)
+        self.assertEqual(dicVariables, {"gold": "12"})
+        # And through the state file.
+        self.fnSet(ssState, u"na\xefve", "2")
+        ssState.fnFlush()
+        self.assertFalse(os.path.exists(ssState.strJournal))
+        self.assertEqual(self.fnLoad()[0], {u"na\xefve": "2", "gold": "12"})
+
+    def testCutShortEntryIsIgnored(self):
+        dicVariables, ssState = self.fnLoad()
+        self.fnSet(ssState, "gold", "12")
+        ssState.fnFlush()
+        flJournal = file(ssState.strJournal, "a")
+        flJournal.write("0 Z29sZA== MTM=")
+        flJournal.close()
+        self.assertEqual(self.fnLoad()[0], {"gold": "12"})
+
+    def testCompaction(self):
+        dicVariables, ssState = self.fnLoad(intCompact = 2)
+        self.fnSet(ssState, "a", "1")
+        ssState.fnFlush()
+        self.fnSet(ssState, "b", u"caf\xe9")
+        self.fnSet(ssState, "c", "3")
+        ssState.fnFlush()
+        self.assertTrue(os.path.exists("state.xml"))
+        self.assertFalse(os.path.exists(ssState.strJournal))
+        # An entry from before the state file was written is stale.
+        flJournal = file(ssState.strJournal, "a")
+        flJournal.write("0 YQ== OTk=\n")
+        flJournal.close()
+        dicVariables, ssState = self.fnLoad()
+        self.assertEqual(dicVariables, {"a": "1", "b": u"caf\xe9", "c": "3"})
+        self.assertEqual(ssState.intGeneration, 1)
+
+class ConfigCacheTest(BotTestCase):
+    def testKey(self):
+        ccCache = muddrop.ConfigCache("cache")
+        flFile = file("plugin.xml", "w")
+        flFile.write("<muclient/>")
+        flFile.close()
+        fltMTime = os.path.getmtime("plugin.xml")
+        tplKey = ccCache.fnKey("plugin.xml")
+        ccCache.fnStore(tplKey, {"value": 1})
+        self.assertEqual(ccCache.fnLoad(tplKey), {"value": 1})
+        # The same modification time with different contents is a miss.
+        flFile = file("plugin.xml", "w")
+        flFile.write("<muclient>x</muclient>")
+        flFile.close()
+        os.utime("plugin.xml", (fltMTime, fltMTime))
+        tplChanged = ccCache.fnKey("plugin.xml")
+        self.assertNotEqual(tplChanged, tplKey)
+        self.assertEqual(ccCache.fnLoad(tplChanged), None)
+        self.assertEqual(ccCache.fnKey("missing.xml"), None)
+
+    def testDisabled(self):
+        flFile = file("plugin.xml", "w")
+        flFile.write("<muclient/>")
+        flFile.close()
+        ccCache = muddrop.ConfigCache(None)
+        tplKey = ccCache.fnKey("plugin.xml")
+        ccCache.fnStore(tplKey, {"value": 1})
+        self.assertEqual(ccCache.fnLoad(tplKey), None)
+        self.assertFalse(os.path.exists("cache"))
+
+    def testPassword(self):
+        self.fnMakeBot()
+        smSessions = muddrop.SessionManager("cache")
+        mdBot = muddrop.MUDdrop(smSessions, "character.xml", False)
+        self.lstBots.append(mdBot)
+        lstFiles = os.listdir("cache")
+        self.assertEqual(len(lstFiles), 1)
+        strCache = os.path.join("cache", lstFiles[0])
+        if os.name == "posix":
+            self.assertEqual(os.stat(strCache).st_mode & 0777, 0600)
+        flCache = file(strCache, "rb")
+        strData = flCache.read()
+        flCache.close()
+        self.assertFalse("sample" in strData)
+        # The cached configuration still has the password.
+        cnfConfiguration = muddrop.Configuration(mdBot, "character.xml")
+        self.assertEqual(cnfConfiguration.strPassword, "sample")
+
+class ReloadTest(BotTestCase):
+    def fnWritePlugin(self, strFilename, strName, strID, strTriggers = ""):
+        flPlugin = file(strFilename, "w")
+        flPlugin.write(PLUGIN % (strName, strID, strTriggers))
+        flPlugin.close()
+
+    def testReloadChangedFiles(self):
+        self.fnWritePlugin("kept.xml", "Kept", "0123456789abcdef01234567")
+        self.fnWritePlugin("changed.xml", "Changed", "89abcdef0123456789abcdef")
+        strTimers = fnTimer("look", name = "tick", second = "30", active_closed = "y")
+        strPlugins = '<plugin name="kept.xml"/><plugin name="changed.xml"/>'
+        mdBot = self.fnMakeBot(strTimers = strTimers, strPlugins = strPlugins)
+        dicOld = mdBot.cnfConfiguration.dicPlugins.copy()
+        plgNamespace = dicOld["000000000000000000000000"]
+        plgNamespace.cbWorld.SetVariable("gold", "12")
+        dicOld["89abcdef0123456789abcdef"].cbWorld.SetVariable("target", "rat")
+        fltDeadline = mdBot.tsTimers.fnDeadline(plgNamespace.itTimers.fnGetName("tick"))
+        self.assertNotEqual(fltDeadline, None)
+
+        self.fnWritePlugin("changed.xml", "Changed", "89abcdef0123456789abcdef", fnTrigger("rat", "kill rat"))
+        self.fnWriteCharacter(fnTrigger("gold", "take gold"), strTimers = strTimers, strPlugins = strPlugins)
+        mdBot.fnDoReload(())
+        dicNew = mdBot.cnfConfiguration.dicPlugins
+        self.assertEqual(sorted(dicNew.keys()), sorted(dicOld.keys()))
+        # The plugin whose file is the same is not loaded again.
+        self.assertTrue(dicNew["0123456789abcdef01234567"] is dicOld["0123456789abcdef01234567"])
+        self.assertTrue(dicNew["89abcdef0123456789abcdef"] is not dicOld["89abcdef0123456789abcdef"])
+        self.assertTrue(dicNew["000000000000000000000000"] is not plgNamespace)
+        # The variables and the timer's deadline carry over.
+        self.assertEqual(dicNew["000000000000000000000000"].cbWorld.GetVariable("gold"), "12")
+        self.assertEqual(dicNew["89abcdef0123456789abcdef"].cbWorld.GetVariable("target"), "rat")
+        tmrTimer = dicNew["000000000000000000000000"].itTimers.fnGetName("tick")
+        self.assertAlmostEqual(mdBot.tsTimers.fnDeadline(tmrTimer), fltDeadline, 3)
+        self.assertEqual(mdBot.tsTimers.fnDeadline(plgNamespace.itTimers.fnGetName("tick")), None)
+        mdBot.fnProcessData("a rat with gold")
+        self.assertEqual(mdBot.lstSent, ["take gold", "kill rat"])
+
+class ReplayTest(BotTestCase):
+    def setUp(self):
+        BotTestCase.setUp(self)
+        srRecorder = muddrop.SessionRecorder("session.rec")
+        # A line split across two reads, a command sent by the bot and a
+        # line typed by a client, which has no alias and goes out as it is.
+        srRecorder.fnRecord(muddrop.SessionRecorder.REC_IN, "You see a gold ")
+        srRecorder.fnRecord(muddrop.SessionRecorder.REC_IN, "coin.\r\nA rat arrives.\r\n")
+        srRecorder.fnRecord(muddrop.SessionRecorder.REC_OUT, "take coin\n")
+        srRecorder.fnRecord(muddrop.SessionRecorder.REC_CLIENT, "look")
+        srRecorder.fnRecord(muddrop.SessionRecorder.REC_IN, "You see a gold coin.\r\n")
+        srRecorder.fnClose()
+
+    def testRecordAndRead(self):
+        srRecorder = muddrop.SessionRecorder("session.rec", "rb")
+        lstRecords = srRecorder.fnRead()
+        srRecorder.fnClose()
+        self.assertEqual([(strDirection, strData) for strDirection, fltTime, strData in lstRecords][3:], [(muddrop.SessionRecorder.REC_CLIENT, "look"), (muddrop.SessionRecorder.REC_IN, "You see a gold coin.\r\n")])
+        # A record that was cut short is left out.
+        flFile = file("session.rec", "ab")
+        flFile.write(muddrop.struct.pack(muddrop.SessionRecorder.HEADER, muddrop.SessionRecorder.REC_IN, 0, 10) + "short")
+        flFile.close()
+        srRecorder = muddrop.SessionRecorder("session.rec", "rb")
+        self.assertEqual(len(srRecorder.fnRead()), 5)
+        srRecorder.fnClose()
+
+    def testReplay(self):
+        mdBot = self.fnMakeBot(fnTrigger("gold coin", "take coin"))
+        # Send through the replay connection rather than into lstSent.
+        del mdBot.fnSendData
+        intLines, fltTime = mdBot.fnReplay("session.rec")
+        self.assertEqual(intLines, 3)
+        self.assertEqual(mdBot.cntConnection.intSent, 3)
+
+    def testReplayOption(self):
+        self.fnMakeBot(fnTrigger("gold coin", "take coin"))
+        lstArguments = sys.argv
+        flStdout = sys.stdout
+        sys.argv = ["muddrop.py", "-c", "character.xml", "--replay", "session.rec"]
+        sys.stdout = StringIO.StringIO()
+        try:
+            muddrop.fnMain()
+            strOutput = sys.stdout.getvalue()
+        finally:
+            sys.argv = lstArguments
+            sys.stdout = flStdout
+        self.assertTrue(re.match("character.xml: replayed 3 lines in .*, 3 lines sent\\.\n", strOutput), strOutput)
+
+class StatsTest(BotTestCase):
+    def fnPluginCalls(self, mdBot, plgPlugin):
+        return [tplStat[3] for tplStat in mdBot.stStats.fnGetStats() if tplStat[0] == "plugin" and tplStat[1] == plgPlugin.strName]
+
+    def testMissingCallback(self):
+        mdBot = self.fnMakeBot(strScript = "def OnHello():\n    pass")
+        plgPlugin = self.fnPlugin(mdBot)
+        plgPlugin.run("OnMissing", (), True)
+        self.assertEqual(self.fnPluginCalls(mdBot, plgPlugin), [])
+        plgPlugin.run("OnHello", ())
+        plgPlugin.run("OnHello", ())
+        self.assertEqual(self.fnPluginCalls(mdBot, plgPlugin), [2])
+
+    def testReloadDropsCounters(self):
+        mdBot = self.fnMakeBot(fnTrigger("gold", "take gold"), "def OnHello():\n    pass")
+        plgOld = self.fnPlugin(mdBot)
+        plgOld.run("OnHello", ())
+        mdBot.fnProcessData("gold")
+        self.assertEqual(len([lstCounter for lstCounter in mdBot.stStats.dicCounters.values() if lstCounter[1] is plgOld]), 2)
+        self.fnWriteCharacter(fnTrigger("silver", "take silver"), "def OnHello():\n    pass")
+        mdBot.fnDoReload(())
+        self.assertTrue(self.fnPlugin(mdBot) is not plgOld)
+        self.assertEqual([lstCounter for lstCounter in mdBot.stStats.dicCounters.values() if lstCounter[1] is plgOld], [])
+
+class CommandQueueTest(BotTestCase):
+    def setUp(self):
+        BotTestCase.setUp(self)
+        self.mdBot = self.fnMakeBot(strAttributes = 'sendrate="1" sendburst="2" coalesce="y"')
+        self.lstWritten = []
+        self.cqQueue = muddrop.CommandQueue(self.mdBot, lambda strLine, blnOmitFromLog: self.lstWritten.append(strLine))
+
+    def tearDown(self):
+        self.cqQueue.fnClear()
+        BotTestCase.tearDown(self)
+
+    def testClientLaneGoesFirst(self):
+        for strLine in ("b1", "b2", "b3", "b4"):
+            self.cqQueue.fnPut(strLine, False, muddrop.CommandQueue.LANE_BOT)
+        self.cqQueue.fnPut("c1", False, muddrop.CommandQueue.LANE_CLIENT)
+        self.assertEqual(self.lstWritten, ["b1", "b2"])
+        self.assertEqual(self.cqQueue.fnGetCommands(), ["c1", "b3", "b4"])
+        # Let the bucket fill up again.
+        self.cqQueue.dcCall.cancel()
+        self.cqQueue.fltUpdated -= 10
+        self.cqQueue.fnRun()
+        self.assertEqual(self.lstWritten, ["b1", "b2", "c1", "b3"])
+
+    def testCoalesce(self):
+        for strLine in ("b1", "b2", "look", "look", "look"):
+            self.cqQueue.fnPut(strLine, False, muddrop.CommandQueue.LANE_BOT)
+        self.cqQueue.fnPut("look", False, muddrop.CommandQueue.LANE_CLIENT)
+        self.assertEqual(self.cqQueue.fnGetCommands(), ["look", "look"])
+        self.assertEqual(self.cqQueue.intCoalesced, 2)
+        self.assertEqual(self.cqQueue.fnClear(), 2)
+        self.assertEqual(self.cqQueue.fnDepth(), 0)
+
+    def testNoRate(self):
+        self.mdBot.cnfConfiguration.fltSendRate = 0
+        for intLine in range(20):
+            self.cqQueue.fnPut("x", False, muddrop.CommandQueue.LANE_BOT)
+        self.assertEqual(len(self.lstWritten), 20)
+
+class AsyncRunTest(BotTestCase):
+    SCRIPT = """from twisted.internet import defer
+dfWait = defer.Deferred()
+lstDone = []
+def OnWait():
+    strValue = yield dfWait
+    lstDone.append(strValue)
+    raise ValueError(strValue)
+def OnDeferred():
+    return dfWait
+@inthread
+def OnThread(strValue):
+    lstDone.append(strValue)
+    raise ValueError(strValue)"""
+
+    def setUp(self):
+        BotTestCase.setUp(self)
+        self.mdBot = self.fnMakeBot(strScript = self.SCRIPT)
+        self.plgPlugin = self.fnPlugin(self.mdBot)
+        self.dicGlobals = self.plgPlugin.dicGlobals
+        # Keep the error reports off the console.
+        self.flStdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.flStdout
+        BotTestCase.tearDown(self)
+
+    def testGenerator(self):
+        self.plgPlugin.run("OnWait", ())
+        # The generator waits for the Deferred without holding up the call.
+        self.assertEqual(self.dicGlobals["lstDone"], [])
+        self.assertEqual(self.mdBot.intErrors, 0)
+        self.dicGlobals["dfWait"].callback("gold")
+        self.assertEqual(self.dicGlobals["lstDone"], ["gold"])
+        self.assertEqual(self.mdBot.intErrors, 1)
+        self.assertTrue("ValueError" in sys.stdout.getvalue())
+
+    def testDeferred(self):
+        self.plgPlugin.run("OnDeferred", ())
+        self.assertEqual(self.mdBot.intErrors, 0)
+        self.dicGlobals["dfWait"].errback(ValueError("late"))
+        self.assertEqual(self.mdBot.intErrors, 1)
+        self.assertTrue("late" in sys.stdout.getvalue())
+
+    def testThread(self):
+        lstCalls = []
+        def fnDeferToThread(fnFunction, *tplArguments):
+            # Run the function here, as the thread pool would.
+            lstCalls.append(tplArguments)
+            return defer.maybeDeferred(fnFunction, *tplArguments)
+        fnOriginal = muddrop.threads.deferToThread
+        muddrop.threads.deferToThread = fnDeferToThread
+        try:
+            self.plgPlugin.run("OnThread", ("silver",))
+        finally:
+            muddrop.threads.deferToThread = fnOriginal
+        self.assertEqual(lstCalls, [("silver",)])
+        self.assertEqual(self.dicGlobals["lstDone"], ["silver"])
+        self.assertEqual(self.mdBot.intErrors, 1)
+
+    def testReportFailure(self):
+        try:
+            raise KeyError("copper")
+        except KeyError:
+            flFailure = failure.Failure()
+        self.plgPlugin.reportfailure(flFailure)
+        self.assertEqual(self.mdBot.intErrors, 1)
+        self.assertTrue("copper" in sys.stdout.getvalue())
+
+class ScrollbackTest(unittest.TestCase):
+    def testLastLines(self):
+        sbScrollback = muddrop.Scrollback(100, 1000000)
+        for intLine in range(1000):
+            sbScrollback.fnAdd("line %d" % intLine)
+        lstLines = sbScrollback.fnGetLines()
+        self.assertTrue(100 <= sbScrollback.intLines <= 125)
+        self.assertEqual(lstLines, ["line %d" % intLine for intLine in range(900, 1000)])
+        self.assertEqual(sbScrollback.fnGetLines(3), ["line 997", "line 998", "line 999"])
+
+    def testByteLimit(self):
+        sbScrollback = muddrop.Scrollback(1000, 400)
+        for intLine in range(1000):
+            sbScrollback.fnAdd("%09d" % intLine)
+        self.assertTrue(400 <= sbScrollback.intBytes <= 500, sbScrollback.intBytes)
+        self.assertEqual(sbScrollback.fnGetLines(1), ["%09d" % 999])
+
+    def testDisabled(self):
+        sbScrollback = muddrop.Scrollback(0, 1000)
+        sbScrollback.fnAdd("line")
+        self.assertEqual(sbScrollback.fnGetLines(), [])
+
+class IndexedLogTest(BotTestCase):
+    def testSearch(self):
+        mdBot = self.fnMakeBot()
+        cnfConfiguration = mdBot.cnfConfiguration
+        cnfConfiguration.strLogFile = "log"
+        cnfConfiguration.intLogSegmentInterval = 3600
+        ilLog = muddrop.IndexedLog(mdBot)
+        fnTime = time.time
+        fltBase = int(fnTime()) / 3600 * 3600
+        lstNow = [fltBase]
+        muddrop.time.time = lambda: lstNow[0]
+        try:
+            for intBlock in range(5):
+                lstNow[0] = fltBase + intBlock * 10
+                ilLog.fnWrite("", "Bob tells you hello %d" % intBlock, "", strDirection = muddrop.IndexedLog.LOG_IN)
+                ilLog.fnWrite("", "You say goodbye", "", strDirection = muddrop.IndexedLog.LOG_OUT)
+                ilLog.fnFlush()
+        finally:
+            muddrop.time.time = fnTime
+        ilLog.fnClose()
+        strSegment = ilLog.strFilename
+        self.assertEqual(len(file(strSegment[:-3] + ".idx").readlines()), 5)
+        lstRecords = muddrop.fnSearchLog(strSegment, "tells you hel+o [13]")
+        self.assertEqual([strText for fltTime, strDirection, strText in lstRecords], ["Bob tells you hello 1", "Bob tells you hello 3"])
+        self.assertEqual(lstRecords[0][1], muddrop.IndexedLog.LOG_IN)
+        # The literal can start and end in the middle of words.
+        self.assertEqual(len(muddrop.fnSearchLog(strSegment, "ells you hel")), 5)
+        self.assertEqual(muddrop.fnSearchLog(strSegment, "farewell"), [])
+        lstRecords = muddrop.fnSearchLog(strSegment, "goodbye", fltBase + 10, fltBase + 30)
+        self.assertEqual([fltTime - fltBase for fltTime, strDirection, strText in lstRecords], [10, 20, 30])
+
+class StyleTrackerTest(unittest.TestCase):
+    def testApply(self):
+        trkStyle = muddrop.StyleTracker()
+        self.assertEqual(trkStyle.fnApply("1;33"), muddrop.StyleTracker.BOLD | 3)
+        self.assertEqual(trkStyle.fnApply("44"), muddrop.StyleTracker.BOLD | 3 | (4 << muddrop.StyleTracker.BACKGROUND_SHIFT))
+        self.assertEqual(trkStyle.fnApply("0;33"), 3)
+        # The arguments of 256 colour and RGB codes are skipped.
+        self.assertEqual(trkStyle.fnApply("38;5;196;4"), 3 | muddrop.StyleTracker.UNDERLINE)
+        self.assertEqual(trkStyle.fnApply("48;2;1;2;3;24;39"), 7)
+        self.assertEqual(trkStyle.fnApply("1;7"), muddrop.StyleTracker.BOLD | muddrop.StyleTracker.INVERSE | 7)
+        self.assertEqual(trkStyle.fnCodes(trkStyle.intStyle), [1, 7, 37, 40])
+        self.assertEqual(trkStyle.fnApply(""), muddrop.StyleTracker.DEFAULT)
+
+    def testParsedLine(self):
+        trkStyle = muddrop.StyleTracker()
+        strRaw = "\x1b[1;33mYou have\x1b[0m 12 \x1b[33mgold"
+        plLine = muddrop.ParsedLine(strRaw, muddrop.Formatting(), trkStyle)
+        self.assertEqual(plLine.strStripped, "You have 12 gold")
+        self.assertEqual(plLine.fnStyleAt(0), muddrop.StyleTracker.BOLD | 3)
+        self.assertEqual(plLine.fnStyleAt(8), muddrop.StyleTracker.DEFAULT)
+        self.assertEqual(plLine.fnStyleAt(12), 3)
+        self.assertEqual(strRaw[plLine.fnRawOffset(12):], "gold")
+        self.assertEqual(plLine.fnRawOffset(16), len(strRaw))
+        # The style carries over to the next line.
+        plLine = muddrop.ParsedLine("more", muddrop.Formatting(), trkStyle)
+        self.assertEqual(plLine.fnStyleAt(0), 3)
+
+class StyleMatchTest(BotTestCase):
+    def testBoldAndColour(self):
+        strTriggers = fnTrigger("gold", "bold gold", match_bold = "y", bold = "y", sequence = "1") + fnTrigger("gold", "not bold gold", match_bold = "y", bold = "n", sequence = "2") + fnTrigger("gold", "yellow gold", match_text_colour = "y", text_colour = "11", sequence = "3")
+        mdBot = self.fnMakeBot(strTriggers)
+        for strLine, lstSent in [
+                ("\x1b[1;33mYou have 12 gold", ["bold gold", "yellow gold"]),
+                ("\x1b[0;33mYou have 12 gold", ["not bold gold", "yellow gold"]),
+                # The style at the start of the match counts, whatever
+                # follows in the middle of it.
+                ("\x1b[0;33mgo\x1b[1;32mld", ["not bold gold", "yellow gold"]),
+                ("\x1b[1;32mgo\x1b[0;33mld", ["bold gold"]),
+                # The last line left the style at yellow.
+                ("some gold", ["not bold gold", "yellow gold"]),
+                ("\x1b[0mgold", ["not bold gold"])]:
+            mdBot.lstSent = []
+            mdBot.fnProcessData(strLine)
+            self.assertEqual(mdBot.lstSent, lstSent, repr(strLine))
+
+class OutputFilterTest(BotTestCase):
+    def setUp(self):
+        BotTestCase.setUp(self)
+        strTriggers = fnTrigger("^secret", omit_from_output = "y") + fnTrigger("^You have (\\d+) gold", rewrite = "Gold: %1") + fnTrigger("dragon", highlight = "1;31") + fnTrigger("^plain", "world.Note('noted')", send_to = "12")
+        self.mdBot = self.fnMakeBot(strTriggers, strAttributes = 'outputfilter="y" prompttimeout="5"')
+        self.trClient = self.fnAddClients(self.mdBot, 1)[0].transport
+        cnfConfiguration = self.mdBot.cnfConfiguration
+        self.ofFilter = muddrop.OutputFilter(self.mdBot, muddrop.LineFramer(cnfConfiguration.intMaxLineLength, cnfConfiguration.strCharset))
+
+    def tearDown(self):
+        self.ofFilter.fnStop()
+        BotTestCase.tearDown(self)
+
+    def fnFeed(self, strData):
+        self.ofFilter.fnFeed(strData)
+        strOutput = self.trClient.value()
+        self.trClient.clear()
+        return strOutput
+
+    def fnTimeout(self):
+        """Run the prompt timeout now."""
+        self.assertTrue(self.ofFilter.dcPrompt.active())
+        self.ofFilter.dcPrompt.cancel()
+        self.ofFilter.fnFlushPrompt()
+        strOutput = self.trClient.value()
+        self.trClient.clear()
+        return strOutput
+
+    def testGagRewriteAndHighlight(self):
+        strOutput = self.fnFeed("secret stuff\r\nYou have 12 gold\r\nA red dragon!\r\nplain\r\nthe end\r\n")
+        # The note goes after the line that caused it.
+        self.assertEqual(strOutput, "Gold: 12\r\nA red \x1b[1;31mdragon\x1b[0;37;40m!\r\nplain\r\nnoted\nthe end\r\n")
+        # The scrollback keeps what the clients saw of the lines.
+        self.assertEqual(self.mdBot.sbScrollback.fnGetLines(), ["Gold: 12", "A red \x1b[1;31mdragon\x1b[0;37;40m!", "plain", "the end"])
+
+    def testPromptTimeout(self):
+        self.assertEqual(self.fnFeed("HP: 10> "), "")
+        self.assertTrue(4 < self.ofFilter.dcPrompt.getTime() - time.time() <= 5)
+        self.assertEqual(self.fnTimeout(), "HP: 10> ")
+        # Only the rest of the line follows the prompt.
+        self.assertEqual(self.fnFeed("look\r\n"), "look\r\n")
+        self.assertEqual(self.ofFilter.dcPrompt, None)
+
+    def testPromptRewritten(self):
+        self.fnFeed("You have ")
+        self.assertEqual(self.fnTimeout(), "You have ")
+        self.assertEqual(self.fnFeed("5 gold\r\n"), "\r\nGold: 5\r\n")
+
+    def testPromptGagged(self):
+        self.fnFeed("secret")
+        self.assertEqual(self.fnTimeout(), "secret")
+        self.assertEqual(self.fnFeed(" thing\r\nnext\r\n"), "\r\nnext\r\n")
+
+class ReconnectTest(BotTestCase):
+    def setUp(self):
+        BotTestCase.setUp(self)
+        self.lstAttempts = []
+        self.objReactor = muddrop.reactor
+        self.clsConnection = muddrop.MUDConnection
+
+    def tearDown(self):
+        muddrop.reactor = self.objReactor
+        muddrop.MUDConnection = self.clsConnection
+        BotTestCase.tearDown(self)
+
+    def fnUseClock(self):
+        """Schedule on a clock of our own from now on, and make connections
+           that get nowhere."""
+        self.clkClock = task.Clock()
+        muddrop.reactor = self.clkClock
+        muddrop.MUDConnection = self.fnConnect
+
+    def fnConnect(self, mdBot, strHost, intPort):
+        self.lstAttempts.append(self.clkClock.seconds())
+        return muddrop.ReplayConnection()
+
+    def fnFail(self, mdBot):
+        """Let the connection fail, and return the seconds until the next
+           attempt, or None if there is none."""
+        mdBot.cntConnection = None
+        intAttempts = len(self.lstAttempts)
+        fltFailed = self.clkClock.seconds()
+        mdBot.fnConnectionEnded()
+        while self.clkClock.getDelayedCalls() and len(self.lstAttempts) == intAttempts:
+            self.clkClock.advance(min([dcCall.getTime() for dcCall in self.clkClock.getDelayedCalls()]) - self.clkClock.seconds())
+        if len(self.lstAttempts) == intAttempts:
+            return None
+        return self.lstAttempts[-1] - fltFailed
+
+    def testBackoff(self):
+        mdBot = self.fnMakeBot(strAttributes = 'reconnect="y" reconnectattempts="6" reconnectdelay="1" reconnectbackoff="2" reconnectmaxdelay="10" reconnectjitter="0.25"')
+        self.fnAddClients(mdBot, 1)
+        self.fnUseClock()
+        lstDelays = [self.fnFail(mdBot) for intAttempt in range(6)]
+        for fltDelay, fltBase in zip(lstDelays, (1, 2, 4, 8, 10, 10)):
+            self.assertTrue(fltBase * 0.75 <= fltDelay <= fltBase * 1.25, lstDelays)
+        # The clients stay connected while there are attempts left.
+        self.assertTrue(mdBot.cntClientConnection != None)
+        self.assertEqual(self.fnFail(mdBot), None)
+        self.assertEqual(len(self.lstAttempts), 6)
+        self.assertEqual(mdBot.cntClientConnection, None)
+        self.assertTrue(mdBot.blnExited)
+
+    def testNoJitter(self):
+        mdBot = self.fnMakeBot(strAttributes = 'reconnect="y" reconnectdelay="3" reconnectbackoff="3" reconnectmaxdelay="50" reconnectjitter="0"')
+        self.fnUseClock()
+        self.assertEqual([self.fnFail(mdBot) for intAttempt in range(5)], [3, 9, 27, 50, 50])
+        # A connection that is made starts the delays over.
+        mdBot.OnConnect()
+        self.assertEqual(self.fnFail(mdBot), 3)
+
+    def testDisabled(self):
+        mdBot = self.fnMakeBot()
+        self.fnUseClock()
+        self.assertEqual(self.fnFail(mdBot), None)
+        self.assertTrue(mdBot.blnExited)
+
+class MetricsTest(BotTestCase):
+    def setUp(self):
+        BotTestCase.setUp(self)
+        self.objReactor = muddrop.reactor
+        self.mdBob = self.fnMakeBot()
+        self.mdBob.cnfConfiguration.strName = 'Bob "the\\rat"'
+        self.mdJose = self.fnMakeBot()
+        self.mdJose.cnfConfiguration.strName = u"Jos\xe9"
+        smSessions = muddrop.SessionManager(None)
+        smSessions.lstSessions = [self.mdBob, self.mdJose]
+        # Listen and measure the lag on a reactor that goes nowhere.
+        muddrop.reactor = proto_helpers.MemoryReactorClock()
+        self.mtMetrics = muddrop.Metrics(smSessions, "tcp:9100:interface=127.0.0.1")
+
+    def tearDown(self):
+        muddrop.reactor = self.objReactor
+        BotTestCase.tearDown(self)
+
+    def fnSamples(self, strName):
+        """Return the lines of a metric's samples."""
+        return [strLine for strLine in self.mtMetrics.fnRender().split("\n") if strLine.startswith(strName + "{")]
+
+    def testRender(self):
+        self.assertEqual(muddrop.reactor.tcpServers[0][0], 9100)
+        self.mdBob.stConnectionState = muddrop.AC_CONNECTED
+        self.mdBob.cqQueue.lstLanes[muddrop.CommandQueue.LANE_BOT].extend([("north", False, 0.0), ("south", False, 0.0)])
+        self.mdJose.cqQueue.lstLanes[muddrop.CommandQueue.LANE_CLIENT].append(("look", False, 0.0))
+        strBob = 'character="Bob \\"the\\\\rat\\""'
+        strJose = 'character="Jos\xc3\xa9"'
+        self.assertTrue("muddrop_sessions 2" in self.mtMetrics.fnRender().split("\n"))
+        self.assertEqual(self.fnSamples("muddrop_queue_depth"), [
+            'muddrop_queue_depth{%s,lane="client"} 0' % strBob,
+            'muddrop_queue_depth{%s,lane="bot"} 2' % strBob,
+            'muddrop_queue_depth{%s,lane="client"} 1' % strJose,
+            'muddrop_queue_depth{%s,lane="bot"} 0' % strJose])
+        # Exactly one state is set for each session.
+        self.assertEqual(self.fnSamples("muddrop_connection_state"), [
+            'muddrop_connection_state{%s,state="disconnected"} 0' % strBob,
+            'muddrop_connection_state{%s,state="connecting"} 0' % strBob,
+            'muddrop_connection_state{%s,state="connected"} 1' % strBob,
+            'muddrop_connection_state{%s,state="disconnected"} 1' % strJose,
+            'muddrop_connection_state{%s,state="connecting"} 0' % strJose,
+            'muddrop_connection_state{%s,state="connected"} 0' % strJose])
+        self.assertEqual(self.fnSamples("muddrop_lines_sent_total"), ['muddrop_lines_sent_total{%s} 0' % strBob, 'muddrop_lines_sent_total{%s} 0' % strJose])
+
+if __name__ == "__main__":
+    unittest.main()